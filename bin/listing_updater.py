@@ -25,6 +25,7 @@ from collections import defaultdict
 from ew.util import daemon, standard_doc_path
 from ew.internal_decs.inbox_item_panel import InboxItemPanel as IP
 from ew.internal_decs import INBOX_DOC_ID, TEMPLATES_DOC_ID, templates_document, inbox_document
+from ew.memphis.catalog import catalog_for_subdir
 import sys, os, pickle, types, threading
 
 logger = ew_logging.getLogger('daemon.listing_updater')
@@ -172,7 +173,8 @@ class ListingsUpdater(daemon.Daemon):
         self.templates_open = bool;
 
     def set_up_server(self):
-        self.server = comms.create_threaded_server(comms.LISTINGS_UPDATER_PORT)
+        self.server = comms.create_threaded_server(
+                comms.LISTINGS_UPDATER_PORT, listen=comms.LISTEN_BOTH)
 
         #sync telling me about items added or removed on tablet from server
         self.server.register_function(self.added_document)
@@ -314,6 +316,7 @@ class ListingsUpdater(daemon.Daemon):
     
     def added_document(self, docid):
         """Handle the addition of a new document"""
+        self.update_catalog('inbox', 'update', docid)
         try:
             self.inbox().add_document(docid)
         except:
@@ -323,6 +326,7 @@ class ListingsUpdater(daemon.Daemon):
     def removed_document(self, docid):
         """Handle the removal of a document"""
         self.record_delete(docid)
+        self.update_catalog('inbox', 'remove', docid)
         try:
             self.inbox().remove_document(docid)
         except:
@@ -344,14 +348,23 @@ class ListingsUpdater(daemon.Daemon):
     def changed_document_status(self, doc_id, new_status):
         """Handle document status change"""
         logger.debug('Attempting to change status(%s) <= %s', doc_id, new_status)
+        self.update_catalog('inbox', 'set_status', doc_id, new_status)
         try:
             self.inbox().change_document_status(doc_id, new_status)
         except:
             logger.exception('changed_document_status(%s,%s) failed',
                              doc_id, new_status)
                 
+    def update_catalog(self, subdir, action, *args):
+        """Apply an incremental change to the document catalog of subdir"""
+        try:
+            getattr(catalog_for_subdir(subdir), action)(*args)
+        except:
+            logger.exception('catalog %s%s for %s failed', action, args, subdir)
+
     def added_template(self, template_id):
         """Handle addition of template"""
+        self.update_catalog('templates', 'update', template_id)
         try:
             self.templates().add_template(template_id)
         except:
@@ -360,6 +373,7 @@ class ListingsUpdater(daemon.Daemon):
             
     def removed_template(self, template_id):
         """Handle template removal"""
+        self.update_catalog('templates', 'remove', template_id)
         try:
             self.templates().remove_template(template_id)
         except:
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Prints the XML-RPC call statistics of running tablet processes: for each
+method, the calls and errors, latency percentiles and mean payload sizes,
+of the calls the process served and of those it made. See
+'rpc_stats.py --help' for usage.
+"""
+
+import pprint
+import socket
+from optparse import OptionParser
+from ew.util import comms
+
+SERVERS = dict(launcher=comms.LAUNCHER_PORT,
+               listing_updater=comms.LISTINGS_UPDATER_PORT,
+               sync=comms.SYNC_PORT, dec=comms.DEC_PORT)
+
+SORT_KEYS = {
+    'time': lambda (method, s): -s['calls'] * s['latency']['mean'],
+    'calls': lambda (method, s): -s['calls'],
+    'p99': lambda (method, s): -s['latency']['p99'],
+    'name': lambda (method, s): method,
+}
+
+usage = """%prog [options] [server...]
+
+where server is one of """ + ', '.join(sorted(SERVERS)) + """, or a port
+number. The default is launcher and listing_updater."""
+
+def print_methods(title, methods, sort):
+    print '  %s' % title
+    if not methods:
+        print '    no calls'
+        return
+    print '    %-44s %6s %5s %7s %7s %7s %7s %7s %7s' % ('method', 'calls',
+            'errs', 'p50ms', 'p95ms', 'p99ms', 'maxms', 'req B', 'resp B')
+    for method, stats in sorted(methods.iteritems(), key=SORT_KEYS[sort]):
+        latency = stats['latency']
+        calls = stats['calls'] or 1
+        print '    %-44s %6d %5d %7.1f %7.1f %7.1f %7.1f %7d %7d' % (
+                method[-44:], stats['calls'], stats['errors'],
+                latency['p50'] * 1000, latency['p95'] * 1000,
+                latency['p99'] * 1000, latency['max'] * 1000,
+                stats['request_bytes'] // calls,
+                stats['response_bytes'] // calls)
+
+def print_stats(name, stats, sort):
+    print '%s (pid %d)' % (name, stats['pid'])
+    for pool in stats['pools']:
+        print ('  workers %(workers)d, busy %(busy)d, queued %(queued)d, '
+               'idle connections %(idle)d, rejected %(rejected)d' % pool)
+    print_methods('served', stats['server'], sort)
+    print_methods('called', stats['client'], sort)
+
+if __name__ == '__main__':
+    parser = OptionParser(usage=usage)
+    parser.add_option('-s', '--sort', choices=sorted(SORT_KEYS),
+            default='time', help='order of the methods: time (the '
+            'default, total time spent), calls, p99 or name')
+    parser.add_option('-r', '--raw', action='store_true',
+            help='print the __stats__ dicts as they are')
+    options, args = parser.parse_args()
+    for name in args or ['launcher', 'listing_updater']:
+        port = SERVERS.get(name) or int(name)
+        client = comms.create_local_client(port, 'localhost')
+        try:
+            stats = getattr(client, '__stats__')()
+        except socket.error, e:
+            print '%s: not answering on port %d (%s)' % (name, port, e)
+            continue
+        if options.raw:
+            print name
+            pprint.pprint(stats)
+        else:
+            print_stats(name, stats, options.sort)
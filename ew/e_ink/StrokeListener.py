@@ -69,6 +69,7 @@ ON_FUEL_GAUGE_CHANGE_EVENT_TYPE = 13
 # PARTIAL_STROKE_EVENT_TYPE = 4
 # STROKE_FILE_READY_EVENT_TYPE = 5
 
+import select
 import socket
 import sys
 import struct
@@ -84,6 +85,8 @@ logger = ew_logging.getLogger('ew.e_ink.StrokeListener')
 endian = '!'
 uint = endian + 'I'
 uint2 = endian + 'II'
+STROKE_HEADER = struct.Struct(endian + 'IHHH')  # cmd, frame, status, npts
+SAMPLE_POINT_LEN = struct.calcsize(endian + 'HH')
 
 class StrokeListener:
     """
@@ -223,9 +226,20 @@ class StrokeListener:
         # out where we are, whereas with DGRAM you know you are
         # getting a stroke from the beginning.
 
-        self.data = ''
+        self.reset_buffer()
+
+    def reset_buffer(self):
+        """
+        Drop any data received but not parsed yet.
+
+        Data is received into the preallocated bytearray self.buf; the
+        unparsed part is self.buf[self.start_pos:self.end_pos]. Parsing
+        advances start_pos rather than slicing off what it has read.
+        """
+        self.buf = bytearray(2 * BUFF_SIZE)
+        self.view = memoryview(self.buf)
+        self.start_pos = self.end_pos = 0
         self.data_needed = self.event_cmd_len
-        # self.data_needed = self.stroke_header_len
 
 
     def old_strokes(self):
@@ -258,48 +272,83 @@ class StrokeListener:
             print "StrokeListener.stop(): socket closed()"
         logger.debug("StrokeListener.stop(): socket closed()")
 
+    def buffered(self):
+        """Number of bytes received but not parsed yet"""
+        return self.end_pos - self.start_pos
+
+    def unread_data(self):
+        """The bytes received but not parsed yet, as a string"""
+        return self.view[self.start_pos:self.end_pos].tobytes()
+
+    def make_room(self):
+        """
+        Move the unparsed data to the front of the buffer, so that a
+        whole datagram fits after it.
+        """
+        start, end = self.start_pos, self.end_pos
+        n = end - start
+        if n + BUFF_SIZE > len(self.buf):
+            buf = bytearray(n + 2 * BUFF_SIZE)
+            buf[:n] = self.buf[start:end]
+            self.buf, self.view = buf, memoryview(buf)
+        elif n:
+            self.buf[:n] = self.buf[start:end]
+        self.start_pos, self.end_pos = 0, n
+
+    def consume(self, count):
+        """Mark count bytes at start_pos as parsed"""
+        self.start_pos += count
+        if self.start_pos == self.end_pos:
+            self.start_pos = self.end_pos = 0
+
     def read_more_data(self, needed):
         """
-        Read from socket if we have less than amount of data needed
+        Read from socket if we have less than amount of data needed.
+        Returns the number of bytes available, or None if a non-blocking
+        socket had nothing to read.
         """
         # logger.debug('StrokeListener.read_more_data(%d), needed)
-        tmp_data = None
-        n = len(self.data)
-        if needed > n:
-            # if self.verbose: print "Ready to read from socket..."
-            try:
-                # Maximum DGRAM size is 64K
-                # (64K - 8)/4 = 16,382 points in a stoke
-                tmp_data, _ = self.socket.recvfrom(BUFF_SIZE)
-                logger.debug(
-                        'Data received by read_more_data (%s bytes): %s',
-                        len(tmp_data),
-                        ' '.join(
-                          ''.join("%02x" % ord(c) for c in tmp_data[i:i + 4])
-                            for i in xrange(0, len(tmp_data), 4)))
-            # except socket.timeout, ex  # Handle timeout?
-            except socket.error, ex:
-                # 'Resource temporarily unavailable
-                if (not self.blocking) and ex.args[0] == 11:
-                    if n > 0:
-                        logger.warn('StrokeListener.read_more_data(): '
-                                     'needed %s, only read %s', needed, n)
-                    return None
-                raise socket.error(ex)
-        if not tmp_data:
+        n = self.end_pos - self.start_pos
+        if needed <= n:
+            return n
+        if len(self.buf) - self.end_pos < BUFF_SIZE:
+            self.make_room()
+        # if self.verbose: print "Ready to read from socket..."
+        try:
+            # Maximum DGRAM size is 64K
+            # (64K - 8)/4 = 16,382 points in a stoke
+            count = self.socket.recv_into(self.view[self.end_pos:], BUFF_SIZE)
+        # except socket.timeout, ex  # Handle timeout?
+        except socket.error, ex:
+            # 'Resource temporarily unavailable
+            if (not self.blocking) and ex.args[0] == 11:
+                if n > 0:
+                    logger.warn('StrokeListener.read_more_data(): '
+                                 'needed %s, only read %s', needed, n)
+                return None
+            raise socket.error(ex)
+        if not count:
             return n
-        len_temp_data = len(tmp_data)
-        if self.verbose: print "Read %d bytes from socket" % len_temp_data
-        logger.verbose("Read %d bytes from socket", len_temp_data)
-        self.data += tmp_data
-        return len_temp_data
+        if logger.isEnabledFor(logging.DEBUG):
+            data = self.view[self.end_pos:self.end_pos + count].tobytes()
+            logger.debug(
+                    'Data received by read_more_data (%s bytes): %s',
+                    count,
+                    ' '.join(
+                      ''.join("%02x" % ord(c) for c in data[i:i + 4])
+                        for i in xrange(0, count, 4)))
+        if self.verbose: print "Read %d bytes from socket" % count
+        logger.verbose("Read %d bytes from socket", count)
+        self.end_pos += count
+        return n + count
 
     def read_event_type(self):
-        if (len(self.data) < self.event_cmd_len):
+        if (self.buffered() < self.event_cmd_len):
             # logger.debug('StrokeListener.read_event_type(None)')
             return None
         else:
-            etype = struct.unpack(self.event_cmd_fmt, self.data[:self.event_cmd_len])[0]
+            etype = struct.unpack_from(self.event_cmd_fmt, self.buf,
+                                       self.start_pos)[0]
             logger.debug('StrokeListener.read_event_type(etype: %d)', etype)
             return etype
 
@@ -406,9 +455,9 @@ class StrokeListener:
                 print msg
             # return None
             raise Exception(msg) # only one chance to read DGRAM socket
-        d = self.data[:len]
-        self.data = self.data[len:]
-        return struct.unpack(fmt, d)
+        values = struct.unpack_from(fmt, self.buf, self.start_pos)
+        self.consume(len)
+        return values
 
     def call_handler(self, method_name, *args):
         """Call an event handler."""
@@ -562,39 +611,35 @@ class StrokeListener:
         to the display server to draw the stroke again.
         """
         logger.debug('StrokeListener.read_stroke(%s)', isPartial)
-        stroke_header_fmt = endian + 'IHHH'
-        stroke_header_len = struct.calcsize(stroke_header_fmt)
-        sample_point_fmt = endian + 'HH'
-        sample_point_len = struct.calcsize(sample_point_fmt)
+        stroke_header_len = STROKE_HEADER.size
         self.read_more_data(self.data_needed)
-        n = len(self.data)
+        start = self.start_pos
+        n = self.end_pos - start
         if (n < stroke_header_len) or (n < self.data_needed):
+            msg = "Not enough data (%d), want min(%d,%d)" % (
+                n, stroke_header_len, self.data_needed)
             if self.verbose:
-                print "Not enough data (%d), want min(%d,%d)" % (
-                    n, stroke_header_len, self.data_needed)
-            logger.debug("Not enough data (%d), want min(%d,%d)",
-                    n, stroke_header_len, self.data_needed)
+                print msg
+            logger.debug(msg)
             # return None
             raise Exception(msg) # only one chance to read DGRAM socket
-        scmdHaveStroke, frame, status, npts = struct.unpack(
-            stroke_header_fmt, self.data[:stroke_header_len])
+        scmdHaveStroke, frame, status, npts = STROKE_HEADER.unpack_from(
+            self.buf, start)
         if self.verbose:
             print 'shs: %d\nframe: %d\nstatus: %d\nnpts: %d' % (
                 scmdHaveStroke, frame, status, npts)
         logger.debug('shs: %d, frame: %d, status: %d, npts: %d',
                 scmdHaveStroke, frame, status, npts)
-        size = stroke_header_len + npts * sample_point_len
+        size = stroke_header_len + npts * SAMPLE_POINT_LEN
         if n < size:
             self.data_needed = size
             # return None
             # only one chance to read DGRAM socket
             raise Exception("Not enough data for all points in stroke")
-        points = []
-        p = stroke_header_len
-        for i in xrange(npts):
-            points.append(struct.unpack(sample_point_fmt,
-                                        self.data[p:p + sample_point_len]))
-            p += sample_point_len
+        # all the x, y coordinates in one call, then paired up
+        coords = iter(struct.unpack_from('%c%dH' % (endian, 2 * npts),
+                                         self.buf, start + stroke_header_len))
+        points = zip(coords, coords)
         if self.discard_first_point:
             points = points[1:]
         if self.discard_negative_points:
@@ -603,8 +648,8 @@ class StrokeListener:
             print "  " + ' '.join(['(%d,%d)' % i for i in points])
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug("  " + ' '.join(['(%d,%d)' % i for i in points]))
-        save_data = self.data[:p]
-        self.data = self.data[p:]
+        save_data = self.view[start:start + size].tobytes()
+        self.consume(size)
         self.data_needed = stroke_header_len
         # frame is an index (identifier) for the stroke
         if isPartial:      # if partial stroke set the appropriate status flag bit
@@ -638,6 +683,28 @@ class StrokeListener:
             if sleep:
                 time.sleep(sleep)
 
+    def register(self, reactor, callback=None):
+        """
+        Read events on reactor, an ew.util.reactor.Reactor, instead of
+        polling in loop: callback is called like loop's with each stroke,
+        on the reactor thread. Makes the socket non-blocking.
+        """
+        def on_readable(sock):
+            while True:
+                data = self.read_event_data()
+                if data is None:
+                    return
+                eventType, event = data
+                if eventType == ON_STROKE_EVENT_TYPE and callback:
+                    callback(*event)
+        self.blocking = False
+        self.socket.setblocking(False)
+        reactor.register(self.socket, on_readable)
+
+    def unregister(self, reactor):
+        if self.socket:
+            reactor.unregister(self.socket)
+
     def selectloop(self):
         '''just for testing'''
         while 1:
@@ -683,7 +750,6 @@ class TestPrint(object):
             print str(pt)
 
 if __name__ == "__main__":
-    import select
     if 'select' in sys.argv[1:]:
         myListener = TestPrint()
         sl = StrokeListener(verbose=True, eventListener=myListener, start=True)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+
+"""
+Uniform grid spatial index over stroke segments and area rectangles.
+
+Strokes uses a StrokeGrid to find the strokes an eraser stroke may touch,
+and an AreaGrid to find the areas a stroke may be labelled with, so both
+cost in proportion to what is near a stroke rather than to all the ink on
+the page.
+"""
+
+def cell_range(size, x0, y0, x1, y1):
+    """yields the (column, row) of the cells of side size that the box
+    x0, y0, x1, y1 touches"""
+    for cx in xrange(int(x0 // size), int(x1 // size) + 1):
+        for cy in xrange(int(y0 // size), int(y1 // size) + 1):
+            yield cx, cy
+
+class StrokeGrid(object):
+    """
+    Index of the segment bounding boxes of strokes, by grid cell.
+
+    Each cell maps to a list of (stroke index, x0, y0, x1, y1) for the
+    segments whose box touches the cell. Strokes are added as they arrive
+    and removed when erased.
+    """
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.stroke_cells = {}  # stroke index -> cells holding its segments
+
+    def clear(self):
+        self.cells.clear()
+        self.stroke_cells.clear()
+
+    def add(self, index, geometry):
+        """Index the segments of stroke index, whose StrokeGeometry is
+        geometry."""
+        cells = self.cells
+        touched = self.stroke_cells.setdefault(index, set())
+        for x0, y0, x1, y1 in geometry.iter_segment_boxes():
+            segment = (index, x0, y0, x1, y1)
+            for cell in cell_range(self.cell_size, x0, y0, x1, y1):
+                cells.setdefault(cell, []).append(segment)
+                touched.add(cell)
+
+    def remove(self, index):
+        """Drop stroke index from the index, if it is there."""
+        cells = self.cells
+        for cell in self.stroke_cells.pop(index, ()):
+            kept = [s for s in cells[cell] if s[0] != index]
+            if kept:
+                cells[cell] = kept
+            else:
+                del cells[cell]
+
+    def strokes_touching(self, geometry, threshold=0, limit=None):
+        """
+        Return the set of indices of strokes with a segment whose bounding
+        box, grown by threshold, overlaps that of a segment of geometry;
+        only indices below limit if it is given. This is the test of
+        Strokes.stroke_intersects.
+        """
+        cells = self.cells
+        t = threshold
+        found = set()
+        for ix0, iy0, ix1, iy1 in geometry.iter_segment_boxes():
+            for cell in cell_range(self.cell_size,
+                                   ix0 - t, iy0 - t, ix1 + t, iy1 + t):
+                for index, jx0, jy0, jx1, jy1 in cells.get(cell, ()):
+                    if index in found or (limit is not None and
+                                          index >= limit):
+                        continue
+                    if ix1 < jx0 - t or ix0 > jx1 + t or \
+                       iy1 < jy0 - t or iy0 > jy1 + t:
+                        continue
+                    found.add(index)
+        return found
+
+RECT_KEYS = ('tight', 'loose', 'intersects')
+
+class AreaGrid(object):
+    """
+    Index of the areas of Strokes.label_strokes by the cells their
+    'tight', 'loose' and 'intersects' rectangles cover. Areas with none
+    of those may match anywhere and are always candidates.
+    """
+    def __init__(self, areas, cell_size):
+        self.areas = areas
+        self.signature = self.signature_of(areas)
+        self.cell_size = cell_size
+        self.cells = {}
+        self.anywhere = []
+        for j, a in enumerate(areas):
+            rects = [a[k] for k in RECT_KEYS if a.get(k)]
+            if not (a.has_key('tight') or a.has_key('loose') or
+                    a.has_key('intersects')):
+                self.anywhere.append(j)
+            for (x0, y0), (x1, y1) in rects:
+                for cell in cell_range(self.cell_size, x0, y0, x1, y1):
+                    self.cells.setdefault(cell, set()).add(j)
+
+    @staticmethod
+    def signature_of(areas):
+        """The area dicts and their rectangles, to notice changes"""
+        return [(id(a), a.get('tight'), a.get('loose'), a.get('intersects'))
+                for a in areas]
+
+    def is_for(self, areas):
+        return areas is self.areas and \
+               self.signature == self.signature_of(areas)
+
+    def candidates(self, xmin, ymin, xmax, ymax):
+        """Sorted indices of the areas a stroke with this bounding box may
+        be labelled with."""
+        found = set(self.anywhere)
+        cells = self.cells
+        for cell in cell_range(self.cell_size, xmin, ymin, xmax, ymax):
+            found.update(cells.get(cell, ()))
+        return sorted(found)
@@ -16,10 +16,14 @@ import os
 import sys
 
 from ew.util import ew_logging
+from ew.util.stroke_geometry import (StrokeGeometry, geometry_of,
+        segments_overlap, any_point_in_rect, point_in_rect)
+from stroke_grid import StrokeGrid, AreaGrid
 
 logger = ew_logging.getLogger('ew.e_ink.strokes')
 
 ptu_tsscale = 16  # default is 16
+GRID_CELL = 32    # side of spatial index cells, in EDO pixels
 
 def set_ptu_tsscale(n=None):
     """
@@ -119,6 +123,11 @@ class Strokes:
 
     self.live_strokes is a list of strokes.
     self.live_strokes[-1]['strokes'] is the list of points in the stroke.
+    self.live_strokes[-1]['geometry'] is its StrokeGeometry.
+
+    Strokes added by get_stroke are kept in a spatial index, self.grid, that
+    match_for_erase and label_strokes query; code that replaces entries of
+    self.live_strokes should keep it up to date with self.grid.remove.
 
     This object has a fileno() method, so it can be used
     with select.select and select.poll.
@@ -158,6 +167,9 @@ class Strokes:
         """
         self.live_strokes = []
         self.already_grouped = 0
+        self.grid = StrokeGrid(GRID_CELL * ptu_tsscale)
+        self._indexed = 0   # len(self.live_strokes) as of the last get_stroke
+        self._area_grid = None
 
     def fileno(self):
         """
@@ -189,11 +201,9 @@ class Strokes:
             return None
         cur = {}
         cur['strokes'] = strokes
-        cur['xmin'] = min([i[0] for i in strokes])
-        cur['xmax'] = max([i[0] for i in strokes])
+        cur['geometry'] = geometry = StrokeGeometry(strokes)
+        cur['xmin'], cur['ymin'], cur['xmax'], cur['ymax'] = geometry.bbox()
         cur['xcenter'] = (cur['xmin'] + cur['xmax']) / 2
-        cur['ymin'] = min([i[1] for i in strokes])
-        cur['ymax'] = max([i[1] for i in strokes])
         cur['ycenter'] = (cur['ymin'] + cur['ymax']) / 2
         cur['time'] = self.last_stroke_time
         cur['frame'] = frame
@@ -202,7 +212,9 @@ class Strokes:
             cur['pen'] = (status & 0x01) != 0
             cur['eraser'] = (status & 0x02) != 0
             cur['stylus'] = (status & 0x04) != 0
+        self.grid.add(len(self.live_strokes), geometry)
         self.live_strokes.append(cur)
+        self._indexed = len(self.live_strokes)
         return cur
 
     def is_erase(self, stroke):
@@ -214,13 +226,26 @@ class Strokes:
         Find other_strokes that intersect with erase_stroke.
         A threshold is used so that strokes do not have to
         intersect exactly.
+
+        When other_strokes are the leading entries of self.live_strokes,
+        as erase_with_other_end_of_pen passes them, only the strokes the
+        spatial index finds near erase_stroke are considered.
         """
         global ptu_tsscale
-        _ = erase_stroke['strokes']
+        threshold = 5*ptu_tsscale
+        live = self.live_strokes
+        n = len(other_strokes)
+        if len(live) == self._indexed and n <= len(live) and \
+                (not n or other_strokes[n-1] is live[n-1]):
+            near = self.grid.strokes_touching(geometry_of(erase_stroke),
+                                              threshold, limit=n)
+            return [(index2, other_strokes[index2]) for index2 in
+                    sorted(near) if other_strokes[index2] is live[index2]
+                    and other_strokes[index2]]
         rval = []
         for index2, j in enumerate(other_strokes):
             if j and self.stroke_intersects(erase_stroke, j,
-                                            threshold=5*ptu_tsscale):
+                                            threshold=threshold):
                 rval.append((index2, j))
         return rval
 
@@ -251,8 +276,10 @@ class Strokes:
                 i, self.live_strokes[:index1+start]):
                 eink_sparkle.erase(j['frame'], j['frame'])
                 self.live_strokes[index2] = None
+                self.grid.remove(index2)
             eink_sparkle.erase(i['frame'], i['frame'])
             self.live_strokes[index1+start] = None
+            self.grid.remove(index1+start)
 
     def label_strokes(self, start, areas):
         """
@@ -272,7 +299,12 @@ class Strokes:
 
         See also group_strokes for more dict items.
         This should be called after get_stroke() and before group_strokes().
+        Only the areas whose rectangles are near a stroke, found with a
+        spatial index of the areas, are checked against it.
         """
+        if not (self._area_grid and self._area_grid.is_for(areas)):
+            self._area_grid = AreaGrid(areas, GRID_CELL * ptu_tsscale)
+        candidates = self._area_grid.candidates
 
         for i in self.live_strokes[start:]:
             if not i:
@@ -281,11 +313,12 @@ class Strokes:
             xmax = i['xmax']
             ymin = i['ymin']
             ymax = i['ymax']
-            points = i['strokes']
+            points = geometry_of(i)
             dx = xmax - xmin
             dy = ymax - ymin
             i['areas'] = []
-            for j, a in enumerate(areas):
+            for j in candidates(xmin, ymin, xmax, ymax):
+                a = areas[j]
 
                 # end of stylus or stylus button
                 pen_flag = False
@@ -327,19 +360,14 @@ class Strokes:
     def intersects(self, points, rect):
         """
         Does any on the points in a stroke intersect a rectangle?
+        points is a list of points or a StrokeGeometry.
         """
         if not rect:
             return False
         xy0, xy1 = rect
         x0, y0 = xy0
         x1, y1 = xy1
-        for px,py in points:
-            if (px < x0): continue
-            if (px > x1): continue
-            if (py < y0): continue
-            if (py > y1): continue
-            return True
-        return False
+        return any_point_in_rect(geometry_of(points), x0, y0, x1, y1)
 
     def bb_intersects(self, stroke1, stroke2, **opts):
         """
@@ -367,30 +395,8 @@ class Strokes:
         """
         if not self.bb_intersects(stroke1, stroke2, **opts):
             return False
-        points1 = stroke1['strokes']
-        points2 = stroke2['strokes']
-        t = opts.get('threshold', 0)
-        for i in range(len(points1)-1):
-            ix0, iy0 = points1[i]
-            ix1, iy1 = points1[i+1]
-            if ix0 > ix1: ix0, ix1 = ix1, ix0
-            if iy0 > iy1: iy0, iy1 = iy1, iy0
-            for j in range(len(points2)-1):
-                jx0, jy0 = points2[j]
-                jx1, jy1 = points2[j+1]
-                if jx0 > jx1: jx0, jx1 = jx1, jx0
-                if jy0 > jy1: jy0, jy1 = jy1, jy0
-                flag = True
-                if ix1 < jx0 - t:
-                    flag = False ; continue
-                if ix0 > jx1 + t:
-                    flag = False ; continue
-                if iy1 < jy0 - t:
-                    flag = False ; continue
-                if iy0 > jy1 + t: flag = False
-                if flag:
-                    return True
-        return False
+        return segments_overlap(geometry_of(stroke1), geometry_of(stroke2),
+                                opts.get('threshold', 0))
 
     def in_rect(self, xmin, ymin, xmax, ymax, rect, **opts):
         """
@@ -423,11 +429,8 @@ class Strokes:
           threshold=0  >0 for looser, <0 for tighter
         """
         t = opts.get('threshold', 0)
-        if x < stroke_dict['xmin']+t: return False
-        if x > stroke_dict['xmax']-t: return False
-        if y < stroke_dict['ymin']+t: return False
-        if y > stroke_dict['ymax']-t: return False
-        return True
+        return point_in_rect(x, y, stroke_dict['xmin']+t, stroke_dict['ymin']+t,
+                             stroke_dict['xmax']-t, stroke_dict['ymax']-t)
 
     def group_strokes(self):
         """
@@ -536,8 +539,9 @@ class Strokes:
             if self.verbose: print "Center", xc, yc
             quadrant_list = []
             dist_list = []
-            for x, y in [s1['strokes'][0], s1['strokes'][-1],
-                         s2['strokes'][0], s2['strokes'][-1]]:
+            g1, g2 = geometry_of(s1), geometry_of(s2)
+            for x, y in [g1.point(0), g1.point(-1),
+                         g2.point(0), g2.point(-1)]:
                 a = 0
                 if x > xc:
                     a += 1
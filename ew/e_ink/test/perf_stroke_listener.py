@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Performance timing of StrokeListener stroke parsing.
+
+Replays stroke datagrams, one of 16000 points (near the most a 64K
+datagram holds) and a run of short ones, through a StrokeListener on a
+fake socket, against the string buffer and per-point unpacking it
+replaced.
+"""
+
+import struct, sys
+import ew.e_ink.StrokeListener
+from ew.util.perf_timing import PerfTiming
+
+sl = sys.modules['ew.e_ink.StrokeListener']
+
+def stroke_datagram(frame, npts):
+    coords = []
+    for n in xrange(npts):
+        coords.extend((n % 1000, (7 * n) % 1000))
+    return struct.pack('!IHHH%dH' % len(coords), sl.ON_STROKE_EVENT_TYPE,
+                       frame, 1, npts, *coords)
+
+LONG_STROKE = [stroke_datagram(1, 16000)]
+SHORT_STROKES = [stroke_datagram(n, 40) for n in xrange(2000)]
+
+class ReplaySocket(object):
+    def __init__(self, datagrams):
+        self.datagrams = datagrams
+        self.next = 0
+
+    def recv_into(self, buffer, nbytes=0):
+        data = self.datagrams[self.next]
+        self.next += 1
+        buffer[:len(data)] = data
+        return len(data)
+
+    def recvfrom(self, size):
+        data = self.datagrams[self.next]
+        self.next += 1
+        return data, None
+
+    def close(self):
+        pass
+
+# The code before the bytearray buffer ================================
+
+class LegacyListener(sl.StrokeListener):
+    def reset_buffer(self):
+        self.data = ''
+        self.data_needed = self.event_cmd_len
+
+    def read_more_data(self, needed):
+        tmp_data = None
+        n = len(self.data)
+        if needed > n:
+            tmp_data, _ = self.socket.recvfrom(sl.BUFF_SIZE)
+            # built whether or not DEBUG is on, as the old code did
+            ' '.join(''.join("%02x" % ord(c) for c in tmp_data[i:i + 4])
+                     for i in xrange(0, len(tmp_data), 4))
+        if not tmp_data:
+            return n
+        self.data += tmp_data
+        return len(tmp_data)
+
+    def read_event_type(self):
+        if (len(self.data) < self.event_cmd_len):
+            return None
+        return struct.unpack(self.event_cmd_fmt,
+                             self.data[:self.event_cmd_len])[0]
+
+    def read_stroke(self, isPartial):
+        stroke_header_fmt = '!IHHH'
+        stroke_header_len = struct.calcsize(stroke_header_fmt)
+        sample_point_fmt = '!HH'
+        sample_point_len = struct.calcsize(sample_point_fmt)
+        self.read_more_data(self.data_needed)
+        scmdHaveStroke, frame, status, npts = struct.unpack(
+            stroke_header_fmt, self.data[:stroke_header_len])
+        points = []
+        p = stroke_header_len
+        for i in xrange(npts):
+            points.append(struct.unpack(sample_point_fmt,
+                                        self.data[p:p + sample_point_len]))
+            p += sample_point_len
+        save_data = self.data[:p]
+        self.data = self.data[p:]
+        self.data_needed = stroke_header_len
+        return frame, scmdHaveStroke, status, npts, points, save_data
+
+def replay(cls, datagrams):
+    listener = cls(start=False)
+    listener.socket = ReplaySocket(datagrams)
+    listener.reset_buffer()
+    return [listener.get_stroke() for d in datagrams]
+
+def check():
+    for datagrams in LONG_STROKE, SHORT_STROKES:
+        assert replay(sl.StrokeListener, datagrams) == \
+               replay(LegacyListener, datagrams)
+
+def test_long_stroke():
+    """one 16000 point stroke, bytearray buffer"""
+    replay(sl.StrokeListener, LONG_STROKE)
+
+def test_long_stroke_legacy():
+    """one 16000 point stroke, string buffer"""
+    replay(LegacyListener, LONG_STROKE)
+
+def test_short_strokes():
+    """2000 strokes of 40 points, bytearray buffer"""
+    replay(sl.StrokeListener, SHORT_STROKES)
+
+def test_short_strokes_legacy():
+    """2000 strokes of 40 points, string buffer"""
+    replay(LegacyListener, SHORT_STROKES)
+
+if __name__ == "__main__":
+    check()
+    perf = PerfTiming()
+    perf.add(test_long_stroke, test_long_stroke_legacy, test_short_strokes,
+             test_short_strokes_legacy)
+    perf.main()
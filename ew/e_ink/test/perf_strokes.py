@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Performance timing of the stroke geometry kernel.
+
+Builds a synthetic page of 5000 strokes and times bounding boxes, eraser
+matching (stroke_intersects against every stroke) and area point tests,
+with the kernel in ew.util.stroke_geometry (NumPy if installed) against
+the per-point tuple code it replaced.
+"""
+
+import random
+from ew.e_ink import strokes
+from ew.util import stroke_geometry
+from ew.util.stroke_geometry import StrokeGeometry
+from ew.util.perf_timing import PerfTiming
+
+STROKES = 5000
+ERASERS = 20
+
+def random_points(rnd):
+    scale = strokes.get_ptu_tsscale()
+    x, y = rnd.randrange(825 * scale), rnd.randrange(1200 * scale)
+    points = []
+    for n in xrange(rnd.randrange(5, 60)):
+        x += rnd.randrange(-8, 9) * scale
+        y += rnd.randrange(-8, 9) * scale
+        points.append((x, y))
+    return points
+
+rnd = random.Random(11)
+PAGE = [random_points(rnd) for n in xrange(STROKES)]
+ERASER_POINTS = [random_points(rnd) for n in xrange(ERASERS)]
+RECT = strokes.rotate_to_ts2(((300, 300), (600, 900)))
+
+class PageStrokes(strokes.Strokes):
+    def __init__(self):
+        self.verbose = False
+        self.erase()
+
+    def __del__(self):
+        pass
+
+def stroke_dict(points):
+    geometry = StrokeGeometry(points)
+    xmin, ymin, xmax, ymax = geometry.bbox()
+    return dict(strokes=points, geometry=geometry, xmin=xmin, xmax=xmax,
+                ymin=ymin, ymax=ymax)
+
+PAGE_DICTS = [stroke_dict(p) for p in PAGE]
+ERASER_DICTS = [stroke_dict(p) for p in ERASER_POINTS]
+
+# The code before the kernel ==========================================
+
+def legacy_bbox(strokes):
+    return (min([i[0] for i in strokes]), max([i[0] for i in strokes]),
+            min([i[1] for i in strokes]), max([i[1] for i in strokes]))
+
+def legacy_stroke_intersects(self, stroke1, stroke2, **opts):
+    if not self.bb_intersects(stroke1, stroke2, **opts):
+        return False
+    points1 = stroke1['strokes']
+    points2 = stroke2['strokes']
+    t = opts.get('threshold', 0)
+    for i in range(len(points1)-1):
+        ix0, iy0 = points1[i]
+        ix1, iy1 = points1[i+1]
+        if ix0 > ix1: ix0, ix1 = ix1, ix0
+        if iy0 > iy1: iy0, iy1 = iy1, iy0
+        for j in range(len(points2)-1):
+            jx0, jy0 = points2[j]
+            jx1, jy1 = points2[j+1]
+            if jx0 > jx1: jx0, jx1 = jx1, jx0
+            if jy0 > jy1: jy0, jy1 = jy1, jy0
+            if ix1 < jx0 - t: continue
+            if ix0 > jx1 + t: continue
+            if iy1 < jy0 - t: continue
+            if iy0 > jy1 + t: continue
+            return True
+    return False
+
+def legacy_intersects(points, rect):
+    (x0, y0), (x1, y1) = rect
+    for px, py in points:
+        if (px < x0): continue
+        if (px > x1): continue
+        if (py < y0): continue
+        if (py > y1): continue
+        return True
+    return False
+
+# Tests ===============================================================
+
+def erase_matches(intersects):
+    s = PageStrokes()
+    t = 5 * strokes.get_ptu_tsscale()
+    return [[n for n, j in enumerate(PAGE_DICTS) if intersects(s, e, j,
+             threshold=t)] for e in ERASER_DICTS]
+
+def check():
+    assert erase_matches(strokes.Strokes.stroke_intersects.im_func) == \
+           erase_matches(legacy_stroke_intersects)
+    s = PageStrokes()
+    assert [s.intersects(d['geometry'], RECT) for d in PAGE_DICTS] == \
+           [legacy_intersects(p, RECT) for p in PAGE]
+
+def test_bbox():
+    """bounding boxes of 5000 strokes, StrokeGeometry"""
+    for points in PAGE:
+        StrokeGeometry(points).bbox()
+
+def test_bbox_legacy():
+    """bounding boxes of 5000 strokes, four list passes"""
+    for points in PAGE:
+        legacy_bbox(points)
+
+def test_erase_match():
+    """20 erasers against 5000 strokes, kernel"""
+    erase_matches(strokes.Strokes.stroke_intersects.im_func)
+
+def test_erase_match_legacy():
+    """20 erasers against 5000 strokes, per-point tuples"""
+    erase_matches(legacy_stroke_intersects)
+
+def test_in_area():
+    """5000 strokes against an 'intersects' area, kernel"""
+    s = PageStrokes()
+    for d in PAGE_DICTS:
+        s.intersects(d['geometry'], RECT)
+
+def test_in_area_legacy():
+    """5000 strokes against an 'intersects' area, per-point tuples"""
+    for points in PAGE:
+        legacy_intersects(points, RECT)
+
+if __name__ == "__main__":
+    print 'NumPy kernel' if stroke_geometry.NUMPY_EXISTS else 'Python kernel'
+    check()
+    perf = PerfTiming()
+    perf.add(test_bbox, test_bbox_legacy, test_erase_match,
+             test_erase_match_legacy, test_in_area, test_in_area_legacy)
+    perf.main()
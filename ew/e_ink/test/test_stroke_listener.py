@@ -0,0 +1,119 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import socket, struct, sys, unittest
+import ew.e_ink.StrokeListener
+from ew.util.reactor import Reactor
+# the package exports the class under the module's name
+sl = sys.modules['ew.e_ink.StrokeListener']
+
+class ReplaySocket(object):
+    """Stands in for the pen tracking socket, returning datagrams in turn"""
+    def __init__(self, datagrams):
+        self.datagrams = list(datagrams)
+
+    def recv_into(self, buffer, nbytes=0):
+        data = self.datagrams.pop(0)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        pass
+
+class Recorder(object):
+    def __init__(self):
+        self.calls = []
+
+    def onStrokeCapture(self, *args):
+        self.calls.append(('onStrokeCapture',) + args)
+
+    def onPageStop(self, *args):
+        self.calls.append(('onPageStop',) + args)
+
+def stroke_datagram(frame, status, points):
+    coords = [c for p in points for c in p]
+    return struct.pack('!IHHH%dH' % len(coords), sl.ON_STROKE_EVENT_TYPE,
+                       frame, status, len(points), *coords)
+
+def page_datagram(page_id):
+    return struct.pack('!II%ds' % len(page_id), sl.ON_PAGE_EVENT_TYPE,
+                       len(page_id), page_id)
+
+def listener(datagrams, **options):
+    listener = sl.StrokeListener(start=False, **options)
+    listener.socket = ReplaySocket(datagrams)
+    listener.reset_buffer()
+    return listener
+
+class TestStrokeListener(unittest.TestCase):
+    def test_stroke(self):
+        points = [(x, 2 * x + 1) for x in range(100)]
+        recorder = Recorder()
+        datagram = stroke_datagram(7, 1, points)
+        l = listener([datagram], eventListener=recorder)
+        self.assertEqual(l.get_stroke(),
+                         (7, sl.ON_STROKE_EVENT_TYPE, 1, 100, points, datagram))
+        self.assertEqual(recorder.calls,
+                         [('onStrokeCapture', 7, 1, points, datagram)])
+        self.assertEqual(l.buffered(), 0)
+
+    def test_long_stroke(self):
+        points = [(x % 65536, 65535 - x % 65536) for x in range(16000)]
+        l = listener([stroke_datagram(1, 1, points)])
+        self.assertEqual(l.get_stroke()[4], points)
+
+    def test_events_in_sequence(self):
+        recorder = Recorder()
+        l = listener([page_datagram('page-1'),
+                      stroke_datagram(1, 1, [(1, 2)]),
+                      stroke_datagram(2, 2, [(3, 4), (5, 6)])],
+                     eventListener=recorder, discard_first_point=True)
+        self.assertEqual(l.get_stroke()[4], [])
+        self.assertEqual(l.get_stroke()[4], [(5, 6)])
+        self.assertEqual([c[0] for c in recorder.calls],
+                         ['onPageStop', 'onStrokeCapture', 'onStrokeCapture'])
+        self.assertEqual(recorder.calls[0], ('onPageStop', 'page-1'))
+
+    def test_events_in_one_read(self):
+        """Several events received at once, as from a stream socket"""
+        first, second = stroke_datagram(1, 1, [(1, 2)]), page_datagram('p')
+        l = listener([first + second])
+        self.assertEqual(l.get_stroke()[5], first)
+        self.assertEqual(l.unread_data(), second)
+        self.assertEqual(l.read_event_data(), (sl.ON_PAGE_EVENT_TYPE,
+                                               (sl.ON_PAGE_EVENT_TYPE, 'p')))
+
+    def test_make_room(self):
+        l = listener([])
+        data = 'x' * 1000
+        l.buf[-1000:] = data
+        l.start_pos, l.end_pos = len(l.buf) - 1000, len(l.buf)
+        l.make_room()
+        self.assertEqual((l.start_pos, l.end_pos), (0, 1000))
+        self.assertEqual(l.unread_data(), data)
+        self.assertTrue(len(l.buf) - l.end_pos >= sl.BUFF_SIZE)
+
+    def test_short_stroke(self):
+        l = listener([stroke_datagram(1, 1, [(1, 2), (3, 4)])[:-2]])
+        self.assertRaises(Exception, l.get_stroke)
+
+    def test_reactor(self):
+        sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        reactor = Reactor('test-reactor')
+        strokes = []
+        try:
+            l = listener([])
+            l.socket = receiver
+            l.register(reactor, lambda *stroke: strokes.append(stroke[4]))
+            for data in (stroke_datagram(1, 1, [(1, 2)]), page_datagram('p'),
+                         stroke_datagram(2, 1, [(3, 4)])):
+                sender.send(data)
+            reactor.run_once(1)
+            self.assertEqual(strokes, [[(1, 2)], [(3, 4)]])
+            l.unregister(reactor)
+        finally:
+            reactor.close()
+            sender.close()
+            receiver.close()
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStrokeListener)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,81 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import random, unittest
+from ew.e_ink import strokes
+
+class PageStrokes(strokes.Strokes):
+    """Strokes without the pen tracking connections"""
+    def __init__(self):
+        self.verbose = False
+        self.last_stroke_time = 0
+        self.erase()
+
+    def __del__(self):
+        pass
+
+class AllAreas(object):
+    """Stands in for the area index, offering every area"""
+    def __init__(self, areas):
+        self.areas = areas
+
+    def is_for(self, areas):
+        return True
+
+    def candidates(self, *bbox):
+        return range(len(self.areas))
+
+def random_stroke(rnd, frame, eraser=False):
+    scale = strokes.get_ptu_tsscale()
+    x, y = rnd.randrange(825 * scale), rnd.randrange(1200 * scale)
+    points = []
+    for n in range(rnd.randrange(1, 30)):
+        x += rnd.randrange(-8, 9) * scale
+        y += rnd.randrange(-8, 9) * scale
+        points.append((x, y))
+    return frame, 0, 0x02 if eraser else 0x01, 0, points, ''
+
+class TestStrokeIndex(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(5)
+        self.strokes = PageStrokes()
+        for frame in range(1500):
+            self.strokes.get_stroke(random_stroke(self.rnd, frame))
+
+    def test_match_for_erase(self):
+        s = self.strokes
+        live = s.live_strokes
+        for n in range(0, len(live), 7):
+            s.grid.remove(n)
+            live[n] = None
+        for frame in range(1500, 1600):
+            eraser = s.get_stroke(random_stroke(self.rnd, frame, eraser=True))
+            if not eraser:
+                continue
+            prior = live[:-1]
+            found = s.match_for_erase(eraser, prior)
+            expected = [(i, j) for i, j in enumerate(prior) if j and
+                        s.stroke_intersects(eraser, j, threshold=5 *
+                                            strokes.get_ptu_tsscale())]
+            self.assertEqual(found, expected)
+            # strokes that are not live ones are matched without the index
+            self.assertEqual(found, s.match_for_erase(eraser,
+                    [j and dict(j) for j in prior]))
+
+    def test_label_strokes(self):
+        s = self.strokes
+        xy = strokes.rotate_to_ts2
+        areas = [dict(tight=xy(((0, 0), (412, 512)))),
+                 dict(loose=xy(((300, 300), (600, 900))), pen=True),
+                 dict(intersects=xy(((100, 700), (200, 800)))),
+                 dict(tight=xy(((412, 512), (825, 1024))), maxsize=(900, 900)),
+                 dict(minsize=(100, 100))]
+        s.label_strokes(0, areas)
+        labels = [[k[:2] for k in i['areas']] for i in s.live_strokes]
+        self.assertTrue([l for l in labels if l])
+        s._area_grid = AllAreas(areas)
+        s.label_strokes(0, areas)
+        self.assertEqual(labels,
+                         [[k[:2] for k in i['areas']] for i in s.live_strokes])
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStrokeIndex)
+    unittest.TextTestRunner(verbosity=2).run(suite)
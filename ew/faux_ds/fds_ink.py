@@ -1,5 +1,6 @@
 # Copyright 2011 Ricoh Innovations, Inc.
 import time
+from ew.util.stroke_geometry import StrokeGeometry
 Default_Pressure = 1
 
 class FDSInk:
@@ -11,15 +12,21 @@ class FDSInk:
                 timestamp = time.time()
 
     class Stroke:
+        """The points of a stroke, held in a StrokeGeometry, all at
+        Default_Pressure"""
         def __init__(self, index, points):
-            self._nodes = []
             self._index = index
-            for p in points:
-                self._nodes.append(self.InkNode(p))
+            self.geometry = StrokeGeometry(points)
 
         def add_points(self, points):
-            for p in points:
-                self._nodes.append(self.InkNode(p))
+            self.geometry.extend(points)
+
+        def bbox(self):
+            return self.geometry.bbox()
+
+        def nodes(self):
+            """the points as InkNodes"""
+            return [FDSInk.InkNode(p) for p in self.geometry.points()]
 
     def __init__(self, window):
         self._index = 0
@@ -29,5 +36,5 @@ class FDSInk:
     def add_stroke(self, points):
         self._index += 1
         stroke = self.Stroke(self._index, points)
-        self._strokes.append(stroke)
+        self.strokes.append(stroke)
         return stroke
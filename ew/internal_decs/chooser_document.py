@@ -13,8 +13,7 @@ from sdk.document import Document
 from sdk.delegate import Dec
 from sdk.display_window import pending_gui
 from ew.util import standard_doc_path, locate, docid_from_path, comms, ew_logging
-from ew.util import system_config as sysconfig
-from ew.memphis.file import MemphisFile
+from ew.memphis.catalog import catalog_for_subdir
 import threading, os, time, itertools
 
 logger = ew_logging.getLogger("ew.internal_decs.chooser_document")
@@ -106,17 +105,8 @@ class ChooserDocument(Document):
                         not w.is_downloading()])
         logger.debug('refresh.doc_widgets: %s', self.doc_widgets)
         logger.debug('refresh.known docids in gui: %s', known)
-        directory = os.path.join(sysconfig.data_home, self._subdir)
-
-        def doc_title(memphis_path):
-            path = os.path.join(directory, memphis_path)
-            logger.debug('getting info from memphis doc @%s', path)
-            with MemphisFile(path) as mf:
-                title = mf.metadata.get('memphis.title', None)
-            return title
-            
-        memphis_docs = dict([(docid_from_path(x), doc_title(x)) for x in os.listdir(directory) \
-                    if x.endswith('.memphis')])
+        memphis_docs = dict([(docid, entry['title']) for docid, entry in
+                             self.catalog().entries().iteritems()])
         docs = set(memphis_docs.keys())
         logger.debug('refresh.docs: %s', docs)
         changes = docs != known
@@ -153,10 +143,8 @@ class ChooserDocument(Document):
         return (self.doc_widgets[where] if where != None  else None), where
 
     def check_initial_state(self):
-        directory = os.path.join(sysconfig.data_home, self._subdir)
         known = self.widget_index.keys()
-        docs = [docid_from_path(x) for x in os.listdir(directory) \
-                    if x.endswith('.memphis')]
+        docs = self.catalog().entries().keys()
         logger.debug('found documents: %s, known: %s', docs, known)
         missing = (doc_id for doc_id in docs if doc_id not in known)
 
@@ -186,6 +174,10 @@ class ChooserDocument(Document):
             index = len(self.doc_widgets)
         return index
 
+    def catalog(self):
+        """The DocumentCatalog of the directory I choose from"""
+        return catalog_for_subdir(self._subdir)
+
     def listings_updater(self):
         with self._instance_lock:
             if not self._listings_updater_client:
@@ -227,9 +219,12 @@ class ChooserDocument(Document):
         file system file date and title from the memphis file info"""
         logger.debug("creating chooser_item_info for %s", path)
         docid = docid_from_path(path)
-        with MemphisFile(path) as mfile:
-            title = mfile.info.get('memphis.title', docid)
-        mod = time.strftime('%Y/%m/%d', time.localtime(os.path.getmtime(path)))
+        entry = self.catalog().get(docid) or self.catalog().update(docid)
+        if entry:
+            title, mtime = entry['title'], entry['mod_time']
+        else:
+            title, mtime = docid, os.path.getmtime(path)
+        mod = time.strftime('%Y/%m/%d', time.localtime(mtime))
         return dict(id = docid, mod_date = mod, title = title)
 
     def add_item(self, item_info):
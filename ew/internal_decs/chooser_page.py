@@ -180,8 +180,9 @@ class ChooserPage(DocumentPage):
 
     def update_using_memphis(self):
         found_changes = False
+        entries = self._document.catalog().entries()
         for widget,_ in self.chooser_panes:
-            if widget.update_from_memphis():
+            if widget.update_from_memphis(entries):
                 found_changes = True
         if found_changes or self._gui.has_changed():
             self._gui.process_changes()
@@ -5,9 +5,9 @@ author: Samantha Atkins
 """
 from sdk.display_constants import SZ_1X_MULTIPLIER as ratio
 from sdk.widgets.panel import Panel
-import time, os
-from ew.util import ew_logging, standard_doc_path
-from ew.memphis.file import MemphisFile
+import time
+from ew.util import ew_logging
+from ew.memphis.catalog import catalog_for_subdir
 logger = ew_logging.getLogger('ew.internal_decs.chooser_panel')
 
 HEADER_VSIZE = 55
@@ -88,20 +88,20 @@ class ChooserPanel(Panel):
         Panel.set_from_dict(self, data)
         self.set_fields(data)
 
-    def update_from_memphis(self):
+    def update_from_memphis(self, entries=None):
         return False
 
-    def title_and_error(self, docid):
+    def title_and_error(self, docid, entries=None):
+        """title and error status of docid from its catalog entry; entries
+        are the catalog entries if the caller has them loaded already"""
         mtitle, error = self.title, None
         if not self.is_downloading():
-            path = standard_doc_path(docid)
-            if os.path.exists(path):
-                with MemphisFile(standard_doc_path(docid)) as mf:
-                    mtitle = mf.metadata.get('memphis.title', None)
-                    if not mtitle:
-                        logger.debug('!!!!%s missing normal title', self)
-                        mtitle = mf.info.get('memphis.title', docid)
-                    error = mf.info.get("memphis.delivery.errorstatus", None)
+            if entries is None:
+                entry = catalog_for_subdir().get(docid)
+            else:
+                entry = entries.get(docid)
+            if entry:
+                mtitle, error = entry['title'], entry['error_status']
         return mtitle, error
 
     def set_fields(self, data):
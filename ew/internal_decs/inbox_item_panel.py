@@ -111,8 +111,8 @@ class InboxPanelWithSelect(ChooserPanel):
     def error_status(self):
         return self.inner.error_status()
 
-    def update_from_memphis(self):
-        return self.inner.update_from_memphis()
+    def update_from_memphis(self, entries=None):
+        return self.inner.update_from_memphis(entries)
 
     def set_downloading(self, boolean):
         self.inner.set_downloading(boolean)
@@ -183,8 +183,8 @@ class InboxItemPanel(ChooserPanel):
             _, estatus = self.title_and_error(self.doc_id)
         return estatus
 
-    def update_from_memphis(self):
-        mtitle, error = self.title_and_error(self.doc_id)
+    def update_from_memphis(self, entries=None):
+        mtitle, error = self.title_and_error(self.doc_id, entries)
         changes = False
         if mtitle != self.title:
             changes = True
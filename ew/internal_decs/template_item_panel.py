@@ -45,8 +45,8 @@ class TemplateItemPanel(ChooserPanel):
     def gui(self, name):
         return self.guis()[name]
 
-    def update_from_memphis(self):
-        mtitle, error = self.title_and_error(self.doc_id)
+    def update_from_memphis(self, entries=None):
+        mtitle, error = self.title_and_error(self.doc_id, entries)
         changes = False
         if mtitle != self.title:
             changes = True
@@ -44,7 +44,7 @@ class TemplatesDocument(ChooserDocument):
 
     def instantiate_template(self, widget):
         def get_title(path, doc_id):
-            with mfile.MemphisFile(path) as mf:
+            with mfile.MemphisFile(path, lazy=True) as mf:
                 title = mf.metadata.get('memphis.title', None)
                 if not title:
                     title = doc_id
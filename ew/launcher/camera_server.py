@@ -94,23 +94,27 @@ function_for_0_arg_event = {
 
 
 camera_file = None
+camera_socket = None
 lock = threading.Lock()
 
 
 def ensure_camera_socket(local_socket_address):
     """Create the camera socket if not already created."""
-    global camera_file
+    global camera_file, camera_socket
     retry_max = 5
     retry_count = 0
     while retry_count < retry_max:
         try:
             with lock:
                 if camera_file is None:
-                    camera_socket = socket.socket(socket.AF_UNIX, 
+                    sock = socket.socket(socket.AF_UNIX, 
                             socket.SOCK_STREAM)
                     addr = local_socket_address or CAMERA_SOCKET
-                    camera_socket.connect(addr)
-                    camera_file = camera_socket.makefile()
+                    sock.connect(addr)
+                    # unbuffered, so no event waits in a read buffer
+                    # unseen by a reactor polling the socket
+                    camera_file = sock.makefile('r+b', 0)
+                    camera_socket = sock
                     logger.debug('Camera server connected via socket %r', addr)
         except Exception, e:
             logger.error("Failed to connect to camera server.. retrying.") 
@@ -205,32 +209,69 @@ class CameraListener(object):
                 return
 
             # Loop to read event messages.
-            while 1:
-                message = event_message.read_from_stream(camera_file)
-                if message is None:
-                    break
-                event_code = message.op_code
-                options = message.options.options_int
-                request_id = message.request_id
-
-                # Dispatch "on_have_image" event.
-                if event_code == CAM_STATUS_HAVE_IMAGE:
-                    func = getattr(self.listener, 'on_have_image', None)
-                    if func:
-                        image_path = message.char_args[0]
-                        func(options, request_id, image_path)
-                else:
-
-                    # Handle several common events that fit a specific
-                    # signature. See table "function_for_0_arg_event"
-                    # in this module for event names.
-                    func_name = function_for_0_arg_event.get(event_code)
-                    if func_name:
-                        func = getattr(self.listener, func_name, None)
-                        if func:
-                            func(options, request_id)
-                    else:
-                        logger.warn('Unknown event ID received: %r', event_code)
+            while self.read_event():
+                pass
         except:
             logger.exception('Error in camera listener')
         logger.error('End of file on camera server event stream.')
+
+    def register(self, reactor):
+        """Read events on reactor, an ew.util.reactor.Reactor, instead of
+        in run. Listener methods are called on the worker thread of the
+        reactor. Returns False if the camera server is not there."""
+        try:
+            ensure_camera_socket(self.local_socket_address)
+        except Exception, e:
+            logger.error("Camera event listener failed"
+                    " to connect to the server: %r", e)
+            return False
+        self.reactor = reactor
+        reactor.register(camera_socket, self._on_readable)
+        return True
+
+    def _on_readable(self, sock):
+        """Reactor handler: a message is arriving"""
+        try:
+            message = event_message.read_from_stream(camera_file)
+        except:
+            logger.exception('Error in camera listener')
+            message = None
+        if message is None:
+            self.reactor.unregister(sock)
+            logger.error('End of file on camera server event stream.')
+        else:
+            self.reactor.run_in_worker(self.dispatch, message)
+
+    def read_event(self):
+        """Read one event message and invoke its listener method. Returns
+        False at the end of the stream."""
+        message = event_message.read_from_stream(camera_file)
+        if message is None:
+            return False
+        self.dispatch(message)
+        return True
+
+    def dispatch(self, message):
+        """Invoke the listener method for an event message."""
+        event_code = message.op_code
+        options = message.options.options_int
+        request_id = message.request_id
+
+        # Dispatch "on_have_image" event.
+        if event_code == CAM_STATUS_HAVE_IMAGE:
+            func = getattr(self.listener, 'on_have_image', None)
+            if func:
+                image_path = message.char_args[0]
+                func(options, request_id, image_path)
+        else:
+
+            # Handle several common events that fit a specific
+            # signature. See table "function_for_0_arg_event"
+            # in this module for event names.
+            func_name = function_for_0_arg_event.get(event_code)
+            if func_name:
+                func = getattr(self.listener, func_name, None)
+                if func:
+                    func(options, request_id)
+            else:
+                logger.warn('Unknown event ID received: %r', event_code)
@@ -12,10 +12,11 @@ if API_GEN_EXPERIMENT:
 
 #import atexit
 import random
-from struct import pack, calcsize
-import threading, pdb, types
+import threading, pdb, time, types
 
 from ew import e_ink
+from ew.util.ew_binary_message import EwBinaryMessage
+from ew.util.latency_histogram import LatencyHistogram
 import ew.util.ew_logging
 import logging  # Must be imported *after* ew_logging.
 
@@ -42,7 +43,7 @@ def perhaps_wait(method):
             kwargs['request_id'] = wait_event.request_id
         retval = method(self, *args, **kwargs)
         if wait:
-            self._wait.wait_for(wait_event)
+            self._wait_for(wait_event)
         return retval
 
     return wait_wrapped
@@ -56,70 +57,371 @@ def no_unicode(method):
     return wrapped
 
 
-lock = threading.Lock()
+# Precompiled message encoders by (int arg count, char arg count).
+_encoder = EwBinaryMessage(magic_number=0x131C014E, endian='@').encoder
 
 interface_testing = False
 
 
 # The "wait" facility.
 #
+class DSRequest(object):
+    """The completion of a display server request sent with a request ID.
+
+    "error" holds the error code the display server reported, None for
+    success, or DSWait.TERMINATED if the wait was abandoned.
+
+    """
+
+    class Timeout(Exception):
+        """Raised when a request does not complete in time."""
+
+    def __init__(self, wait, func_name, request_id, timeout=None):
+        self._wait = wait
+        self.func_name = func_name
+        self.request_id = request_id
+        self.error = None
+        self.start = time.time()
+        self.deadline = self.start + timeout if timeout else None
+        self.completed = False
+        self.timed_out = False
+
+    def done(self):
+        return self.completed or self.timed_out
+
+    def result(self, timeout=None):
+        """Waits for the request and returns its error code.
+        Raises DSRequest.Timeout if the request's own timeout expires, or
+        if it is not done within "timeout" seconds.
+
+        """
+        self._wait.wait_all([self], timeout)
+        return self.error
+
+    def __repr__(self):
+        return '<DSRequest %s %d %s>' % (self.func_name, self.request_id,
+                'done' if self.completed else
+                'timed out' if self.timed_out else 'pending')
+
+
 class DSWait:
+    """Request IDs and completion tracking for display server requests.
+
+    IDs are 16 bit. An ID is not reused while a request holding it is
+    pending, and a request stops holding its ID when it completes or its
+    timeout expires. The time from sending to completion is recorded in a
+    LatencyHistogram per operation.
+
+    """
+
+    TERMINATED = 999
+    SWEEP_SIZE = 64     # look for expired requests when this many pending
+
     def __init__(self):
-        self._id = self.id_generator()
+        self._next_id = random.randint(1, 0xffff)
         self._waiting_events = {}
         self._lock = threading.Lock()
+        self._completion = threading.Condition(self._lock)
+        self.latency = {}   # func name -> LatencyHistogram
+
+    def _allocate_id(self):
+        # Called with self._lock held.
+        if len(self._waiting_events) >= 0xffff:
+            raise RuntimeError('All display server request IDs are pending')
+        request_id = self._next_id
+        while request_id in self._waiting_events:
+            request_id = request_id % 0xffff + 1
+        self._next_id = request_id % 0xffff + 1
+        return request_id
+
+    def _expire(self, requests, now):
+        # Called with self._lock held.
+        for request in requests:
+            if (request.deadline and now >= request.deadline
+                    and not request.done()):
+                request.timed_out = True
+                self._waiting_events.pop(request.request_id, None)
+                logger.info('Display server request %s %d timed out',
+                        request.func_name, request.request_id)
+
+    def prewait(self, func_name, timeout=None):
+        """Performs start of function tasks for wait option.
+        Returns a DSRequest with a free request ID. If timeout is given the
+        request expires that many seconds from now.
 
-    def id_generator(self):
-        next = random.randint(1, 0xffff)
-        while 1:
-             yield next
-             next = (next + 1) & 0xffff
-             if not next: next = 1
-
-    def prewait(self, func_name):
-        """Performs start of function tasks for wait option."""
-        def make_event():
-            event = threading.Event()
-            event.func_name = func_name
-            event.error = None
-            event.request_id = self._id.next()
-            return event
+        """
         with self._lock:
-            event = make_event()
-            self._waiting_events[event.request_id] = event
+            if len(self._waiting_events) >= self.SWEEP_SIZE:
+                self._expire(self._waiting_events.values(), time.time())
+            request = DSRequest(self, func_name, self._allocate_id(), timeout)
+            self._waiting_events[request.request_id] = request
         logger.debug('Calling: %s with generated request ID: %s',
-                func_name, event.request_id)
-        return event
+                func_name, request.request_id)
+        return request
+
+    def wait_for(self, event, timeout=None):
+        """Performs end of function tasks for wait option.
+        Returns the error code of the DSRequest "event"; see
+        DSRequest.result.
 
-    def wait_for(self, event):
-        """Performs end of function tasks for wait option."""
+        """
         logger.debug('Waiting for: %s, request ID: %s', event.func_name, event.request_id)
-        event.wait()
-        with lock:
-            self._waiting_events.pop(event.request_id)
+        error = event.result(timeout)
         logger.debug('Returned after wait: %s, request ID: %r, error: %r',
                 event.func_name, event.request_id, event.error)
-        return event.error
+        return error
+
+    def wait_all(self, requests, timeout=None):
+        """Waits until all the requests are done, and returns their error
+        codes. Raises DSRequest.Timeout if any of them expires, or if they
+        are not all done within "timeout" seconds.
+
+        """
+        self._wait_until(lambda: all(r.done() for r in requests),
+                         requests, timeout)
+        expired = [r for r in requests if r.timed_out]
+        if expired:
+            raise DSRequest.Timeout('Display server requests timed out: %s'
+                                    % expired)
+        return [r.error for r in requests]
+
+    def wait_any(self, requests, timeout=None):
+        """Waits until at least one of the requests is done, completed or
+        expired, and returns the list of those that are.
+        Raises DSRequest.Timeout if none is done within "timeout" seconds.
+
+        """
+        self._wait_until(lambda: any(r.done() for r in requests),
+                         requests, timeout)
+        return [r for r in requests if r.done()]
+
+    def _wait_until(self, predicate, requests, timeout):
+        end = time.time() + timeout if timeout is not None else None
+        with self._completion:
+            while True:
+                now = time.time()
+                self._expire(requests, now)
+                if predicate():
+                    return
+                if end is not None and now >= end:
+                    raise DSRequest.Timeout(
+                            'Display server requests not done in %ss: %s' %
+                            (timeout, requests))
+                deadlines = [r.deadline for r in requests
+                             if r.deadline and not r.done()]
+                if end is not None:
+                    deadlines.append(end)
+                self._completion.wait(
+                        min(deadlines) - now if deadlines else None)
 
     def notify_event(self, request_id, error=None):
         """
         Notifies a function call waiting on the specified request ID that
         its completion event has arrived.
         """
-        with lock:
-            event = self._waiting_events[request_id]
-            if event:
-                event.error = error
-                event.set()
-            else:
+        with self._lock:
+            request = self._waiting_events.pop(request_id, None)
+            if request is None:
                 logger.info("Did not find a waiting event on request_id %d", request_id)
+                return
+            request.error = error
+            request.completed = True
+            histogram = self.latency.get(request.func_name)
+            if histogram is None:
+                histogram = self.latency[request.func_name] = \
+                        LatencyHistogram()
+            histogram.add(time.time() - request.start)
+            self._completion.notifyAll()
+
+    def latency_stats(self):
+        """Returns a dict of operation name -> latency histogram dict."""
+        with self._lock:
+            return dict((name, histogram.as_dict())
+                        for name, histogram in self.latency.iteritems())
 
     def terminate_all_waiting_events(self):
         logger.debug('Terminating all waiting events')
-        for event in self._waiting_events.values():
-            event.error = 999
-            event.set()
-        self._waiting_events = {}
+        with self._lock:
+            for request in self._waiting_events.values():
+                request.error = self.TERMINATED
+                request.completed = True
+            self._waiting_events = {}
+            self._completion.notifyAll()
+
+
+# The "batch" facility.
+#
+class DSBatch(object):
+    """Holds back the display server messages sent by one thread until the
+    end of a "with sender.batch():" block, then sends them as one burst.
+
+    Consecutive update_region_of_page / update_region_of_infobar calls for
+    the same page (or the infobar), source image, options and source offset
+    are merged: duplicate and overlapping rectangles become their bounding
+    boxes. A call of any other kind or key ends the merge, so every draw
+    is sent in the order it was called.
+
+    If wait is true, the end of the block waits for the display server to
+    complete the last message of the burst. A nested batch joins the
+    enclosing one.
+
+    """
+
+    def __init__(self, sender, wait=False):
+        self.sender = sender
+        self.wait = wait
+        self.outer = None
+        self.messages = []
+
+    def __enter__(self):
+        current = self.sender._batch_state.batch
+        if current:
+            self.outer = current
+            current.wait = current.wait or self.wait
+            return current
+        self.sender._batch_state.batch = self
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.outer:
+            return
+        self.sender._batch_state.batch = None
+        self.flush(wait=self.wait and type is None)
+
+    def add(self, message):
+        self.messages.append(message)
+
+    def flush(self, wait=False):
+        """Sends the messages held so far as one burst, waiting for the
+        last one to complete if wait is true."""
+        messages = coalesce_regions(self.messages)
+        self.messages = []
+        if not messages:
+            return
+        event = None
+        if wait:
+            if messages[-1].request_id:
+                logger.warn('Not waiting on batch, its last message already'
+                            ' has request ID %s', messages[-1].request_id)
+            else:
+                event = self.sender._wait.prewait('batch')
+                messages[-1].request_id = event.request_id
+        self.sender._send(*[m.encode() for m in messages])
+        if event:
+            self.sender._wait.wait_for(event)
+
+
+class _BatchState(threading.local):
+    batch = None    # the calling thread's open DSBatch
+
+
+class DSMessage(object):
+    """A display server message held in a batch."""
+
+    __slots__ = ('op_code', 'options', 'request_id', 'int_args', 'char_args',
+                 'region_key')
+
+    def __init__(self, op_code, options, request_id, int_args, char_args,
+            region=False):
+        self.op_code = op_code
+        self.options = options
+        self.request_id = request_id
+        self.int_args = int_args
+        self.char_args = char_args
+        if region:
+            x_dest, y_dest, x_src, y_src = int_args[:4]
+            self.region_key = (op_code, options, request_id, char_args,
+                               x_src - x_dest, y_src - y_dest)
+        else:
+            self.region_key = None
+
+    def rect(self):
+        """The destination rectangle of a region message as (x, y, w, h)"""
+        return self.int_args[:2] + self.int_args[4:6]
+
+    def with_rect(self, (x, y, width, height)):
+        """A copy of a region message for another destination rectangle"""
+        dx, dy = self.region_key[-2:]
+        return DSMessage(self.op_code, self.options, self.request_id,
+                (x, y, x + dx, y + dy, width, height), self.char_args,
+                region=True)
+
+    def encode(self):
+        return _encoder(len(self.int_args), len(self.char_args)).encode(
+                self.op_code, self.options, self.request_id,
+                self.int_args, self.char_args)
+
+
+# Region message options that act on the whole destination rectangle,
+# clear ink and flash: such regions are never grown into a bounding box
+EXACT_REGION_OPTIONS = 0x10 | 0x02
+
+def coalesce_regions(messages):
+    """Returns messages with each run of consecutive region messages of
+    one region key merged, in the place of the first message of the run.
+    Any other message, or a region message of another key, ends the run,
+    so overlapping draws are never reordered. Regions that clear ink or
+    flash only lose duplicates and rectangles inside another, see
+    EXACT_REGION_OPTIONS."""
+    placed = []
+    run_key = None
+    run_rects = None    # destination rectangles of the current run
+    for message in messages:
+        key = message.region_key
+        if key is not None and key == run_key:
+            run_rects.append(message.rect())
+        elif key is None:
+            run_key = None
+            placed.append(message)
+        else:
+            run_key, run_rects = key, [message.rect()]
+            placed.append((message, run_rects))
+    result = []
+    for item in placed:
+        if isinstance(item, tuple):
+            message, key_rects = item
+            if message.options & EXACT_REGION_OPTIONS:
+                key_rects = drop_contained_rects(key_rects)
+            else:
+                key_rects = merge_rects(key_rects)
+            result.extend(message.with_rect(rect) for rect in key_rects)
+        else:
+            result.append(item)
+    return result
+
+def merge_rects(rects):
+    """Returns rectangles (x, y, w, h) with any that overlap or touch
+    replaced by their bounding box, until none do."""
+    merged = []
+    for x, y, w, h in rects:
+        i = 0
+        while i < len(merged):
+            mx, my, mw, mh = merged[i]
+            if x <= mx + mw and mx <= x + w and y <= my + mh and my <= y + h:
+                left, top = min(x, mx), min(y, my)
+                w = max(x + w, mx + mw) - left
+                h = max(y + h, my + mh) - top
+                x, y = left, top
+                del merged[i]
+                i = 0   # the grown rectangle may now reach earlier ones
+            else:
+                i += 1
+        merged.append((x, y, w, h))
+    return merged
+
+def drop_contained_rects(rects):
+    """Returns rectangles (x, y, w, h) without duplicates and without any
+    that lie inside another, in the order of first appearance."""
+    kept = []
+    for x, y, w, h in rects:
+        if any(kx <= x and ky <= y and x + w <= kx + kw and y + h <= ky + kh
+               for kx, ky, kw, kh in kept):
+            continue
+        kept = [(kx, ky, kw, kh) for kx, ky, kw, kh in kept
+                if not (x <= kx and y <= ky and
+                        kx + kw <= x + w and ky + kh <= y + h)]
+        kept.append((x, y, w, h))
+    return kept
 
 
 class DSDatagramSender(object):
@@ -153,6 +455,7 @@ class DSDatagramSender(object):
         self._ptu_send = None
         self._send_lock = threading.Lock()
         self._wait = DSWait()
+        self._batch_state = _BatchState()
         self.__class__._instance = self
 
     def clear(self):
@@ -161,14 +464,76 @@ class DSDatagramSender(object):
     def handle_request_completion(self, request_id, error_code=None):
         self._wait.notify_event(request_id, error_code)
 
-    def _send(self, packet):
+    def submit(self, operation, *args, **kwargs):
+        """Sends a display server operation with a new request ID and
+        returns its DSRequest without waiting, so that several operations
+        can be in flight at once; collect them with wait_all or wait_any.
+
+        "operation" is the name of an operation taking a request_id, e.g.
+        "update_region_of_page", or the bound method. An optional
+        "timeout" keyword gives the seconds after which the request
+        expires. The other arguments are passed to the operation.
+
+        """
+        if isinstance(operation, basestring):
+            operation = getattr(self, operation)
+        timeout = kwargs.pop('timeout', None)
+        request = self._wait.prewait(operation.__name__, timeout)
+        kwargs.update(request_id=request.request_id, wait=False)
+        operation(*args, **kwargs)
+        return request
+
+    def wait_all(self, requests, timeout=None):
+        """See DSWait.wait_all"""
+        self._flush_batch()
+        return self._wait.wait_all(requests, timeout)
+
+    def wait_any(self, requests, timeout=None):
+        """See DSWait.wait_any"""
+        self._flush_batch()
+        return self._wait.wait_any(requests, timeout)
+
+    def latency_stats(self):
+        """See DSWait.latency_stats"""
+        return self._wait.latency_stats()
+
+    def batch(self, wait=False):
+        """Returns a context manager that holds back the messages this
+        thread sends and sends them, with update regions merged, as one
+        burst when the block ends. See DSBatch.
+
+        """
+        return DSBatch(self, wait)
+
+    def _submit(self, op_code, options, request_id, int_args=(),
+            char_args=(), region=False):
+        batch = self._batch_state.batch
+        if batch:
+            batch.add(DSMessage(op_code, options, request_id, int_args,
+                                char_args, region))
+        else:
+            self._send(_encoder(len(int_args), len(char_args)).encode(
+                    op_code, options, request_id, int_args, char_args))
+
+    def _flush_batch(self):
+        # messages waited on inside a batch have to be sent first
+        batch = self._batch_state.batch
+        if batch:
+            batch.flush()
+
+    def _wait_for(self, wait_event):
+        self._flush_batch()
+        self._wait.wait_for(wait_event)
+
+    def _send(self, *packets):
         #logger.debug('_send called: %r', packet)
         if not interface_testing:
             with self._send_lock:
                 if not self._ptu_send:
                     self._ptu_send = e_ink.PenTrackUpdate(
                             **self._pen_track_update_options).send
-                self._ptu_send(packet)
+                for packet in packets:
+                    self._ptu_send(packet)
         #logger.debug('_send returned')
 
 
@@ -215,25 +580,20 @@ class DSDatagramSender(object):
         #
         logger.debug('sending load_document page:%d path:%s mask_ink:%s', start_page_num, 
                      document_path, mask_ink)
-        fmt = "@9L%ds" % len(document_path)
         if wait:
             wait_event = self._wait.prewait('load_document')
             request_id = wait_event.request_id
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 100, ((0x02 if flash else 0) |
                         (0x01 if force_reload else 0) | (0x40 if mask_ink else 0)),
                 request_id,
-                # Int and char arg counts
-                1, 1,
                 # Int args
-                start_page_num,
-                # String arg lengths
-                len(document_path),
+                (start_page_num,),
                 # String args
-                str(document_path)))
+                (str(document_path),))
         if wait:
-            self._wait.wait_for(wait_event)
+            self._wait_for(wait_event)
 
     load_document.opcode = 100
 
@@ -248,34 +608,25 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-insertpage%5C
         """
-        fmt = "@9L%ds%ds" % (
-                tuple(len(arg) for arg in (
-                    page_id, insert_before)))
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 101, 0,
                 request_id,
-                # Int and char arg counts
-                0, 2,
-                # String arg lengths
-                len(page_id), len(insert_before),
+                # Int args
+                (),
                 # String args
-                str(page_id), str(insert_before)))
+                (str(page_id), str(insert_before)))
 
     insert_page.opcode = 101
 
     def mask_page_strokes(self, mask_strokes, page_id):
-        fmt = "@9L%ds" % len(page_id)
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                         #opcode and options
                         170, 0, 
                         #request id 
                         0,
-                        #num int and string args
-                        1, 1,
-                        (1 if mask_strokes else 0),
-                        len(page_id),
-                        str(page_id)))
+                        ((1 if mask_strokes else 0),),
+                        (str(page_id),))
                         
 
     mask_page_strokes.opcode = 170
@@ -290,17 +641,14 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-deletepage%5C
         """
-        fmt = "@8L%ds" % len(page_id)
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 102, 0,
                 request_id,
-                # Int and char arg counts
-                0, 1,
-                # String arg lengths
-                len(page_id),
+                # Int args
+                (),
                 # String args
-                str(page_id)))
+                (str(page_id),))
 
     delete_page.opcode = 102
 
@@ -328,24 +676,18 @@ class DSDatagramSender(object):
         logger.debug('DS.update_region_of_page(%s,%s,%s,%s)',
                      (x_dest, y_dest), (x_src, y_src, width_src, height_src), 
                      page_id, src_path)
-        fmt = "@15L%ds%ds" % (
-                tuple(len(arg) for arg in (
-                    page_id, src_path)))
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 103, ((0x10 if clear_ink else 0) |
                         (0x08 if delete_image else 0) |
                         (0x02 if flash else 0) |
                         (0x04 if redraw else 0)),
                 request_id,
-                # Int and char arg counts
-                6, 2,
                 # Int args
-                x_dest, y_dest, x_src, y_src, width_src, height_src,
-                # String arg lengths
-                len(page_id), len(src_path),
+                (x_dest, y_dest, x_src, y_src, width_src, height_src),
                 # String args
-                str(page_id), str(src_path)))
+                (str(page_id), str(src_path)),
+                region=True)
 
     update_region_of_page.opcode = 103
 
@@ -367,17 +709,15 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-updateregionofinfobar%5C
         """
-        fmt = "@13L"
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 104, ((0x10 if clear_ink else 0) |
                         (0x02 if flash else 0) |
                         (0x04 if redraw else 0)),
                 request_id,
-                # Int and char arg counts
-                6, 0,
                 # Int args
-                x_dest, y_dest, x_src, y_src, width_src, height_src))
+                (x_dest, y_dest, x_src, y_src, width_src, height_src),
+                region=True)
 
     update_region_of_infobar.opcode = 104
 
@@ -392,17 +732,14 @@ class DSDatagramSender(object):
             Display+Server+API#DisplayServerAPI-jumptopage
         """
         logger.debug('attempting to jump to page %s', page_id)
-        fmt = "@8L%ds" % len(page_id)
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 105, 0,
                 request_id,
-                # Int and char arg counts
-                0, 1,
-                # String arg lengths
-                len(page_id),
+                # Int args
+                (),
                 # String args
-                str(page_id)))
+                (str(page_id),))
 
     jump_to_page.opcode = 105
 
@@ -413,13 +750,10 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-nextpage
         """
-        fmt = "@7L"
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 106, 0,
-                request_id,
-                # Int and char arg counts
-                0, 0))
+                request_id)
 
     next_page.opcode = 106
 
@@ -430,13 +764,10 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-prevpage
         """
-        fmt = "@7L"
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 107, 0,
-                request_id,
-                # Int and char arg counts
-                0, 0))
+                request_id)
 
     prev_page.opcode = 107
 
@@ -463,10 +794,7 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-createoverlaywindow
         """
-        fmt = "@16L%ds%ds%ds" % (
-                tuple(len(arg) for arg in (
-                    page_id, display_window_id, src_path)))
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 110, ((0x10 if clear_ink else 0) |
                         (0x08 if delete_image else 0) |
@@ -474,14 +802,10 @@ class DSDatagramSender(object):
                         (0x02 if flash else 0) |
                         (0x04 if redraw else 0)),
                 request_id,
-                # Int and char arg counts
-                6, 3,
                 # Int args
-                x_dest, y_dest, x_src, y_src, width_src, height_src,
-                # String arg lengths
-                len(page_id), len(display_window_id), len(src_path),
+                (x_dest, y_dest, x_src, y_src, width_src, height_src),
                 # String args
-                str(page_id), str(display_window_id), str(src_path)))
+                (str(page_id), str(display_window_id), str(src_path)))
 
     create_overlay_window.opcode = 110
 
@@ -506,24 +830,17 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-modifyoverlaywindow
         """
-        fmt = "@15L%ds%ds" % (
-                tuple(len(arg) for arg in (
-                    display_window_id, src_path)))
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 111, ((0x10 if clear_ink else 0) |
                         (0x08 if delete_image else 0) |
                         (0x02 if flash else 0) |
                         (0x04 if redraw else 0)),
                 request_id,
-                # Int and char arg counts
-                6, 2,
                 # Int args
-                x_dest, y_dest, x_src, y_src, width_src, height_src,
-                # String arg lengths
-                len(display_window_id), len(src_path),
+                (x_dest, y_dest, x_src, y_src, width_src, height_src),
                 # String args
-                str(display_window_id), str(src_path)))
+                (str(display_window_id), str(src_path)))
 
     modify_overlay_window.opcode = 111
 
@@ -539,24 +856,21 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-closeoverlaywindow
         """
-        fmt = "@8L%ds" % len(display_window_id)
         if wait:
             wait_event = self._wait.prewait('close_overlay_window')
             request_id = wait_event.request_id
             logger.debug('close_overlay waits on %r %d', wait_event, request_id)
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 112, ((0x02 if flash else 0) |
                         (0x04 if redraw else 0)),
                 request_id,
-                # Int and char arg counts
-                0, 1,
-                # String arg lengths
-                len(display_window_id),
+                # Int args
+                (),
                 # String args
-                str(display_window_id)))
+                (str(display_window_id),))
         if wait:
-            self._wait.wait_for(wait_event)
+            self._wait_for(wait_event)
 
     close_overlay_window.opcode = 112
 
@@ -567,20 +881,15 @@ class DSDatagramSender(object):
                     wait = False):
         """mask drawing and storing ink in the window (page or overlay) with the given
         display_id"""
-        fmt = "@12L%ds" % len(display_id)
         logger.debug('DS <= mask_region(%s,%s)', (top,left,width,height), display_id)
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 175, 0,
                 request_id,
-                # Int and char arg counts
-                4, 1,
                 # Int args
-                top, left, width, height,
-                # String arg lengths
-                len(display_id), 
+                (top, left, width, height),
                 # String args
-                str(display_id)))
+                (str(display_id),))
         
     mask_region.opcode = 175
 
@@ -589,19 +898,16 @@ class DSDatagramSender(object):
         """video will be inverted in the given regions each of which is (x,y,w,h).
         Inversion will happen on pen down in a region and continue to either leaving
         the region or pen up.  At that point it will revert"""
-        fmt = '@%dL%ds' % (9 + len(regions), len(display_id))
-        var_stuff = [len(regions)/4]
-        var_stuff.extend(regions)
-        var_stuff.append(len(display_id))
-        var_stuff.append(display_id)
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        int_args = [len(regions)/4]
+        int_args.extend(regions)
+        self._submit(
                 # Op code and options
                 190, 0,
                 0,
-                # Int and char arg counts
-                len(regions) + 1, 1,
                 # Int args
-                *var_stuff))
+                int_args,
+                # String args
+                (str(display_id),))
         
     invert_video_in_regions.opcode = 190
 
@@ -616,19 +922,14 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-changeconfig%5C
         """
-        fmt = "@9L%ds%ds" % (
-                tuple(len(arg) for arg in (
-                    Variable, Value)))
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 120, 0,
                 request_id,
-                # Int and char arg counts
-                0, 2,
-                # String arg lengths
-                len(Variable), len(Value),
+                # Int args
+                (),
                 # String args
-                str(Variable), str(Value)))
+                (str(Variable), str(Value)))
 
     change_config.opcode = 120
 
@@ -644,19 +945,14 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-erasestrokesbyindex%5C
         """
-        fmt = "@10L%ds" % len(page_id)
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 130, 0,
                 request_id,
-                # Int and char arg counts
-                2, 1,
                 # Int args
-                start_index, end_index,
-                # String arg lengths
-                len(page_id),
+                (start_index, end_index),
                 # String args
-                str(page_id)))
+                (str(page_id),))
 
     erase_strokes_by_index.opcode = 130
 
@@ -674,19 +970,14 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-eraseinkinregion%5C
         """
-        fmt = "@12L%ds" % len(page_id)
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 131, 0,
                 request_id,
-                # Int and char arg counts
-                4, 1,
                 # Int args
-                x, y, width, height,
-                # String arg lengths
-                len(page_id),
+                (x, y, width, height),
                 # String args
-                str(page_id)))
+                (str(page_id),))
 
     erase_ink_in_region.opcode = 131
 
@@ -697,13 +988,10 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-doze%5C
         """
-        fmt = "@7L"
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 140, 0,
-                request_id,
-                # Int and char arg counts
-                0, 0))
+                request_id)
 
     doze.opcode = 140
 
@@ -714,13 +1002,10 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-sleep%5C
         """
-        fmt = "@7L"
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 141, 0,
-                request_id,
-                # Int and char arg counts
-                0, 0))
+                request_id)
 
     sleep.opcode = 141
 
@@ -734,15 +1019,12 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-setdozetimer%5C
         """
-        fmt = "@8L"
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 142, 0,
                 request_id,
-                # Int and char arg counts
-                1, 0,
                 # Int args
-                timeout))
+                (timeout,))
 
     set_doze_timer.opcode = 142
 
@@ -753,13 +1035,10 @@ class DSDatagramSender(object):
           http://eptwiki.rii.ricoh.com:8080/display/ePro/
             Display+Server+API#DisplayServerAPI-dotest
         """
-        fmt = "@7L"
-        self._send(pack(fmt, 0x131C014E, calcsize(fmt),
+        self._submit(
                 # Op code and options
                 255, 0,
-                request_id,
-                # Int and char arg counts
-                0, 0))
+                request_id)
 
 
 
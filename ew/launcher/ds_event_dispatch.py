@@ -1,6 +1,7 @@
 #!/usr/bin/env python
-import re, os, threading
-from struct import unpack_from
+import errno, re, os, sys, threading
+from array import array
+from struct import Struct, unpack_from, error as struct_error
 import socket
 
 MAX_EVENT_SIZE = 65535
@@ -16,7 +17,142 @@ pat_pat = re.compile(r'[sS]|[^sS]+')
 
 endian = '!'
 
-end_pos = None
+# on_stroke flags
+STROKE_START, STROKE_END = 0x01, 0x02
+
+class DecodePlan(object):
+    """A display server event format compiled once for decoding.
+
+    Each run of integer fields is read by one precompiled Struct, and
+    strings by their length prefix. See
+    DSDatagramReceiver.unpack_ds_event_data for the format characters.
+
+    """
+
+    _length = Struct(endian + 'I')
+
+    def __init__(self, format):
+        self.format = format
+        self.steps = []     # Struct for an integer run, or 's' / 'S'
+        for m in pat_pat.finditer(format):
+            fmt = m.group(0)
+            if fmt in 'sS':
+                self.steps.append(fmt)
+            else:
+                self.steps.append(Struct(endian + fmt))
+
+    def decode(self, data, pos=4):
+        """Returns (values, end offset) for the event in data, whose fields
+        start at pos. Raises struct.error if data is too short."""
+        values = []
+        for step in self.steps:
+            if step.__class__ is str:
+                length, = self._length.unpack_from(data, pos)
+                pos += 4
+                if pos + length > len(data):
+                    raise struct_error('string runs past end of event')
+                values.append(data[pos:pos + length])
+                pos += length
+                if step == 'S' and pos % 4:
+                    pos += 4 - pos % 4
+            else:
+                values.extend(step.unpack_from(data, pos))
+                pos += step.size
+        return values, pos
+
+
+class StrokeSamples(object):
+    """The (x, y) samples of an on_stroke event, held as one flat
+    array('H') of coordinates, "coords", while the event is queued. Reads
+    like the list of (x, y) tuples it replaces; tolist() makes that list,
+    which is what the on_stroke handler gets, see dispatch_args.
+    """
+
+    __slots__ = ('coords',)
+
+    def __init__(self, coords):
+        self.coords = coords
+
+    @classmethod
+    def from_event(cls, data, pos, sample_count):
+        """Decodes sample_count network order samples at data[pos:]"""
+        end = pos + 4 * sample_count
+        if end > len(data):
+            raise struct_error('stroke samples run past end of event')
+        coords = array('H')
+        coords.fromstring(data[pos:end])
+        if sys.byteorder == 'little':
+            coords.byteswap()
+        return cls(coords)
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.tolist()[i]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('stroke sample index out of range')
+        return self.coords[2 * i], self.coords[2 * i + 1]
+
+    def __iter__(self):
+        coords = iter(self.coords)
+        return iter(zip(coords, coords))
+
+    def extend(self, samples):
+        """Appends the samples of another StrokeSamples"""
+        self.coords.extend(samples.coords)
+
+    def tolist(self):
+        coords = iter(self.coords)
+        return zip(coords, coords)
+
+    def __eq__(self, other):
+        if isinstance(other, StrokeSamples):
+            return self.coords == other.coords
+        try:
+            return self.tolist() == [tuple(p) for p in other]
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+def merge_partial_strokes(queued, entry):
+    """EditableQueue merge function for on_stroke entries (function, args).
+
+    A stroke arrives as several on_stroke events, the first flagged
+    STROKE_START and the last STROKE_END. If entry continues the stroke of
+    the still queued entry, in the same window, its samples are added to
+    queued's, which is returned with entry's STROKE_END flag. Otherwise
+    returns None.
+
+    """
+    function, args = queued
+    if entry[0] is not function:
+        return None
+    index, flags, window_id, millis, samples = args
+    new_index, new_flags, new_window_id, new_millis, new_samples = entry[1]
+    if (new_index != index or new_window_id != window_id or
+            flags & STROKE_END or new_flags & STROKE_START or
+            (flags ^ new_flags) & ~(STROKE_START | STROKE_END)):
+        return None
+    samples.extend(new_samples)
+    return function, (index, flags | new_flags & STROKE_END, window_id,
+                      millis, samples)
+
+def dispatch_args(function, args):
+    """The arguments a queued event handler is called with: the samples of
+    on_stroke as the plain list of (x, y) tuples, other events' as
+    queued."""
+    if args and isinstance(args[-1], StrokeSamples):
+        return tuple(args[:-1]) + (args[-1].tolist(),)
+    return args
 
 class AbortedEventLoopWait(Exception):
     def __init__(self):
@@ -37,7 +173,7 @@ class DSEventLoop(threading.Thread):
             else:
                 try:
                     logger.debug('calling %s%s', fun.__name__, args)
-                    fun(*args)
+                    fun(*dispatch_args(fun, args))
                     logger.debug('returned from calling %s', fun.__name__)
                 except AbortedEventLoopWait:
                     logger.debug('%s exited from context close during wait', self)
@@ -73,10 +209,20 @@ class DSDatagramReceiver:
             on_shutdown = (12,),
             on_fuel_gauge_change = (13,),
             on_viewport_change = (14, 'ii'))
-        self._event_by_number = dict([(v[0],(getattr(self.runner,k), v[1:])) for \
-                                          k,v in self._event_map.iteritems()])
+        self._event_by_number = dict(
+                (v[0], (getattr(self.runner, k), self.decode_plan(v[1]) if
+                        len(v) > 1 else None, v[2] if len(v) > 2 else None))
+                for k, v in self._event_map.iteritems())
 
+    _plans = {}
 
+    @classmethod
+    def decode_plan(cls, format):
+        """Returns the DecodePlan for format, compiling it once."""
+        plan = cls._plans.get(format)
+        if plan is None:
+            plan = cls._plans[format] = DecodePlan(format)
+        return plan
 
     def get_ds_event_id(self, data):
         return unpack_from(endian + 'I', data)[0]
@@ -100,6 +246,8 @@ class DSDatagramReceiver:
         that they are "network" order (big-endian), so this implementation works
         as such.
 
+        Each format is compiled once into a DecodePlan, see decode_plan.
+
         This function works similarly to the "struct.unpack" function in the
         Python library. It takes a pattern (a string) as its argument and
         returns a sequence of data values (integers and strings). The event ID
@@ -111,81 +259,106 @@ class DSDatagramReceiver:
         "S": string (preceded by its integer length, chars padded to
           integer boundary)
         """
-        global end_pos
-        values = []
         try:
-            for m in pat_pat.finditer(format):
-                fmt = m.group(0)
-                if fmt in 'sS':
-                    length, = unpack_from(endian + 'I', data, pos)
-                    values.append(unpack_from(
-                            endian + '%ds' % length, data, pos + 4)[0])
-                    pos += 4 + length
-                    if fmt == 'S':
-                        align = pos % 4
-                        if align:
-                            pos += 4 - align
-                else:
-                    values.extend(unpack_from(endian + fmt, data, pos))
-                    pos += 4 * len(fmt)
-            end_pos = pos
+            return self.decode_plan(format).decode(data, pos)[0]
         except Exception:
             logger.exception('bad data received')
-        return values
+            return []
 
     # Event decoding ======================
 
 
     _listener = None
+    _socket = None
 
-    def listen_for_events(self, listener=None, local_socket_path='/tmp/PTU_sendsocket'):
+    def _bind_event_socket(self, local_socket_path):
         sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
         #sock.setblocking(True)
         if os.path.exists(local_socket_path):
             os.remove(local_socket_path)
         sock.bind(local_socket_path)
+        return sock
+
+    def listen_for_events(self, listener=None, local_socket_path='/tmp/PTU_sendsocket'):
+        sock = self._bind_event_socket(local_socket_path)
         while 1:
             logger.debug('Waiting for datagram...')
-            data = sock.recv(MAX_EVENT_SIZE)
-            if False or logger.isEnabledFor(DEBUG):
-                logger.debug('Event datagram received -- %s bytes:\n%s',
-                        len(data),
-                        ' '.join(
-                          ''.join("%02x" % ord(c) for c in data[i:i + 4])
-                            for i in xrange(0, len(data), 4)))
-            function, args = self._get_handler_information(data)
-            if not function: 
-                logger.warn('Unrecognized DS message received.. ignored')
-                continue
-            fname = function.__name__
-            entry = function,args
-            priority = self._queue.Priority_Normal
-            if fname == 'on_page':
-                #switching pages so remove queue on_stroke commands
-                def is_on_stroke(function, args):
-                    return function.__name__ == 'on_stroke'
-                #self._queue.remove_all(is_on_stroke)
-                self._queue.put(entry, self._queue.Priority_High)
-            elif fname == 'on_stroke':
-                priority = self._queue.Priority_Immediate if \
-                           self.runner.infobar().owns_stroke(*args) else \
-                           self._queue.Priority_Normal
-                self._queue.put(entry, priority)
-            elif fname in ('on_read_complete', 'on_error', 'on_render_complete'):
-                #logger.debug('wait ending function %s called immediately', fname)
-                function(*args)
-            else: #probably more special cases here for power events..
-                self._queue.put(entry)
-
-
-    def start_service(self):
-        self._listener_thread = threading.Thread(
-            target = self.listen_for_events, name='ds_event_queue')
-        self._listener_thread.setDaemon(True)
-        self._listener_thread.start()
+            self.handle_datagram(sock.recv(MAX_EVENT_SIZE))
+
+    def _on_readable(self, sock):
+        """Reactor handler: handle every datagram waiting on sock"""
+        while 1:
+            try:
+                data = sock.recv(MAX_EVENT_SIZE)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            self.handle_datagram(data)
+
+    def handle_datagram(self, data):
+        """Queue the call for one display server event datagram"""
+        if False or logger.isEnabledFor(DEBUG):
+            logger.debug('Event datagram received -- %s bytes:\n%s',
+                    len(data),
+                    ' '.join(
+                      ''.join("%02x" % ord(c) for c in data[i:i + 4])
+                        for i in xrange(0, len(data), 4)))
+        function, args = self._get_handler_information(data)
+        if not function: 
+            logger.warn('Unrecognized DS message received.. ignored')
+            return
+        fname = function.__name__
+        entry = function,args
+        priority = self._queue.Priority_Normal
+        if fname == 'on_page':
+            #switching pages so remove queue on_stroke commands
+            def is_on_stroke(function, args):
+                return getattr(function, '__name__', None) == 'on_stroke'
+            purged = self._queue.remove_all(is_on_stroke)
+            if purged:
+                logger.debug('on_page discarded %d queued on_stroke events',
+                             purged)
+            self._queue.put(entry, self._queue.Priority_High)
+        elif fname == 'on_stroke':
+            priority = self._queue.Priority_Immediate if \
+                       self.runner.infobar().owns_stroke(*args) else \
+                       self._queue.Priority_Normal
+            self._queue.put(entry, priority, merge_partial_strokes)
+        elif fname in ('on_read_complete', 'on_error', 'on_render_complete'):
+            #logger.debug('wait ending function %s called immediately', fname)
+            function(*args)
+        else: #probably more special cases here for power events..
+            self._queue.put(entry)
+
+
+    def queue_stats(self):
+        """Event queue depth, merged partial strokes, and the lag between
+        receiving and dispatching events; see EditableQueue.stats"""
+        return self._queue.stats()
+
+    def start_service(self, reactor=None,
+                      local_socket_path='/tmp/PTU_sendsocket'):
+        """Start the DS event loop, and receive events on reactor (an
+        ew.util.reactor.Reactor) or, without one, a thread of their own."""
+        if reactor is not None:
+            self._socket = self._bind_event_socket(local_socket_path)
+            self._socket.setblocking(False)
+            self._reactor = reactor
+            reactor.register(self._socket, self._on_readable)
+        else:
+            self._listener_thread = threading.Thread(
+                target = self.listen_for_events, name='ds_event_queue',
+                kwargs = dict(local_socket_path=local_socket_path))
+            self._listener_thread.setDaemon(True)
+            self._listener_thread.start()
         DSEventLoop(self).start()
 
     def stop_service(self):
+        if self._socket is not None:
+            self._reactor.unregister(self._socket)
+            self._socket.close()
+            self._socket = None
         self._queue.put(("STOP", ()), self._queue.Priority_Immediate)
 
     def _get_handler_information(self, data):
@@ -194,30 +367,30 @@ class DSDatagramReceiver:
         unpacking_info = self._event_by_number.get(event_id)
         if unpacking_info:
             args = ()
-            function, rest = unpacking_info
-            logger.debug("handling DS event %s with format.. %s", function.__name__, rest)
-            if rest:
-                format = rest[0]
-                unpacker = self.unpack_ds_event_data
-                if len(rest) > 1:
-                    unpacker = rest[1]
-                args = unpacker(format, data)
+            function, plan, unpacker = unpacking_info
+            if plan:
+                try:
+                    if unpacker:
+                        args = unpacker(plan, data)
+                    else:
+                        args = plan.decode(data)[0]
+                except Exception:
+                    logger.exception('bad data received')
+                    args = []
         else:
             logger.error('Received DS packet with unknown event id %d',
                          event_id)
 
-        fname = function.__name__ if function else 'None'
-        logger.debug('DS incoming gives call %s%s', fname, args)
+        # checked once here, as this runs for every stroke datagram
+        if logger.isEnabledFor(DEBUG):
+            fname = function.__name__ if function else 'None'
+            logger.debug("handled DS event %s with format.. %s", fname,
+                         plan.format if function and plan else '')
+            logger.debug('DS incoming gives call %s%s', fname, args)
         return function, args
 
-    def _stroke_data_unpacker(self,format, data):
-        unpacked = self.unpack_ds_event_data(format, data)
-        index, flags, window_id, milliseconds, sample_count = unpacked
-        sample_coordinates = unpack_from(endian + '%dH' % (sample_count * 2),
-                                         data, end_pos)
-        samples = [sample_coordinates[i:i + 2]
-                   for i in xrange(0, len(sample_coordinates), 2)]
-        logger.debug('unpacked on_stroke points %s', samples)
+    def _stroke_data_unpacker(self, plan, data):
+        (index, flags, window_id, milliseconds, sample_count), end = \
+                plan.decode(data)
+        samples = StrokeSamples.from_event(data, end, sample_count)
         return (index, flags, window_id, milliseconds, samples)
-
-
@@ -1,13 +1,16 @@
 #!/usr/bin/env python
 # Copyright 2011 Ricoh Innovations, Inc.
-from ds_event_dispatch import DSDatagramReceiver
+from ds_event_dispatch import DSDatagramReceiver, STROKE_END
 from display_server import DSDatagramSender
 from infobar import Infobar
 import threading, os, types, pdb, time
+from array import array
 from ew.util import comms, ew_logging as log, standard_doc_path, docid_from_path, system_config as sysconfig, login
 from ew.util.resettable_timer import ResettableTimer
+from ew.util.reactor import Reactor
 from ew.internal_decs.inbox_item_panel import InboxItemPanel as IP
 from ew.memphis.file import MemphisFile
+from ew.memphis.ink_store import InkStoreError, flat_samples
 from sdk.document import Document
 from sdk.delegate import Dec
 from ew.util import tablet_config
@@ -88,6 +91,8 @@ class DocumentRunner:
     def __init__(self):
         self._to_ds = DSDatagramSender.instance()
         self._from_ds = DSDatagramReceiver(self)
+        # one thread for the DS, camera and service manager sockets
+        self._reactor = Reactor.instance()
         self._is_loading = False
         self._pending_operations = {}
         self._queued_submit = None
@@ -96,6 +101,8 @@ class DocumentRunner:
         self._templates = None
         self._settings = None
         self._document = None
+        self._page_id = None
+        self._stroke_ink = None # (millis, samples) of the stroke being drawn
         self._infobar = Infobar(self)
         self._known_windows = {}
         self._is_logged_in = False
@@ -240,7 +247,7 @@ class DocumentRunner:
             self._location = DoesNothing()
             self._audio = AudioService()
         self._network.on_connection_info(self.handle_connection_info)
-        self._network.start()
+        self._network.start(self._reactor)
         self._network.get_conn_info()
         
         self._powermgr.on_fuel_gauge_change(self.on_fuel_gauge_change)
@@ -248,8 +255,8 @@ class DocumentRunner:
         self._powermgr.on_suspend(self.on_suspend)
         self._powermgr.on_wakeup(self.on_suspend)
         self._powermgr.on_battery_warning(self.battery_warning)
-        self._powermgr.start()
-        self._audio.start()
+        self._powermgr.start(self._reactor)
+        self._audio.start(self._reactor)
         logger.debug('finished setting up services')
 
 #        self._powermgr.on_power_long_hold(self.blank_screen)
@@ -364,6 +371,7 @@ class DocumentRunner:
             window = self._document.window_handling_stroke_in(window_id)
             if not self._is_special_document(self._document):
                 self.inbox().mark_modified_if_new(self._document.doc_id())
+                self._keep_ink(flags, millis, points)
 
         if window:
             window.on_stroke(index, flags, millis, points)
@@ -371,8 +379,30 @@ class DocumentRunner:
             logger.warn('no window to accept stroke to window id %s', window_id)
         self._ready_timer.start()
 
+    def _keep_ink(self, flags, millis, points):
+        """Collects the samples of a stroke on the document page and appends
+        the stroke to the page ink store when it ends; the next stroke file
+        of the page refers to it, see on_stroke_file_ready."""
+        if self._page_id is None:
+            return
+        if self._stroke_ink is None:
+            self._stroke_ink = (millis, array('H'))
+        self._stroke_ink[1].extend(flat_samples(points))
+        if not flags & STROKE_END:
+            return
+        millis, samples = self._stroke_ink
+        self._stroke_ink = None
+        try:
+            with MemphisFile(self._document.path, lazy=True) as mf:
+                mf.add_stroke(str(self._page_id), samples, millis)
+        except (InkStoreError, OverflowError, EnvironmentError):
+            logger.exception('ink of a stroke on page %s not kept',
+                             self._page_id)
+
     def on_page(self, page_id):
         self._on_activity()
+        self._page_id = page_id
+        self._stroke_ink = None
         self._infobar.update_using_region_of_page(page_id)
 
         if self._is_special_document(self._document):
@@ -409,7 +439,7 @@ class DocumentRunner:
 
         mpath = stroke_file_path.split('.memphis/')[0] + '.memphis'
         logger.debug('stroke_file_ready should go to %s', mpath)
-        with MemphisFile(mpath) as mf:
+        with MemphisFile(mpath, lazy=True) as mf:
             mf.add_stroke_file(stroke_file_path)
 
     def on_landscape(self):
@@ -544,6 +574,7 @@ class DocumentRunner:
                 logger.debug('lock on %s released as requested with no blockers', docid)
             
     def _close_document(self):
+        self._stroke_ink = None
         if self._document:
             self._document.on_close()
             if not self._is_special_document(self._document):
@@ -695,7 +726,7 @@ class DocumentRunner:
             config.is_developer_tablet()
         if os.path.exists(path):
             def get_classes_and_lock():
-                mfile = MemphisFile(path)
+                mfile = MemphisFile(path, lazy=True)
                 mfile.open()
 #                pdb.set_trace()
                 alock = mfile.get_lock('loaded', exclusive=False)
@@ -747,7 +778,7 @@ class DocumentRunner:
     def start_services(self):
         logger.debug('starting DocumentRunner services')
         self._rpc_thread.start() #start XML server
-        self._from_ds.start_service() #start DS event loop
+        self._from_ds.start_service(self._reactor) #start DS event loop
 
     def stop_services(self):
         logger.warn('Shutting down DocumentRunner services')
@@ -758,7 +789,8 @@ class DocumentRunner:
 
     ### Server setup and methods ###
     def _set_up_server(self):
-        server = comms.create_threaded_server(comms.LAUNCHER_PORT)
+        server = comms.create_threaded_server(comms.LAUNCHER_PORT,
+                                              listen=comms.LISTEN_BOTH)
         self._rpc_thread = comms.ServerThread('doc_runner', server)
         self._add_ds_delegates(server)
         server.register_function(self.open_inbox)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Performance timing of display server message encoding.
+
+Encodes every DSDatagramSender operation with the precompiled encoders,
+against the previous per-call format strings and struct.pack. The two are
+checked to produce the same bytes before timing.
+"""
+
+from struct import pack, calcsize
+from ew.launcher import display_server
+from ew.launcher.display_server import DSDatagramSender
+from ew.util.perf_timing import PerfTiming
+
+ROUNDS = 5000
+MAGIC = 0x131C014E
+PAGE, PATH, WINDOW = 'p0001.pgm', '/data/inbox/doc.memphis/p0001.pgm', 'w1'
+REGION = (10, 20, 0, 0, 300, 200)
+
+def send_all(ds):
+    """Calls every display server operation once."""
+    ds.load_document(1, PATH)
+    ds.insert_page(PAGE, 'p0002.pgm')
+    ds.mask_page_strokes(True, PAGE)
+    ds.delete_page(PAGE)
+    ds.update_region_of_page(*(REGION + (PAGE, PATH)), flash=True)
+    ds.update_region_of_infobar(*REGION)
+    ds.jump_to_page(PAGE)
+    ds.next_page()
+    ds.prev_page()
+    ds.create_overlay_window(*(REGION + (PAGE, WINDOW, PATH)))
+    ds.modify_overlay_window(*(REGION + (WINDOW, PATH)))
+    ds.close_overlay_window(WINDOW, wait=False)
+    ds.mask_region(1, 2, 3, 4, PAGE)
+    ds.invert_video_in_regions(PAGE, 1, 2, 3, 4, 5, 6, 7, 8)
+    ds.change_config('variable', 'value')
+    ds.erase_strokes_by_index(1, 5, PAGE)
+    ds.erase_ink_in_region(1, 2, 3, 4, PAGE)
+    ds.doze()
+    ds.sleep()
+    ds.set_doze_timer(30)
+    ds.do_test()
+
+def legacy_packets():
+    """The same calls as send_all, encoded the way they were before the
+    precompiled encoders."""
+    def message(op, options, ints, strings):
+        fmt = '@%dL' % (7 + len(ints) + len(strings)) + ''.join(
+                '%ds' % len(s) for s in strings)
+        return pack(fmt, MAGIC, calcsize(fmt), op, options, 0,
+                len(ints), len(strings),
+                *(list(ints) + [len(s) for s in strings] + list(strings)))
+    return [
+        message(100, 0x02, (1,), (PATH,)),
+        message(101, 0, (), (PAGE, 'p0002.pgm')),
+        message(170, 0, (1,), (PAGE,)),
+        message(102, 0, (), (PAGE,)),
+        message(103, 0x02, REGION, (PAGE, PATH)),
+        message(104, 0, REGION, ()),
+        message(105, 0, (), (PAGE,)),
+        message(106, 0, (), ()),
+        message(107, 0, (), ()),
+        message(110, 0, REGION, (PAGE, WINDOW, PATH)),
+        message(111, 0, REGION, (WINDOW, PATH)),
+        message(112, 0, (), (WINDOW,)),
+        message(175, 0, (1, 2, 3, 4), (PAGE,)),
+        message(190, 0, (2, 1, 2, 3, 4, 5, 6, 7, 8), (PAGE,)),
+        message(120, 0, (), ('variable', 'value')),
+        message(130, 0, (1, 5), (PAGE,)),
+        message(131, 0, (1, 2, 3, 4), (PAGE,)),
+        message(140, 0, (), ()),
+        message(141, 0, (), ()),
+        message(142, 0, (30,), ()),
+        message(255, 0, (), ()),
+    ]
+
+def check_encoding(ds):
+    packets = []
+    ds._send = lambda packet: packets.append(packet)
+    send_all(ds)
+    del ds._send
+    assert packets == legacy_packets(), 'encodings differ'
+
+def test_encode():
+    """5000 rounds of all 21 operations, precompiled encoders"""
+    ds = DSDatagramSender.instance()
+    for n in xrange(ROUNDS):
+        send_all(ds)
+
+def test_encode_legacy():
+    """5000 rounds of all 21 operations, per-call format strings"""
+    for n in xrange(ROUNDS):
+        legacy_packets()
+
+if __name__ == "__main__":
+    display_server.interface_testing = True
+    check_encoding(DSDatagramSender.instance())
+    perf = PerfTiming()
+    perf.add(test_encode, test_encode_legacy)
+    perf.main()
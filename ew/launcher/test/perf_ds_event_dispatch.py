@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Performance timing of display server event decoding.
+
+Replays a stream of stroke datagrams, shaped like those the display server
+sends while a pen is down (partial strokes of a few samples, then the
+completed stroke), through DSDatagramReceiver._get_handler_information,
+against the previous regex driven decoder. The two are checked to decode
+the same values before timing.
+"""
+
+import random, re, time
+from struct import pack, unpack_from
+from sys import stderr
+from ew.launcher.ds_event_dispatch import DSDatagramReceiver
+from ew.util.perf_timing import PerfTiming
+
+STROKES = 500
+EVENT_NAMES = ('on_stroke', 'on_page', 'on_submit', 'on_read_complete',
+        'on_render_complete', 'on_error', 'on_stroke_file_ready',
+        'on_landscape', 'on_portrait', 'on_sleep', 'on_doze', 'on_wake',
+        'on_shutdown', 'on_fuel_gauge_change', 'on_viewport_change')
+
+class Runner(object):
+    pass
+
+def handler(name):
+    def handle(self, *args):
+        pass
+    handle.__name__ = name
+    return handle
+
+for name in EVENT_NAMES:
+    setattr(Runner, name, handler(name))
+
+def stroke_datagram(index, flags, window_id, millis, points):
+    window_id += '\0' * (-len(window_id) % 4)
+    return pack('!IiiI%dsiI%dH' % (len(window_id), 2 * len(points)),
+            0, index, flags, len(window_id), window_id, millis,
+            len(points), *[c for p in points for c in p])
+
+def stroke_datagrams(seed=1):
+    """datagrams for STROKES strokes, each sent as partial strokes of 1 to
+    8 samples and then whole"""
+    rnd = random.Random(seed)
+    datagrams = []
+    for index in xrange(STROKES):
+        x, y = rnd.randrange(1200), rnd.randrange(1600)
+        points = []
+        for n in xrange(rnd.randrange(10, 120)):
+            x = max(0, x + rnd.randrange(-6, 7))
+            y = max(0, y + rnd.randrange(-6, 7))
+            points.append((x, y))
+        for start in xrange(0, len(points), 8):
+            datagrams.append(stroke_datagram(index, 1, '', 20 * start,
+                    points[start:start + rnd.randrange(1, 9)]))
+        datagrams.append(stroke_datagram(index, 0, '', 20 * len(points),
+                points))
+    return datagrams
+
+DATAGRAMS = stroke_datagrams()
+
+# The decoder before precompiled plans ================================
+
+pat_pat = re.compile(r'[sS]|[^sS]+')
+end_pos = None
+
+def legacy_unpack(format, data, pos=4):
+    global end_pos
+    values = []
+    for m in pat_pat.finditer(format):
+        fmt = m.group(0)
+        if fmt in 'sS':
+            strlen = unpack_from('!I', data, pos)[0]
+            pos += 4
+            values.append(data[pos:pos + strlen])
+            pos += strlen
+            if fmt == 'S':
+                rem = pos % 4
+                if rem:
+                    pos += 4 - rem
+        else:
+            fmt = '!' + fmt
+            for value in unpack_from(fmt, data, pos):
+                values.append(value)
+                pos += 4
+    end_pos = pos
+    return values
+
+def legacy_decode(data):
+    index, flags, window_id, millis, count = legacy_unpack('iiSii', data)
+    coords = unpack_from('!%dH' % (count * 2), data, end_pos)
+    points = [(coords[i], coords[i + 1]) for i in xrange(0, len(coords), 2)]
+    return (index, flags, window_id, millis, points)
+
+def check_decoding(receiver):
+    for data in DATAGRAMS:
+        function, args = receiver._get_handler_information(data)
+        assert function.__name__ == 'on_stroke'
+        assert tuple(args) == legacy_decode(data), 'decodings differ'
+
+def report(t0):
+    print >>stderr, '%.0f events/sec' % (len(DATAGRAMS) / (time.time() - t0))
+
+def test_decode():
+    """replay stroke datagrams, precompiled plans"""
+    receiver = DSDatagramReceiver(Runner())
+    get_handler_information = receiver._get_handler_information
+    t0 = time.time()
+    for data in DATAGRAMS:
+        get_handler_information(data)
+    report(t0)
+
+def test_decode_legacy():
+    """replay stroke datagrams, per-datagram regex and unpack_from"""
+    t0 = time.time()
+    for data in DATAGRAMS:
+        legacy_decode(data)
+    report(t0)
+
+if __name__ == "__main__":
+    check_decoding(DSDatagramReceiver(Runner()))
+    print '%d datagrams' % len(DATAGRAMS)
+    perf = PerfTiming()
+    perf.add(test_decode, test_decode_legacy)
+    perf.main()
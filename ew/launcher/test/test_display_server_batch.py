@@ -0,0 +1,112 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import unittest
+from ew.launcher import display_server
+from ew.launcher.display_server import (DSDatagramSender, merge_rects,
+        drop_contained_rects)
+from ew.util.ds_message import DsMessage
+
+ds_message = DsMessage()
+
+class TestDSBatch(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.ds = DSDatagramSender.instance()
+        self.ds._send = lambda *packets: self.sent.append(
+                [ds_message.decode(packet) for packet in packets])
+
+    def test_merge_rects(self):
+        self.assertEqual(merge_rects([(0, 0, 10, 10), (0, 0, 10, 10)]),
+                         [(0, 0, 10, 10)])
+        self.assertEqual(merge_rects([(0, 0, 10, 10), (50, 50, 5, 5),
+                                      (5, 5, 10, 10)]),
+                         [(50, 50, 5, 5), (0, 0, 15, 15)])
+        # merging two may make the result reach a third
+        self.assertEqual(merge_rects([(0, 0, 2, 2), (4, 0, 2, 2),
+                                      (1, 0, 4, 1)]),
+                         [(0, 0, 6, 2)])
+
+    def test_batch_coalesces_regions(self):
+        ds = self.ds
+        with ds.batch():
+            ds.update_region_of_page(0, 0, 0, 0, 10, 10, 'p1', 'img')
+            ds.update_region_of_page(5, 5, 5, 5, 10, 10, 'p1', 'img')
+            ds.update_region_of_page(5, 5, 5, 5, 10, 10, 'p1', 'img')
+            ds.update_region_of_page(0, 0, 0, 0, 10, 10, 'p2', 'img')
+            ds.update_region_of_infobar(0, 0, 0, 0, 4, 4)
+            ds.update_region_of_infobar(4, 0, 4, 0, 4, 4)
+            ds.jump_to_page('p2')
+            # not merged across another operation
+            ds.update_region_of_page(0, 0, 0, 0, 1, 1, 'p1', 'img')
+            self.assertEqual(self.sent, [])
+        self.assertEqual(len(self.sent), 1)
+        burst = [(m.op_code, m.int_args, m.char_args) for m in self.sent[0]]
+        self.assertEqual(burst, [
+            (103, (0, 0, 0, 0, 15, 15), ('p1', 'img')),
+            (103, (0, 0, 0, 0, 10, 10), ('p2', 'img')),
+            (104, (0, 0, 0, 0, 8, 4), ()),
+            (105, (), ('p2',)),
+            (103, (0, 0, 0, 0, 1, 1), ('p1', 'img')),
+        ])
+
+    def test_drop_contained_rects(self):
+        self.assertEqual(drop_contained_rects([(0, 0, 4, 4), (0, 0, 4, 4),
+                                               (1, 1, 2, 2), (4, 0, 4, 4)]),
+                         [(0, 0, 4, 4), (4, 0, 4, 4)])
+        self.assertEqual(drop_contained_rects([(1, 1, 2, 2), (2, 2, 4, 4),
+                                               (0, 0, 4, 4)]),
+                         [(2, 2, 4, 4), (0, 0, 4, 4)])
+
+    def test_clear_ink_regions_not_grown(self):
+        """Clearing ink or flashing is limited to the rectangles asked for"""
+        ds = self.ds
+        with ds.batch():
+            ds.update_region_of_page(0, 0, 0, 0, 10, 10, 'p1', 'img',
+                                     clear_ink=True)
+            ds.update_region_of_page(5, 5, 5, 5, 10, 10, 'p1', 'img',
+                                     clear_ink=True)
+            ds.update_region_of_page(2, 2, 2, 2, 4, 4, 'p1', 'img',
+                                     clear_ink=True)
+            ds.update_region_of_page(0, 0, 0, 0, 10, 10, 'p1', 'img',
+                                     clear_ink=True)
+            ds.update_region_of_infobar(0, 0, 0, 0, 4, 4, flash=True)
+            ds.update_region_of_infobar(4, 0, 4, 0, 4, 4, flash=True)
+        burst = [(m.op_code, m.options, m.int_args) for m in self.sent[0]]
+        self.assertEqual(burst, [
+            (103, 0x10, (0, 0, 0, 0, 10, 10)),
+            (103, 0x10, (5, 5, 5, 5, 10, 10)),
+            (104, 0x02, (0, 0, 0, 0, 4, 4)),
+            (104, 0x02, (4, 0, 4, 0, 4, 4)),
+        ])
+
+    def test_interleaved_keys_keep_order(self):
+        """A, B, A on one rect leaves A on the screen"""
+        ds = self.ds
+        with ds.batch():
+            ds.update_region_of_page(0, 0, 0, 0, 10, 10, 'p1', 'imgA')
+            ds.update_region_of_page(0, 0, 0, 0, 10, 10, 'p1', 'imgB')
+            ds.update_region_of_page(0, 0, 0, 0, 10, 10, 'p1', 'imgA')
+        burst = [m.char_args for m in self.sent[0]]
+        self.assertEqual(burst, [('p1', 'imgA'), ('p1', 'imgB'),
+                                 ('p1', 'imgA')])
+
+    def test_batch_wait(self):
+        ds = self.ds
+        def complete(*packets):
+            self.sent.append(packets)
+            last = ds_message.decode(packets[-1])
+            ds.handle_request_completion(last.request_id)
+        ds._send = complete
+        with ds.batch(wait=True):
+            ds.next_page()
+            with ds.batch():
+                ds.prev_page()
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(self.sent[0]), 2)
+        self.assertNotEqual(ds_message.decode(self.sent[0][-1]).request_id, 0)
+
+    def tearDown(self):
+        del self.ds._send
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDSBatch)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,55 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import threading, unittest
+from ew.launcher.display_server import DSDatagramSender, DSRequest, DSWait
+from ew.util.ds_message import DsMessage
+
+ds_message = DsMessage()
+
+class TestDSWait(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.ds = DSDatagramSender.instance()
+        self.ds._send = lambda *packets: self.sent.extend(
+                ds_message.decode(packet) for packet in packets)
+
+    def test_ids_not_reused_while_pending(self):
+        wait = DSWait()
+        wait._next_id = 0xfffe
+        first = [wait.prewait('op') for n in range(3)]
+        self.assertEqual([r.request_id for r in first], [0xfffe, 0xffff, 1])
+        wait._next_id = 0xffff
+        self.assertEqual(wait.prewait('op').request_id, 2)
+        # unknown and repeated completions are ignored
+        wait.notify_event(1)
+        wait.notify_event(1)
+        wait.notify_event(1234)
+        self.assertTrue(first[2].done())
+        self.assertEqual(first[2].result(), None)
+
+    def test_submit_and_wait(self):
+        ds = self.ds
+        requests = [ds.submit('jump_to_page', 'p%d' % n) for n in range(3)]
+        requests.append(ds.submit(ds.next_page, timeout=0.05))
+        self.assertEqual([m.request_id for m in self.sent],
+                         [r.request_id for r in requests])
+        self.assertRaises(DSRequest.Timeout, ds.wait_any, requests, 0.01)
+
+        threading.Timer(0.01, ds.handle_request_completion,
+                        (requests[1].request_id, 7)).start()
+        self.assertEqual(ds.wait_any(requests, 5), [requests[1]])
+        self.assertEqual(requests[1].error, 7)
+
+        ds.handle_request_completion(requests[0].request_id)
+        ds.handle_request_completion(requests[2].request_id)
+        # the last request expires on its own timeout
+        self.assertRaises(DSRequest.Timeout, ds.wait_all, requests, 5)
+        self.assertTrue(requests[3].timed_out)
+        self.assertEqual(ds.wait_all(requests[:3]), [None, 7, None])
+        self.assertEqual(ds.latency_stats()['jump_to_page']['count'], 3)
+
+    def tearDown(self):
+        del self.ds._send
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDSWait)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,133 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import os, socket, tempfile, threading, unittest
+from struct import pack
+from array import array
+from ew.launcher.ds_event_dispatch import (DSDatagramReceiver, DSEventLoop,
+        StrokeSamples, merge_partial_strokes)
+from ew.util.reactor import Reactor
+
+class Runner(object):
+    def __init__(self):
+        for name in ('on_stroke', 'on_page', 'on_submit', 'on_read_complete',
+                'on_render_complete', 'on_error', 'on_stroke_file_ready',
+                'on_landscape', 'on_portrait', 'on_sleep', 'on_doze',
+                'on_wake', 'on_shutdown', 'on_fuel_gauge_change',
+                'on_viewport_change'):
+            setattr(self, name, getattr(self, 'handle'))
+
+    def handle(self, *args):
+        pass
+
+class TestDSEventDecoding(unittest.TestCase):
+    def setUp(self):
+        self.receiver = DSDatagramReceiver(Runner())
+
+    def test_strings(self):
+        data = pack('!II5s3xI4s', 6, 5, 'a.stf', 4, 'b.pg')
+        self.assertEqual(self.receiver._get_handler_information(data)[1],
+                         ['a.stf', 'b.pg'])
+        data = pack('!II3si', 3, 3, 'abc', -1)
+        self.assertEqual(self.receiver.unpack_ds_event_data('si', data),
+                         ['abc', -1])
+        # truncated events decode to no arguments
+        self.assertEqual(self.receiver.unpack_ds_event_data('si', data[:-2]),
+                         [])
+
+    def test_stroke(self):
+        points = [(1, 2), (300, 65535), (7, 0)]
+        data = pack('!IiiI2s2xiI6H', 0, 4, 1, 2, 'w1', 1234, 3,
+                    *[c for p in points for c in p])
+        function, args = self.receiver._get_handler_information(data)
+        self.assertEqual(args[:4], (4, 1, 'w1', 1234))
+        samples = args[4]
+        self.assertEqual(list(samples.coords), [1, 2, 300, 65535, 7, 0])
+        self.assertEqual(samples, points)
+        self.assertEqual(len(samples), 3)
+        self.assertEqual(samples[0][1], 2)
+        self.assertEqual(samples[-1], (7, 0))
+        self.assertEqual(samples[1:], points[1:])
+        self.assertEqual(list(samples), points)
+        self.assertRaises(IndexError, samples.__getitem__, 3)
+        # too few samples for the count
+        function, args = self.receiver._get_handler_information(data[:-4])
+        self.assertEqual(args, [])
+
+class TestStrokeCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.runner = Runner()
+        self.receiver = DSDatagramReceiver(self.runner)
+        self.queue = self.receiver._queue
+
+    def put_stroke(self, index, flags, window_id, *coords):
+        self.queue.put((self.runner.on_stroke, (index, flags, window_id, 100,
+                        StrokeSamples(array('H', coords)))),
+                       merge=merge_partial_strokes)
+
+    def test_partial_strokes_merge(self):
+        self.put_stroke(1, 0x01, 'w', 1, 2)
+        self.put_stroke(1, 0, 'w', 3, 4, 5, 6)
+        self.put_stroke(1, 0x02, 'w', 7, 8)
+        self.put_stroke(2, 0x01, 'w', 9, 9)     # next stroke
+        self.put_stroke(2, 0, 'x', 9, 9)        # other window
+        self.queue.put((self.runner.on_submit, ()))
+        self.put_stroke(2, 0x02, 'x', 9, 9)     # not consecutive
+        stats = self.queue.stats()
+        self.assertEqual((stats['depth'], stats['coalesced']), (5, 2))
+
+        function, args = self.queue.get()
+        self.assertEqual(args[:4], (1, 0x03, 'w', 100))
+        self.assertEqual(args[4], [(1, 2), (3, 4), (5, 6), (7, 8)])
+        self.assertEqual([len(self.queue.get()[1]) for n in range(4)],
+                         [5, 5, 0, 5])
+        stats = self.queue.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['max_depth'], 5)
+        self.assertEqual(stats['lag']['count'], 5)
+
+    def test_handler_gets_list(self):
+        strokes = []
+        self.runner.on_stroke = lambda *args: strokes.append(args)
+        self.put_stroke(1, 0x01, 'w', 1, 2)
+        self.put_stroke(1, 0x02, 'w', 3, 4)
+        self.queue.put(("STOP", ()))
+        DSEventLoop(self.receiver).run()
+        self.assertEqual(strokes, [(1, 0x03, 'w', 100, [(1, 2), (3, 4)])])
+        self.assertEqual(type(strokes[0][4]), list)
+
+class TestReactorReceiving(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.done = threading.Event()
+        runner = Runner()
+        runner.on_submit = lambda: self.calls.append('on_submit')
+        runner.on_read_complete = lambda request_id: \
+                self.calls.append(('on_read_complete', request_id))
+        runner.on_landscape = lambda: (self.calls.append('on_landscape'),
+                                       self.done.set())
+        self.receiver = DSDatagramReceiver(runner)
+        self.reactor = Reactor('test-reactor')
+        self.path = os.path.join(tempfile.mkdtemp(), 'ds_events')
+
+    def tearDown(self):
+        self.receiver.stop_service()
+        self.reactor.close()
+        os.remove(self.path)
+        os.rmdir(os.path.dirname(self.path))
+
+    def test_datagrams(self):
+        self.receiver.start_service(self.reactor, self.path)
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        for data in pack('!I', 2), pack('!Ii', 3, 17), pack('!I', 7):
+            sender.sendto(data, self.path)
+        sender.close()
+        self.reactor.run_once(1)
+        self.done.wait(2)
+        self.assertEqual(sorted(self.calls),
+                         sorted([('on_read_complete', 17), 'on_submit',
+                                 'on_landscape']))
+
+if __name__ == "__main__":
+    for case in TestDSEventDecoding, TestStrokeCoalescing, \
+            TestReactorReceiving:
+        suite = unittest.TestLoader().loadTestsFromTestCase(case)
+        unittest.TextTestRunner(verbosity=2).run(suite)
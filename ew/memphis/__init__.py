@@ -1,3 +1,3 @@
 #!/usr/bin/env python
 
-__all__ = ["file", "mlogging", "pdfconverter","constants"]
\ No newline at end of file
+__all__ = ["file", "mlogging", "pdfconverter","constants","catalog"]
\ No newline at end of file
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""Persistent catalog of the memphis documents in a data directory.
+
+A DocumentCatalog records, for every document in a directory such as
+data_home/inbox, the few fields the choosers display: title, mod_time,
+status, error_status and creation_time. Listing the directory then costs a
+read of one JSON file instead of opening every document.
+
+The catalog is kept up to date incrementally (update, remove, set_status,
+and MemphisFile.save), and is validated against the mtime of the
+directory, so documents added or removed behind its back are picked up by a
+rescan that only re-reads documents whose metadata files changed. Documents
+changed in place, which leaves the directory mtime alone, are caught by
+comparing the stamp of every entry each time the entries are listed.
+"""
+
+from __future__ import with_statement
+
+import errno
+import json
+import os
+import threading
+import time
+
+from ew.util import docid_from_path, ew_logging
+from ew.util import system_config
+from ew.util.lock import ExclusiveLock
+from file import MemphisFile, metadataPathFor
+from export import log_epoch, parse_log_record, read_log_entries
+
+logger = ew_logging.getLogger('ew.memphis.catalog')
+
+TITLE_KEY = 'memphis.title'
+ERROR_STATUS_KEY = 'memphis.delivery.errorstatus'
+
+_catalogs = {}
+
+def catalog_for(directory):
+    """Return the DocumentCatalog for directory, or None if directory is
+    not under system_config.data_home."""
+    directory = os.path.abspath(directory)
+    catalog = _catalogs.get(directory)
+    if catalog is None:
+        path = catalog_path_for(directory)
+        if not path:
+            return None
+        catalog = _catalogs[directory] = DocumentCatalog(directory, path)
+    return catalog
+
+def catalog_for_subdir(subdir='inbox'):
+    """Return the DocumentCatalog for data_home/subdir"""
+    return catalog_for(os.path.join(system_config.data_home, subdir))
+
+def catalog_path_for(directory):
+    relpath = os.path.relpath(directory, os.path.abspath(system_config.data_home))
+    if relpath.startswith(os.pardir) or relpath == os.curdir:
+        return None
+    return os.path.join(system_config.catalog_dir,
+                        relpath.replace(os.sep, '.') + '.json')
+
+def document_saved(memphisfile):
+    """Refresh the catalog entry of a document that has just been saved,
+    if the directory it is in has a catalog."""
+    path = os.path.abspath(memphisfile.filepath)
+    catalog = catalog_for(os.path.dirname(path))
+    if catalog and os.path.exists(catalog.path):
+        catalog.update(docid_from_path(path), memphisfile)
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        return 0
+
+def document_stamp(path):
+    """mtimes of the document directory and of the files the catalog
+    fields are read from"""
+    metadir = metadataPathFor(path)
+    return [_mtime(path),
+            _mtime(os.path.join(metadir, 'memphis.metadata.json')),
+            _mtime(os.path.join(metadir, 'memphis.info.json'))]
+
+def creation_time(path):
+    """epoch time the document at path was created, the Time of the first
+    entry in its document log; the document mtime if that is unknown"""
+    metadir = metadataPathFor(path)
+    logpath = os.path.join(metadir, 'memphis.log')
+    entries = read_log_entries(logpath) if os.path.exists(logpath) else []
+    if entries:
+        try:
+            with open(os.path.join(metadir, entries[0].split('-')[1])) as f:
+                created = log_epoch(parse_log_record(f.read()).get('Time', ''))
+            if created:
+                return created
+        except IOError, e:
+            logger.warn('no first log entry for %s: %s', path, e)
+    return _mtime(path)
+
+
+class DocumentCatalog(object):
+    """Catalog of the documents in one directory.
+    Use catalog_for() rather than creating instances directly, so that a
+    process shares one instance per directory.
+
+    """
+
+    def __init__(self, directory, path):
+        self.directory = directory
+        self.path = path
+        self._thread_lock = threading.RLock()
+
+    def entries(self):
+        """Return a dict of docid -> entry dict for every document in the
+        directory, rescanning the directory first if it has changed, and
+        otherwise re-reading the entries whose document stamp changed.
+
+        """
+        with self._lock():
+            data = self._load()
+            dir_mtime = _mtime(self.directory)
+            # a directory modified within a second of the last scan may
+            # have changed again without its mtime moving
+            if dir_mtime != data['directory_mtime'] or \
+                    dir_mtime >= data['scan_time'] - 1:
+                self._rescan(data, dir_mtime)
+                self._store(data)
+            elif self._refresh_changed(data):
+                self._store(data)
+            return dict(data['documents'])
+
+    def get(self, docid):
+        """Return the entry for docid, or None if it is not a document in
+        the directory."""
+        return self.entries().get(docid)
+
+    def update(self, docid, memphisfile=None):
+        """Re-read the entry for docid from the document.
+        An already open MemphisFile for it may be passed in memphisfile.
+        Returns the new entry, or None if the document does not exist.
+
+        """
+        with self._lock():
+            data = self._load()
+            path = os.path.join(self.directory, docid + '.memphis')
+            documents = data['documents']
+            if os.path.isdir(path):
+                documents[docid] = self._read_entry(path, documents.get(docid),
+                                                    memphisfile)
+            else:
+                documents.pop(docid, None)
+            self._store(data)
+            return documents.get(docid)
+
+    def remove(self, docid):
+        with self._lock():
+            data = self._load()
+            if data['documents'].pop(docid, None):
+                self._store(data)
+
+    def set_status(self, docid, status):
+        """Record the chooser status (New, Submitted, ...) of docid"""
+        with self._lock():
+            data = self._load()
+            entry = data['documents'].get(docid)
+            if entry and entry.get('status') != status:
+                entry['status'] = status
+                self._store(data)
+
+    #--------------------------------------------------------------------------
+    #   Internal utilities
+    #--------------------------------------------------------------------------
+
+    def _lock(self):
+        """Lock against other threads and other processes"""
+        return _CatalogLock(self)
+
+    def _load(self):
+        data = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                logger.error('unreadable catalog %s: %s', self.path, e)
+        except ValueError, e:
+            logger.error('unreadable catalog %s: %s', self.path, e)
+        data.setdefault('directory_mtime', None)
+        data.setdefault('scan_time', 0)
+        data.setdefault('documents', {})
+        return data
+
+    def _store(self, data):
+        with open(self.path, 'w') as f:
+            json.dump(data, f, sort_keys=True, indent=1)
+
+    def _rescan(self, data, dir_mtime):
+        logger.debug('rescanning %s', self.directory)
+        scan_time = time.time()
+        documents = data['documents']
+        found = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.memphis'):
+                continue
+            docid = docid_from_path(name)
+            path = os.path.join(self.directory, name)
+            entry = documents.get(docid)
+            if entry and entry.get('stamp') == document_stamp(path):
+                found[docid] = entry
+            else:
+                found[docid] = self._read_entry(path, entry)
+        data['documents'] = found
+        data['directory_mtime'] = dir_mtime
+        data['scan_time'] = scan_time
+
+    def _refresh_changed(self, data):
+        """Re-read the entries whose document stamp changed, dropping those
+        whose document is gone. Returns whether any entry changed."""
+        documents = data['documents']
+        changed = False
+        for docid, entry in documents.items():
+            path = os.path.join(self.directory, docid + '.memphis')
+            stamp = document_stamp(path)
+            if entry.get('stamp') == stamp:
+                continue
+            changed = True
+            if stamp[0]:
+                documents[docid] = self._read_entry(path, entry)
+            else:
+                del documents[docid]
+        return changed
+
+    def _read_entry(self, path, previous=None, memphisfile=None):
+        docid = docid_from_path(path)
+        logger.debug('cataloging memphis doc @%s', path)
+        if memphisfile is None:
+            with MemphisFile(path, lazy=True) as mf:
+                title, error = self._read_fields(mf, docid)
+        else:
+            title, error = self._read_fields(memphisfile, docid)
+        previous = previous or {}
+        return dict(title=title,
+                    mod_time=_mtime(path),
+                    status=previous.get('status'),
+                    error_status=error,
+                    creation_time=previous.get('creation_time') or
+                                  creation_time(path),
+                    stamp=document_stamp(path))
+
+    def _read_fields(self, mf, docid):
+        title = mf.metadata.get(TITLE_KEY) or mf.info.get(TITLE_KEY, docid)
+        return title, mf.info.get(ERROR_STATUS_KEY)
+
+
+class _CatalogLock(object):
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.file_lock = None
+
+    def __enter__(self):
+        self.catalog._thread_lock.acquire()
+        try:
+            catalog_dir = os.path.dirname(self.catalog.path)
+            try:
+                os.makedirs(catalog_dir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            self.file_lock = ExclusiveLock(self.catalog.path + '.lock')
+            self.file_lock.acquire()
+        except:
+            self.catalog._thread_lock.release()
+            raise
+
+    def __exit__(self, type, value, traceback):
+        try:
+            self.file_lock.release()
+            self.file_lock.close()
+        finally:
+            self.catalog._thread_lock.release()
@@ -5,6 +5,8 @@
 #--------------------------------------------------------------------------------------------------
 BASEMETADATADIR 		= "memphis.document.d"   			# The standard name for the metadata directory
 PAGELISTFILENAME 		= "memphis.pagelist"				# The standard name for the simple pagelist file
+MANIFESTFILENAME 		= "memphis.manifest.json"			# Member hashes, added to zip exports
+INKSTOREFILENAME 		= "memphis.ink"						# Binary ink of a page, see ink_store.py
 
 #--------------------------------------------------------------------------------------------------
 # Metadata Constants
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""Streaming zip export of memphis documents.
+
+The archive is written front to back to any object with a write() method,
+such as an open file or socket.makefile('wb'), so no temporary zip is
+needed. Members that are already compressed are stored as is; the others
+are deflated on a pool of worker threads (zlib releases the GIL).
+
+A manifest of member hashes is added as the last member. Hashes already
+recorded in the memphis logs (entry files are named by their own hash, and
+base image, meta file and stroke file entries carry the hash of the file
+they add) are reused, so only files without a current log hash are hashed.
+
+A delta export holds only what was added after a given running hash: the
+new log lines as partial logs (memphis.*.plog), their entry files, and the
+files those entries add. Saving a changed pagelist or info file logs it as
+an AddMetaFile entry, so page additions, removals and reordering and info
+changes travel the same way.
+"""
+
+from __future__ import with_statement
+
+import glob
+import json
+import os
+import random
+import time
+import zipfile
+import zlib
+
+import constants as mc
+from mlogging import (HASHTYPEPREFIX, LINE_PREFIX, NEWLINE, hashobject,
+        hashprefix, stringcbi)
+from ew.util.worker_pool import WorkerPool
+from ew.util import ew_logging
+
+logger = ew_logging.getLogger('ew.memphis.export')
+
+EXPORT_WORKERS = 2
+# Formats that do not get any smaller when deflated
+STORED_EXTENSIONS = frozenset(['.jpg', '.jpeg', '.png', '.gif', '.ogg',
+                               '.mp3', '.zip', '.gz'])
+LOG_TIME_FORMAT = '%Y%m%d%H%M%S'
+
+class UnknownHashError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def export_zip(filepath, fileobj, members, workers=EXPORT_WORKERS,
+               manifest=True, extra=()):
+    """Write the files at the paths "members", all under the document
+    directory filepath, as a zip archive to fileobj.
+    Member names are the paths with filepath removed, as saveZipTo has
+    always done. "extra" holds (path, data) pairs for members that are not
+    files on disk. If manifest is true a mc.MANIFESTFILENAME member mapping
+    member names to hashes is added.
+
+    """
+    l = len(filepath)
+    members = list(members)
+    known = known_hashes(filepath, members) if manifest else {}
+
+    def prepare(path):
+        return _prepare_member(path, path[l:], known.get(path), manifest)
+
+    hashes = {}
+    zf = _StreamingZipFile(_CountingWriter(fileobj))
+    pool = WorkerPool(workers, name='zip-export')
+    try:
+        for zinfo, data, cbi in pool.imap(prepare, members):
+            zf.writecompressed(zinfo, data)
+            hashes[zinfo.filename] = cbi
+        for path, data in extra:
+            zf.writestr(path[l:], data, zipfile.ZIP_DEFLATED)
+            hashes[path[l:]] = stringcbi(data)
+        if manifest:
+            arcname = os.path.join(filepath, mc.MANIFESTFILENAME)[l:]
+            zf.writestr(arcname, json.dumps(hashes, sort_keys=True, indent=1),
+                        zipfile.ZIP_DEFLATED)
+    finally:
+        pool.close()
+        zf.close()
+    return hashes
+
+def _prepare_member(path, arcname, cbi, want_hash):
+    """Read and compress one member on a worker thread.
+    Returns (ZipInfo, compressed data, cbi); the data is hashed only if
+    want_hash is true and no cbi is known for it.
+
+    """
+    st = os.stat(path)
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16L
+    with open(path, 'rb') as f:
+        data = f.read()
+    if cbi is None and want_hash:
+        h = hashobject()
+        h.update(data)
+        cbi = hashprefix() + h.hexdigest()
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data) & 0xffffffff
+    if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+        zinfo.compress_type = zipfile.ZIP_STORED
+    else:
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        co = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        data = co.compress(data) + co.flush()
+    zinfo.compress_size = len(data)
+    return zinfo, data, cbi
+
+#------------------------------------------------------------------------------
+#   Hashes recorded in the logs
+#------------------------------------------------------------------------------
+
+def known_hashes(filepath, members):
+    """Return a dict of member path -> cbi for the members whose current
+    hash is recorded in a memphis log of the document.
+
+    """
+    known = {}
+    recorded = {}   # path -> (cbi, Time of the entry that recorded it)
+    for path in members:
+        logdir, name = os.path.split(path)
+        if not name.startswith(HASHTYPEPREFIX):
+            continue
+        # log entry files are named by their own hash
+        known[path] = name
+        try:
+            with open(path, 'rb') as f:
+                record = parse_log_record(f.read())
+        except IOError:
+            continue
+        logtime = record.get('Time', '')
+        for target, cbi in _recorded_files(filepath, logdir, record):
+            if target not in recorded or recorded[target][1] < logtime:
+                recorded[target] = cbi, logtime
+    members = set(members)
+    for path, (cbi, logtime) in recorded.iteritems():
+        # only trust a hash logged after the file was last modified
+        if path in members and path not in known and \
+                os.stat(path).st_mtime <= log_epoch(logtime):
+            known[path] = cbi
+    return known
+
+def parse_log_record(logrecord):
+    """Return the fields of a log entry record as a dict"""
+    fields = {}
+    for line in logrecord.split(NEWLINE):
+        key, sep, value = line.partition(': ')
+        if sep:
+            fields[key] = value
+    return fields
+
+def _recorded_files(filepath, logdir, record):
+    """yields (path, cbi) for the file whose hash a log record carries"""
+    opcode = record.get('Opcode')
+    if opcode == 'BaseImageUpdated' and 'ImageHash' in record:
+        yield os.path.join(filepath, record['PageID']), record['ImageHash']
+    elif opcode == 'AddStrokeFile' and 'Hash' in record:
+        yield os.path.join(logdir, record['Path']), record['Hash']
+    elif opcode == 'AddMetaFile' and 'Hash' in record:
+        # Path was the full target path when logged; keep the part inside
+        # the log directory.
+        marker = os.path.basename(logdir) + os.sep
+        relpath = record['Path'].rpartition(marker)[2]
+        yield os.path.join(logdir, relpath), record['Hash']
+
+def log_epoch(logtime):
+    """epoch time of a log record Time field, or 0 if it is malformed"""
+    try:
+        seconds = time.mktime(time.strptime(logtime[:14], LOG_TIME_FORMAT))
+        return seconds + int(logtime[14:] or 0) / 1e6
+    except ValueError:
+        return 0
+
+#------------------------------------------------------------------------------
+#   Delta packaging
+#------------------------------------------------------------------------------
+
+def delta_members(filepath, pagenames, acked_hash):
+    """Work out what a peer holding the document as of the running hash
+    acked_hash (a memphis.currenthash value) is missing.
+
+    Returns (members, extra, head_hash): the paths of the files to send,
+    (path, data) pairs for the partial logs (memphis.*.plog) carrying the
+    log lines added since acked_hash, and the running hash after them.
+    The pagelist, info and metadata files are sent if those log lines
+    record a change to them. Pages the peer has never seen get their whole
+    memphis.log instead.
+    Raises UnknownHashError if acked_hash is not in the document log.
+
+    """
+    docdir = os.path.join(filepath, mc.BASEMETADATADIR)
+    entries = read_log_entries(log_path_in(docdir))
+    position = _position_after(entries, acked_hash)
+    if position is None:
+        raise UnknownHashError('%s is not in the log of %s' % (acked_hash,
+                                                               filepath))
+    members, extra = [], []
+    _add_log_delta(filepath, docdir, entries[position:], members, extra)
+    head_hash = stringcbi(entries[-1]) if entries else acked_hash
+
+    acked_pages = _acked_page_hashes(docdir, entries[:position], pagenames)
+    for pagename in pagenames:
+        pagedir = os.path.splitext(os.path.join(filepath, pagename))[0] + '.d'
+        logpath = log_path_in(pagedir)
+        if not logpath:
+            continue
+        page_entries = read_log_entries(logpath)
+        if pagename in acked_pages:
+            page_position = _position_after(page_entries,
+                                            acked_pages[pagename])
+        else:
+            page_position = None
+        if page_position is None:
+            # a page the peer does not have: send its whole log
+            members.append(logpath)
+            members.append(os.path.join(docdir, mc.PAGELISTFILENAME))
+            _add_log_delta(filepath, pagedir, page_entries, members, None)
+        else:
+            _add_log_delta(filepath, pagedir, page_entries[page_position:],
+                           members, extra)
+    return [m for m in _unique(members) if os.path.isfile(m)], extra, head_hash
+
+def log_path_in(logdir):
+    """the log (or partial log) file in logdir, or None"""
+    logpath = os.path.join(logdir, 'memphis.log')
+    if os.path.exists(logpath):
+        return logpath
+    plogs = glob.glob(os.path.join(logdir, "memphis.*.plog"))
+    return plogs[0] if plogs else None
+
+def read_log_entries(logpath):
+    """Return the entries ("prevcbi-cbi") of a log file, in order, leaving
+    out the initial null entry."""
+    entries = []
+    if logpath:
+        with open(logpath, 'rb') as logf:
+            for line in logf.read().split(NEWLINE):
+                if line.startswith(LINE_PREFIX) and '-' in line:
+                    entries.append(line[len(LINE_PREFIX):])
+    return entries
+
+def _position_after(entries, acked_hash):
+    """index of the first entry after the one whose running hash is
+    acked_hash, or None if there is no such entry"""
+    if entries and entries[0].split('-')[0] == acked_hash:
+        return 0 # a partial log starting from acked_hash
+    for index, entry in enumerate(entries):
+        if stringcbi(entry) == acked_hash:
+            return index + 1
+    return None
+
+def _entry_records(logdir, entries):
+    """yields (entry file path, parsed record) for the cbis of entries"""
+    for entry in entries:
+        for cbi in entry.split('-')[1:]:
+            path = os.path.join(logdir, cbi)
+            try:
+                with open(path, 'rb') as f:
+                    yield path, parse_log_record(f.read())
+            except IOError:
+                logger.warn('missing log entry file %s', path)
+
+def _add_log_delta(filepath, logdir, entries, members, extra):
+    """Add the entry files of entries, and the files they refer to, to
+    members, and a partial log of them to extra (unless extra is None)."""
+    if not entries:
+        return
+    if extra is not None:
+        plog = os.path.join(logdir, 'memphis.%s.plog' %
+                            hex(random.getrandbits(128)))
+        extra.append((plog, ''.join([LINE_PREFIX + entry + NEWLINE
+                                     for entry in entries])))
+    for path, record in _entry_records(logdir, entries):
+        members.append(path)
+        for target, _ in _recorded_files(filepath, logdir, record):
+            members.append(target)
+        if record.get('Opcode') in ('SetMetadata', 'RemoveMetadata'):
+            members.append(os.path.join(logdir, 'memphis.metadata.json'))
+
+def _acked_page_hashes(docdir, acked_entries, pagenames):
+    """Return a dict of page name -> the last page log hash recorded in the
+    document log entries the peer already has."""
+    acked = {}
+    wanted = set(pagenames)
+    for _, record in _entry_records(docdir, reversed(acked_entries)):
+        if record.get('Opcode') in ('PageUpdated', 'PageMetadataUpdated'):
+            pagename = os.path.basename(record.get('PageID', ''))
+            if pagename in wanted and pagename not in acked:
+                acked[pagename] = record.get('LastEntry')
+                if len(acked) == len(wanted):
+                    break
+    return acked
+
+def _unique(items):
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+#------------------------------------------------------------------------------
+#   Zip writing
+#------------------------------------------------------------------------------
+
+class _CountingWriter(object):
+    """Adds the tell() zipfile needs to a write-only stream such as a
+    socket file."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.position = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        self.fileobj.flush()
+
+class _StreamingZipFile(zipfile.ZipFile):
+    """ZipFile that never seeks, and accepts members compressed elsewhere."""
+
+    def __init__(self, fileobj):
+        zipfile.ZipFile.__init__(self, fileobj, "w")
+
+    def writecompressed(self, zinfo, data):
+        """Write a member whose CRC, sizes and compress_type are already set
+        in zinfo, and whose data is already compressed accordingly."""
+        zinfo.header_offset = self.fp.tell()
+        self._didModify = True
+        self.fp.write(zinfo.FileHeader())
+        self.fp.write(data)
+        self.filelist.append(zinfo)
+        self.NameToInfo[zinfo.filename] = zinfo
@@ -14,13 +14,15 @@ STDIMAGEFORMAT = "PPM"
 #------------------------------------------------------------------------------
 import errno
 import os
-import zipfile
 
 import json
 
 
 import constants as mc
-from mlogging import MemphisLog, filecbi, hashobject, hashprefix
+import export
+from ink_store import InkStore, InkStoreError
+from mlogging import (MemphisLog, LogTransaction, TAIL_SUFFIX, copyandhash,
+        filecbi)
 
 from ew.util.lock import ExclusiveLock, SharedLock
 
@@ -47,6 +49,32 @@ class FormatError(Exception):
     def __init__(self, msg):
         self.msg = msg
 
+class _Component(object):
+    """Descriptor for a part of an open MemphisFile (metadata, pages, ...)
+    that is built by "factory" the first time it is used.
+    Reads as None until the file is opened.
+
+    """
+    def __init__(self, name, factory):
+        self.attr = '_' + name
+        self.factory = factory
+
+    def __get__(self, memphisfile, cls):
+        if memphisfile is None:
+            return self
+        value = memphisfile.__dict__.get(self.attr)
+        if value is None and memphisfile.isopen:
+            value = self.factory(memphisfile)
+            memphisfile.__dict__[self.attr] = value
+        return value
+
+    def __set__(self, memphisfile, value):
+        memphisfile.__dict__[self.attr] = value
+
+    def loaded(self, memphisfile):
+        """The component if it has been built, otherwise None."""
+        return memphisfile.__dict__.get(self.attr)
+
 class MemphisFile(object):
     '''MemphisFile
     The Memphisfile class is a generalized editing library for Memphis
@@ -62,13 +90,32 @@ class MemphisFile(object):
     developer metadata should be placed in the metadata object. Both of these
     objects are intended to have keys and values that are string objects.
 
+    If lazy is true, open() does not read anything; each of those objects
+    is loaded the first time it is used, and save() only saves the ones
+    that were loaded. This makes opening a document to read a single key
+    cheap.
+
     '''
-    def __init__(self,filepath):
+    metadata = _Component('metadata',
+            lambda mf: MemphisMetadata(mf, mf.filepath))
+    mlog = _Component('mlog',
+            lambda mf: MemphisLog(metadataPathFor(mf.filepath)))
+    info = _Component('info', lambda mf: MemphisInfo(mf, mf.filepath))
+    localinfo = _Component('localinfo',
+            lambda mf: MemphisLocalInfo(mf, mf.filepath))
+    pages = _Component('pages', lambda mf: MemphisFilePageList(mf))
+
+    _components = 'metadata', 'mlog', 'info', 'localinfo', 'pages'
+
+    def __init__(self,filepath,lazy=False):
         self.filepath = filepath
+        self.lazy = lazy
+        self.isopen = False
         self.metadata = None
         self.pages = None
         self.info = None
         self.localinfo = None
+        self.mlog = None
         self._page_log_hashes = {} #will only have entries for pages whose logs have been added to
 
     def __enter__(self): 
@@ -84,15 +131,31 @@ class MemphisFile(object):
 
         """
         self.__makeifneeded()
-        self.metadata = MemphisMetadata(self,self.filepath)
-        self.mlog = MemphisLog(self.metadata.metadatadir)
-        self.info = MemphisInfo(self,self.filepath)
-        self.localinfo = MemphisLocalInfo(self,self.filepath)
-        self.pages = MemphisFilePageList(self)
+        self.isopen = True
+        for name in self._components:
+            setattr(self, name, None)
+            if not self.lazy:
+                getattr(self, name)
         return self
 
+    def loaded(self, name):
+        """Return the named component (e.g. 'metadata') if it has been
+        loaded, otherwise None. Never loads it.
+
+        """
+        return getattr(type(self), name).loaded(self)
+
+
+    def add_stroke(self, page_id, points, millis=0):
+        """Appends a stroke drawn on a page to the page ink store, the next
+        stroke file logged for the page refers to it. Returns the index of
+        the stroke, see ew.memphis.ink_store."""
+        with self.page(page_id).ink_store() as store:
+            return store.append(points, millis=millis)
 
     def add_stroke_file(self, stroke_file_path):
+        """Logs the stroke file of a page, see
+        MemphisFilePage.add_stroke_file."""
         parts = stroke_file_path.split('.memphis/')
         page_parts = parts[1].split('.d/')
         page_id, stroke_file = page_parts
@@ -112,14 +175,32 @@ class MemphisFile(object):
         return save_hash
 
     def save(self):
-        '''Sync the memphis file to disk'''
-        self.info.save()
-        self.localinfo.save()
-        self.pages.save()
-        #for any pages whose log has been extended write the hash of the last item to my log
-        for page_id, hash_value in self._page_log_hashes.iteritems():
-            self.mlog.writePageUpdated(page_id, hash_value)
-        self.metadata.save()
+        '''Sync the memphis file to disk.
+        All log entries written by the save go out in one LogTransaction.
+        A rewritten pagelist or info file is logged as an AddMetaFile entry
+        with its new hash, so delta exports carry it.
+        If the metadata or info changed, the document's catalog entry is
+        refreshed.'''
+        cataloged_change = [c for c in (self.loaded('metadata'),
+                                         self.loaded('info'))
+                            if c is not None and c.needs_rewrite]
+        logged_files = [c.jsonpath if name == 'info' else c.pagelistpath
+                        for name, c in (('info', self.loaded('info')),
+                                        ('pages', self.loaded('pages')))
+                        if c is not None and c.needs_rewrite]
+        with LogTransaction():
+            for name in ('info', 'localinfo', 'pages'):
+                self.__saveifloaded(name)
+            for path in logged_files:
+                addExistingMetaFile(self.filepath, os.path.basename(path))
+            #for any pages whose log has been extended write the hash of the last item to my log
+            for page_id, hash_value in self._page_log_hashes.iteritems():
+                self.mlog.writePageUpdated(page_id, hash_value)
+            self.__saveifloaded('metadata')
+        self._page_log_hashes.clear()
+        if cataloged_change:
+            import catalog
+            catalog.document_saved(self)
 
     close = save
 
@@ -155,22 +236,41 @@ class MemphisFile(object):
         return True
 
     def saveZipTo(self,destpath):
-        self.save()
-
-        l = len(self.filepath)
-        file = zipfile.ZipFile(destpath, "w")
-        for membername in walk_files(self.filepath):
-            if os.path.basename(membername) != "memphis.localinfo.json":
-                file.write(membername,membername[l:],zipfile.ZIP_DEFLATED)
-        file.close()
+        with open(destpath, "wb") as zipf:
+            self.exportZip(zipf)
 
-        # open the file again, to see what's in it
+    def exportZip(self, fileobj, workers=export.EXPORT_WORKERS, manifest=True):
+        """Save, then stream the document as a zip archive to fileobj, which
+        only needs a write() method (e.g. an open file or a socket file).
+        Returns a dict of member name -> hash, which is also added to the
+        archive as a manifest member unless manifest is false.
+        See ew.memphis.export.
 
-        #file = zipfile.ZipFile(destpath, "r")
-        #for info in file.infolist():
-        #   print info.filename, info.date_time, info.file_size, \
-        #           info.compress_size
+        """
+        self.save()
+        members = [m for m in walk_files(self.filepath) if is_exported(m)]
+        return export.export_zip(self.filepath, fileobj, members, workers,
+                                 manifest)
+
+    def exportDeltaZip(self, fileobj, acked_hash,
+                       workers=export.EXPORT_WORKERS):
+        """Save, then stream as a zip archive to fileobj only what was added
+        to the document since the running hash acked_hash (a
+        memphis.currenthash value the receiver already has): the new log
+        lines as memphis.*.plog partial logs, their entry files, and the
+        stroke, meta and image files they add.
+        Returns the running hash the receiver will have after merging it.
+        Raises export.UnknownHashError if acked_hash is not in the log, in
+        which case a full exportZip is needed.
 
+        """
+        self.save()
+        members, extra, head_hash = export.delta_members(
+                self.filepath, list(self.pages), acked_hash)
+        export.export_zip(self.filepath, fileobj,
+                          [m for m in members if is_exported(m)], workers,
+                          extra=extra)
+        return head_hash
 
     def addMetaFile(self,frompath,newchildpath):
         addMetaFile(self.filepath,frompath,newchildpath)
@@ -198,6 +298,11 @@ class MemphisFile(object):
     #   Internal utilities
     #--------------------------------------------------------------------------
 
+    def __saveifloaded(self, name):
+        component = self.loaded(name)
+        if component is not None:
+            component.save()
+
     def __makeifneeded(self):
         '''Test the existence of the document directory, and if it does not
            exist create both the main directory and its document metadata
@@ -231,13 +336,15 @@ class MemphisFilePageList(list):
         self.memphisfile = memphisfile
         self.pagelistpath = os.path.join(self.memphisfile.filepath,
                 mc.BASEMETADATADIR,mc.PAGELISTFILENAME)
-        self.needs_rewrite = False
         self.pagesopened = {}
+        self._positions = None
 
         if os.path.exists(self.pagelistpath):
             with open(self.pagelistpath,"r") as infile:
                 for line in infile:
                     self.append(line.strip())
+        # loading is not a change
+        self.needs_rewrite = False
 
     def save(self):
         if self.needs_rewrite:
@@ -285,18 +392,38 @@ class MemphisFilePageList(list):
                     value = getattr(super(cls, self), op.__name__)(
                             *args, **kwargs)
                     self.needs_rewrite = True
+                    self._positions = None
                     return value
                 delegate.__name__ = op.__name__
                 setattr(cls, op.__name__, delegate)
             create_override(op)
 
+    def positions(self):
+        """Return a dict mapping each page id, both with and without its
+        image extension, to its index in the list. Where ids collide the
+        full name wins, then the earliest page. Rebuilt after any change
+        to the list.
+
+        """
+        if self._positions is None:
+            positions = {}
+            for index, name in enumerate(self):
+                positions.setdefault(name, index)
+            for index, name in enumerate(self):
+                positions.setdefault(name.split('.')[0], index)
+            self._positions = positions
+        return self._positions
+
+    def __contains__(self, key):
+        index = self.positions().get(key)
+        return index is not None and \
+                super(MemphisFilePageList, self).__getitem__(index) == key
+
     def normalize_key(self, key):
-        if not key in self:
-            for actual_key in self:
-                ak = actual_key.split('.')[0]
-                if ak == key:
-                    return actual_key
-        return key
+        index = self.positions().get(key)
+        if index is None:
+            return key
+        return super(MemphisFilePageList, self).__getitem__(index)
             
     def page(self, *args):
         '''Fetches page objects either by file name or index in the page list.
@@ -308,7 +435,7 @@ class MemphisFilePageList(list):
             key = args[0]
             if isinstance(key, str):
                 pkey = self.normalize_key(key) #pagelist has page image extension garbage in 1.0
-                if not super(MemphisFilePageList, self).__contains__(pkey):
+                if not pkey in self.positions():
                     logger.debug('no %s in %s', pkey, self)
                     raise KeyError(key)
                 return self.page_for(pkey)
@@ -362,27 +489,60 @@ class MemphisFilePage(object):
         #self.data = MemphisMetadata(self.memphisfile, self.filepath, "memphis.data.json")
 
     def setBaseImage(self,image,isOriginal=False):
-        if isinstance(image,str):
-            simplefilecopy(image,self.filepath)
-        elif PIL_EXISTS:
-            if isinstance(image,PIL.Image.Image):
-                image.save(self.filepath,STDIMAGEFORMAT)
-        self.mlog.writeBaseImageUpdated(self.pagename,filecbi(self.filepath))
+        """Make image (a file path or a PIL image) the page image.
+        If isOriginal, also keep a copy as the "original.<page>" meta file.
+        The image is read only once for all the copies and the hash.
 
+        """
+        copies = []
         if isOriginal:
             self.__makeifneeded()
             basename = os.path.basename(self.filepath)
             origpath = os.path.join(metadataPathFor(self.filepath),"%s.%s" % (
                     "original",basename))
-            self.addMetaFile(self.filepath,origpath)
+            origdir, origpath = metaFileTarget(self.filepath,origpath)
+            copies.append(origpath)
+        if isinstance(image,str):
+            imagehash = copyandhash(image,[self.filepath] + copies)
+        else:
+            if PIL_EXISTS and isinstance(image,PIL.Image.Image):
+                image.save(self.filepath,STDIMAGEFORMAT)
+            imagehash = copyandhash(self.filepath,copies)
+        self.mlog.writeBaseImageUpdated(self.pagename,imagehash)
+
+        if isOriginal:
+            MemphisLog(origdir).writeAddMetaFile(origpath,imagehash)
 
 
     def add_stroke_file(self,strokedataFile):
-        """chops strokedataFile to be page relative and logs it"""
+        """chops strokedataFile to be page relative and logs it.
+        If the ink store has strokes no stroke file was logged for yet, the
+        log entry refers to them as the ink of this stroke file; the stroke
+        file is logged even if the ink store cannot be read."""
         def relative_path(path):
             return path.split('/')[-1]
-        
-        self.mlog.writeAddStrokeFile(relative_path(strokedataFile))
+
+        inkstrokes = None
+        try:
+            if os.path.exists(self.inkStorePath()):
+                with self.ink_store() as store:
+                    start, stop = store.unreferenced()
+                    if stop > start:
+                        store.mark_referenced(stop)
+                        inkstrokes = start, stop
+        except (InkStoreError, EnvironmentError):
+            logger.exception('no ink logged for %s', strokedataFile)
+        self.mlog.writeAddStrokeFile(relative_path(strokedataFile), inkstrokes)
+
+    def inkStorePath(self):
+        return os.path.join(metadataPathFor(self.filepath), mc.INKSTOREFILENAME)
+
+    def ink_store(self, create=True):
+        """The InkStore of the page, see ew.memphis.ink_store. The caller
+        closes it."""
+        if create:
+            self.__makeifneeded()
+        return InkStore(self.inkStorePath(), create)
         
     def removeStrokeFile(self,strokeid):
         pass # TBD
@@ -579,20 +739,22 @@ class MemphisMetadata(dict):
         if self.needs_rewrite:
             mlog = MemphisLog(self.metadatadir)
 
-            # this removes any keys
-            self.logentrieswrite = self.logentrieswrite - self.logentriesdelete
-            for e in self.logentrieswrite:
-                #self[META_CURRENTHASH] = mlog.writeSetMetaEntry(e,self[e])
-                super(MemphisMetadata, self).__setitem__(
-                        mc.META_CURRENTHASH, mlog.writeSetMetaEntry(e,self[e]))
-
-            # this removes any delete entries that are not part of the
-            # original set of keys when we opened.
-            self.logentriesdelete = self.logentriesdelete & self.originalkeys
-            for e in self.logentriesdelete:
-                #self[META_CURRENTHASH] = mlog.writeRemoveMetaEntry(e)
-                super(MemphisMetadata, self).__setitem__(
-                        mc.META_CURRENTHASH, mlog.writeRemoveMetaEntry(e))
+            # all entries for the changed keys go out under one lock
+            with LogTransaction():
+                # this removes any keys
+                self.logentrieswrite = self.logentrieswrite - self.logentriesdelete
+                for e in self.logentrieswrite:
+                    #self[META_CURRENTHASH] = mlog.writeSetMetaEntry(e,self[e])
+                    super(MemphisMetadata, self).__setitem__(
+                            mc.META_CURRENTHASH, mlog.writeSetMetaEntry(e,self[e]))
+
+                # this removes any delete entries that are not part of the
+                # original set of keys when we opened.
+                self.logentriesdelete = self.logentriesdelete & self.originalkeys
+                for e in self.logentriesdelete:
+                    #self[META_CURRENTHASH] = mlog.writeRemoveMetaEntry(e)
+                    super(MemphisMetadata, self).__setitem__(
+                            mc.META_CURRENTHASH, mlog.writeRemoveMetaEntry(e))
 
             # NOTE = JSON Write must follow all metadata writes, so that
             # rolling hash is properly updated in JSON
@@ -666,7 +828,9 @@ class MemphisMetadata(dict):
 #   Utility Functions
 #------------------------------------------------------------------------------
 
-def addMetaFile(baseitempath,frompath,newchildpath):
+def metaFileTarget(baseitempath,newchildpath):
+    """Return (metadata directory, full target path) for the meta file
+    newchildpath of baseitempath, making any subdirectory it names."""
     # incoming path must include a file name, and may include subdirectory
     # structure
     newp = os.path.split(newchildpath)
@@ -678,48 +842,19 @@ def addMetaFile(baseitempath,frompath,newchildpath):
         if not os.path.exists(subdir):
             logger.info("making dir %s", subdir)
             os.makedirs(subdir)
+    return targetdir, os.path.join(subdir,newp[1])
 
+def addMetaFile(baseitempath,frompath,newchildpath):
+    targetdir, targetfname = metaFileTarget(baseitempath,newchildpath)
     # copy the file, generate a hash as we do
-    targetfname = os.path.join(subdir,newp[1])
-    infile = open(frompath,"r")
-    outfile = open(targetfname,"w")
-    h = hashobject()
-    block = infile.read(4096)
-    while block:
-        outfile.write(block)
-        h.update(block)
-        block = infile.read(4096)
-    outfile.close()
-    infile.close()
-
+    file_hash = copyandhash(frompath,[targetfname])
     mlog = MemphisLog(targetdir)
-    mlog.writeAddMetaFile(targetfname,hashprefix()+h.hexdigest())
+    mlog.writeAddMetaFile(targetfname,file_hash)
 
 def addExistingMetaFile(baseitempath,newchildpath):
-    # incoming path must include a file name, and may include subdirectory
-    # structure
-    newp = os.path.split(newchildpath)
-    targetdir = metadataPathFor(baseitempath)
-    subdir = targetdir #write in main doc dir if needed
-    if newp[0]:
-        # then path includes new subdirectory, make it
-        subdir = os.path.join(targetdir,newp[0])
-        if not os.path.exists(subdir):
-            logger.info("making dir %s", subdir)
-            os.makedirs(subdir)
-
-    # copy the file, generate a hash as we do
-    targetfname = os.path.join(subdir,newp[1])
-    infile = open(targetfname,"r")
-    h = hashobject()
-    block = infile.read(4096)
-    while block:
-        h.update(block)
-        block = infile.read(4096)
-    infile.close()
-
+    targetdir, targetfname = metaFileTarget(baseitempath,newchildpath)
+    file_hash = filecbi(targetfname)
     mlog = MemphisLog(targetdir)
-    file_hash = hashprefix()+h.hexdigest()
     mlog.writeAddMetaFile(targetfname,file_hash)
     return file_hash
 
@@ -728,19 +863,7 @@ def getMetaFileHash(baseitempath,newchildpath):
     # structure
     newp = os.path.split(newchildpath)
     targetdir = metadataPathFor(baseitempath)
-    subdir = targetdir #write in main doc dir if needed
-
-    # copy the file, generate a hash as we do
-    targetfname = os.path.join(subdir,newp[1])
-    infile = open(targetfname,"r")
-    h = hashobject()
-    block = infile.read(4096)
-    while block:
-        h.update(block)
-        block = infile.read(4096)
-    infile.close()
-    file_hash = hashprefix()+h.hexdigest()
-    return file_hash
+    return filecbi(os.path.join(targetdir,newp[1]))
 
 def metadataPathFor(path):
     # choose appropriate metadata path
@@ -750,22 +873,21 @@ def metadataPathFor(path):
         return os.path.splitext(path)[0] + ".d"     # specific page metadata
 
 def simplefilecopy(source,dest):
-    infile = open(source,"r")
-    outfile = open(dest,"w")
-    block = infile.read(4096)
-    while block:
-        outfile.write(block)
-        block = infile.read(4096)
-    infile.close()
-    outfile.close()
+    copyandhash(source,[dest],hashed=False)
 
 def walk_files(directory):
     """Produces all regular file paths in a directory."""
-    for dirpath, dirnames, filenames in os.walk(directory)[-1]:
+    for dirpath, dirnames, filenames in os.walk(directory):
         len(dirnames) #BS to make pylint shut up
         for filename in filenames:
             yield os.path.join(dirpath, filename)
 
+def is_exported(path):
+    """Whether the file at path belongs in an exported document, as opposed
+    to tablet-local state."""
+    return not (os.path.basename(path) == "memphis.localinfo.json" or
+                path.endswith(TAIL_SUFFIX))
+
 def load_json(jsonpath):
     """Load JSON data from file "jsonpath"
     Return an empty dict if file "jsonpath" is not found or if the
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""Binary per-page ink store.
+
+The strokes of a page are appended to one memory-mapped file in the page
+metadata directory, mc.INKSTOREFILENAME. Each stroke is a fixed record
+header followed by its samples as packed uint16 x, y pairs, so a stroke
+costs 4 bytes per sample on disk and nothing in the Python heap until it
+is read. Strokes are addressed by index, in the order they were added;
+erasing marks them with a tombstone flag rather than moving any data.
+
+File layout, all little-endian:
+
+  header:  magic "EWIK", version (H), 0 (H),
+           bytes used (Q), strokes referenced by logged stroke files (Q)
+  records: sample count (I), frame (I), status (H), flags (H), millis (I),
+           then sample count x, y uint16 pairs
+
+The file grows by doubling, so the part after "bytes used" is slack.
+"""
+
+from __future__ import with_statement
+
+import mmap
+import os
+import sys
+from array import array
+from collections import namedtuple
+from itertools import chain
+from struct import Struct
+
+MAGIC = 'EWIK'
+VERSION = 1
+FILE_HEADER = Struct('<4sHHQQ')
+RECORD_HEADER = Struct('<IIHHI')
+FLAGS = Struct('<H')
+FLAGS_OFFSET = 10               # of the flags in a record header
+ERASED = 0x0001                 # record flags
+INITIAL_SIZE = 64 * 1024
+MAX_SAMPLES = 0xffff            # the store is for pen strokes, not images
+
+# A stored stroke; samples is an array('H') of x, y coordinates, alternating
+InkStroke = namedtuple('InkStroke', 'index frame status millis samples')
+
+class InkStoreError(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+        self.msg = msg
+
+def flat_samples(points):
+    """points as an array('H') of alternating x, y: points may be such an
+    array already, an object with such an array as .coords (the
+    StrokeSamples of a queued display server on_stroke), a StrokeGeometry,
+    or (x, y) pairs such as on_stroke handlers get"""
+    coords = getattr(points, 'coords', None)
+    if coords is not None:
+        points = coords
+    if isinstance(points, array) and points.typecode == 'H':
+        return points
+    xs = getattr(points, 'xs', None)
+    if xs is not None:
+        samples = array('H', xs) * 2
+        samples[0::2] = array('H', xs)
+        samples[1::2] = array('H', points.ys)
+        return samples
+    return array('H', chain.from_iterable(points))
+
+class InkStore(object):
+    """The ink of one page. Use as a context manager, or call close().
+
+    len() counts every stroke ever added, erased or not; store[index] is
+    an InkStroke, or None if the stroke was erased, and iterating gives
+    the strokes that are not erased.
+
+    """
+
+    def __init__(self, path, create=True):
+        self.path = path
+        exists = os.path.exists(path)
+        if not exists and not create:
+            raise InkStoreError('no ink store at %s' % path)
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        try:
+            if not exists:
+                self._file.truncate(INITIAL_SIZE)
+                self._map = mmap.mmap(self._file.fileno(), INITIAL_SIZE)
+                self._used = FILE_HEADER.size
+                self._referenced = 0
+                self._write_header()
+            else:
+                self._map = mmap.mmap(self._file.fileno(), 0)
+                magic, version, _, self._used, self._referenced = \
+                        FILE_HEADER.unpack_from(self._map, 0)
+                if magic != MAGIC or version != VERSION:
+                    raise InkStoreError('%s is not a version %d ink store' %
+                                        (path, VERSION))
+            self._offsets = array('L')
+            self._index_records()
+        except:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._file:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+            self._file = None
+
+    def flush(self):
+        self._map.flush()
+
+    def _write_header(self):
+        FILE_HEADER.pack_into(self._map, 0, MAGIC, VERSION, 0, self._used,
+                              self._referenced)
+
+    def _index_records(self):
+        """Find the record offsets, reading only the record headers"""
+        position, end = FILE_HEADER.size, self._used
+        while position < end:
+            self._offsets.append(position)
+            count = RECORD_HEADER.unpack_from(self._map, position)[0]
+            position += RECORD_HEADER.size + 4 * count
+        if position != end:
+            raise InkStoreError('%s is truncated' % self.path)
+
+    def _reserve(self, size):
+        needed = self._used + size
+        if needed > len(self._map):
+            new_size = max(needed, 2 * len(self._map))
+            self._map.flush()
+            self._map.close()
+            self._file.truncate(new_size)
+            self._map = mmap.mmap(self._file.fileno(), new_size)
+
+    # Strokes ===============================================================
+
+    def append(self, points, frame=0, status=0, millis=0):
+        """Add a stroke; see flat_samples for what points may be.
+        Returns the index of the stroke."""
+        samples = flat_samples(points)
+        count = len(samples) // 2
+        if count > MAX_SAMPLES:
+            raise InkStoreError('stroke of %d samples is too long' % count)
+        if sys.byteorder != 'little':
+            samples = array('H', samples)
+            samples.byteswap()
+        data = samples.tostring()
+        position = self._used
+        self._reserve(RECORD_HEADER.size + len(data))
+        RECORD_HEADER.pack_into(self._map, position, count, frame, status, 0,
+                                millis)
+        start = position + RECORD_HEADER.size
+        self._map[start:start + len(data)] = data
+        self._used = start + len(data)
+        self._write_header()
+        self._offsets.append(position)
+        return len(self._offsets) - 1
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._offsets)
+        if not 0 <= index < len(self._offsets):
+            raise IndexError('ink stroke index out of range')
+        position = self._offsets[index]
+        count, frame, status, flags, millis = RECORD_HEADER.unpack_from(
+                self._map, position)
+        if flags & ERASED:
+            return None
+        start = position + RECORD_HEADER.size
+        samples = array('H')
+        samples.fromstring(self._map[start:start + 4 * count])
+        if sys.byteorder != 'little':
+            samples.byteswap()
+        return InkStroke(index, frame, status, millis, samples)
+
+    def __iter__(self):
+        for index in xrange(len(self._offsets)):
+            stroke = self[index]
+            if stroke is not None:
+                yield stroke
+
+    def is_erased(self, index):
+        flags, = FLAGS.unpack_from(self._map,
+                                   self._offsets[index] + FLAGS_OFFSET)
+        return bool(flags & ERASED)
+
+    def erase(self, start, stop=None):
+        """Mark strokes start up to stop (start + 1 if stop is None) erased.
+        Returns the number that were not erased already."""
+        if stop is None:
+            if start < 0:
+                start += len(self._offsets)
+            stop = start + 1
+        erased = 0
+        for index in xrange(*slice(start, stop).indices(len(self._offsets))):
+            flags_at = self._offsets[index] + FLAGS_OFFSET
+            flags, = FLAGS.unpack_from(self._map, flags_at)
+            if not flags & ERASED:
+                FLAGS.pack_into(self._map, flags_at, flags | ERASED)
+                erased += 1
+        return erased
+
+    def live_count(self):
+        return sum(1 for index in xrange(len(self._offsets))
+                   if not self.is_erased(index))
+
+    # Stroke file references ================================================
+
+    def unreferenced(self):
+        """(start, stop) of the strokes added since the last call of
+        mark_referenced"""
+        return self._referenced, len(self._offsets)
+
+    def mark_referenced(self, stop=None):
+        """Record that the strokes before stop (all of them if stop is None)
+        are covered by a logged stroke file."""
+        self._referenced = len(self._offsets) if stop is None else stop
+        self._write_header()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # Copyright 2010-2011 Ricoh Innovations, Inc.
 
+from __future__ import with_statement
+
 import os
 import logging
 import datetime
@@ -9,8 +11,10 @@ import json
 
 import hashlib
 import fcntl
+import mmap
 import random
 import glob
+import threading
 from types import ListType
 
 import constants as mc
@@ -18,6 +22,8 @@ import constants as mc
 HASHTYPEPREFIX = "sha1."
 NEWLINE = '\r\n'
 LINE_PREFIX = 'Entry: '
+TAIL_SUFFIX = '.tail'   # sidecar caching the last entry of a log file
+COPY_BLOCKSIZE = 1 << 20
 
 class MemphisLog:
     def __init__(self,path):
@@ -72,8 +78,13 @@ class MemphisLog:
     def writeAddMetaFile(self,filepath,hash):
         return self.writelogentry("AddMetaFile",Path=filepath,Hash=hash)
     
-    def writeAddStrokeFile(self,filepath):
+    def writeAddStrokeFile(self,filepath,inkstrokes=None):
+        """inkstrokes, if given, is the (start, stop) range of the strokes
+        in the page ink store that the stroke file holds"""
         hash_val = filecbi(os.path.join(self.path, filepath))
+        if inkstrokes:
+            return self.writelogentry("AddStrokeFile", Hash=hash_val,
+                                      Path=filepath, InkStrokes="%d-%d" % inkstrokes)
         return self.writelogentry("AddStrokeFile", Hash=hash_val, Path=filepath)
     
     def writePageMetaUpdated(self,pageID,lastentry):
@@ -100,9 +111,8 @@ class MemphisLog:
             f.close()
         
         
-    def _writelogentry(self,opcode,**keywords):
-        logrecord = createlogrecord(opcode,keywords)
-
+    def preparelog(self):
+        '''make sure the log directory and log file exist.'''
         # mke sure a log directory exists
         if not os.path.exists(self.path):
             os.makedirs(self.path)
@@ -110,23 +120,134 @@ class MemphisLog:
             raise IOError,"Log path does not point at directory"
             
         self.writefirstentryifneeded()
-            
+
+    def _writelogentry(self,opcode,**keywords):
+        logrecord = createlogrecord(opcode,keywords)
+        self.preparelog()
         cbi = stringcbi(logrecord)
 
         # write the stand alone entry file
-        filepath = os.path.join(self.path,cbi)
-        f = open(filepath,'wb')
-        f.write(logrecord)
-        f.close()
+        writeentryfile(self.path,cbi,logrecord)
         return cbi
 
     def writelogentry(self,opcode,**keywords):
-        cbi = self._writelogentry(opcode,**keywords)
-        prev = addCBIsettolog(self.logfilepath,[cbi],self.previoushash)
+        transaction = current_transaction()
+        if transaction:
+            prev = transaction.addlogrecord(self,
+                                            createlogrecord(opcode,keywords))
+        else:
+            cbi = self._writelogentry(opcode,**keywords)
+            prev = addCBIsettolog(self.logfilepath,[cbi],self.previoushash)
         if self._entry_monitor:
             self._entry_monitor(prev)
         return prev
 
+#----------------------------------------------------------------------------------------------
+#     Batched Log Writing
+#----------------------------------------------------------------------------------------------
+
+_transaction_state = threading.local()
+
+def current_transaction():
+    '''return the LogTransaction active in this thread, or None.'''
+    return getattr(_transaction_state, 'transaction', None)
+
+class LogTransaction(object):
+    '''LogTransaction
+    Batches the entries written by every MemphisLog in the current thread
+    while the transaction is active. Each log file touched is opened and
+    locked once, its hash chain is extended in memory, and on exit the entry
+    files and the log lines are written out with a single append and a
+    single fsync per log. The resulting chain is identical to the one
+    written entry by entry.
+
+    Use as a context manager. Transactions nest; an inner transaction joins
+    the outer one and everything is written when the outermost one exits.
+    Entries are written out even if the block raises, because their hashes
+    have already been handed back to the callers.
+
+    '''
+    def __init__(self):
+        self.pendinglogs = {}
+        self.outer = None
+
+    def __enter__(self):
+        self.outer = current_transaction()
+        if not self.outer:
+            _transaction_state.transaction = self
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if not self.outer:
+            _transaction_state.transaction = None
+            self.commit()
+
+    def addlogrecord(self,mlog,logrecord):
+        '''queue logrecord for mlog and return the new running hash.'''
+        pending = self.pendinglogs.get(mlog.logfilepath)
+        if pending is None:
+            mlog.preparelog()
+            pending = _PendingLog(mlog.path,mlog.logfilepath)
+            self.pendinglogs[mlog.logfilepath] = pending
+        return pending.add(logrecord,mlog.previoushash)
+
+    def commit(self):
+        '''write out and unlock every log touched by this transaction.'''
+        pendinglogs, self.pendinglogs = self.pendinglogs, {}
+        error = None
+        for pending in pendinglogs.itervalues():
+            try:
+                pending.commit()
+            except Exception, e:
+                logging.exception('failed writing log %s' % pending.logfilepath)
+                error = error or e
+        if error:
+            raise error
+
+class _PendingLog(object):
+    '''Holds the lock and the in-memory tail of one log file for a
+       LogTransaction.'''
+    def __init__(self,path,logfilepath):
+        self.path = path
+        self.logfilepath = logfilepath
+        self.entries = []
+        self.lines = []
+        self.logf = open(logfilepath,'rb+')
+        fcntl.lockf(self.logf.fileno(), fcntl.LOCK_EX) # held until commit
+        self.lastentry = getlastentryfromlog(self.logf,logfilepath)
+
+    def add(self,logrecord,previoushash=None):
+        # same chaining rules as addCBIsettolog
+        cbi = stringcbi(logrecord)
+        if previoushash:
+            prevcbi = previoushash
+        else:
+            prev = self.lastentry
+            if not prev:
+                prev = stringcbi('') ## HERE start value.
+                logging.warn('starting new log in %s' % self.logfilepath)
+            prevcbi = stringcbi(prev)
+        entry = prevcbi+'-'+cbi
+        self.entries.append((cbi,logrecord))
+        self.lines.append(LINE_PREFIX + entry + NEWLINE)
+        self.lastentry = entry
+        return stringcbi(entry)
+
+    def commit(self):
+        try:
+            for cbi, logrecord in self.entries:
+                writeentryfile(self.path,cbi,logrecord)
+            self.logf.seek(0,2)
+            self.logf.write(''.join(self.lines))
+            self.logf.flush()
+            os.fsync(self.logf.fileno())
+            if self.lines:
+                storelastentry(self.logf,self.logfilepath,self.lastentry,
+                               persist=True)
+        finally:
+            fcntl.lockf(self.logf.fileno(), fcntl.LOCK_UN)  # OS level file unlock
+            self.logf.close()
+
 #----------------------------------------------------------------------------------------------
 #     Utility Functions
 #----------------------------------------------------------------------------------------------
@@ -146,16 +267,45 @@ def stringcbi(message):
 
 def filecbi(pathname):
     '''return a cbi for the file.'''
-    f = open(pathname,'rb')
-#    h = sha1.new()
-    h = hashobject()
-    d = f.read(64000)
-    while(len(d)>0):
-        h.update(d)
-        d = f.read(64000)
-    f.close()
-    return hashprefix()+h.hexdigest()
+    return copyandhash(pathname)
+
+def copyandhash(source,dests=(),hashed=True):
+    '''copy the file at source to each path in dests, reading it only once,
+    and return its cbi (None if hashed is false).
+    A regular file is mapped with mmap, so the hash and every copy are fed
+    from the page cache without building Python strings; anything mmap
+    cannot map is read in COPY_BLOCKSIZE blocks.'''
+    h = hashobject() if hashed else None
+    infile = open(source,'rb')
+    outfiles = []
+    try:
+        for dest in dests:
+            outfiles.append(open(dest,'wb'))
+        try:
+            blocks = [mmap.mmap(infile.fileno(),0,access=mmap.ACCESS_READ)]
+        except (ValueError, EnvironmentError):
+            # empty file, pipe, ...
+            blocks = iter(lambda: infile.read(COPY_BLOCKSIZE),'')
+        for block in blocks:
+            if h:
+                h.update(block)
+            for outfile in outfiles:
+                outfile.write(block)
+            if isinstance(block,mmap.mmap):
+                block.close()
+    finally:
+        infile.close()
+        for outfile in outfiles:
+            outfile.close()
+    if h:
+        return hashprefix()+h.hexdigest()
     
+def writeentryfile(path,cbi,logrecord):
+    '''write the stand alone entry file for logrecord, named by its cbi.'''
+    f = open(os.path.join(path,cbi),'wb')
+    f.write(logrecord)
+    f.close()
+
 def getlastentry(teststring, strict=False):
     '''return a string which is the last valid entry from the teststring or None'''
     start = teststring.rfind( LINE_PREFIX )
@@ -190,6 +340,97 @@ def getlastentryfromfile(logfile):
     return foundlast
 
 
+#----------------------------------------------------------------------------------------------
+#     Tail Cache
+#----------------------------------------------------------------------------------------------
+
+TAIL_CACHE_SIZE = 64    # logs whose tail is kept in memory
+
+class _TailCache(object):
+    '''logfilepath -> ((size, mtime), lastentry) of the log as we last wrote
+    it, for the TAIL_CACHE_SIZE logs used last. The tail of a log dropped
+    from here is read from its sidecar, or from the log if that is stale.'''
+
+    def __init__(self, size=TAIL_CACHE_SIZE):
+        self.size = size
+        self._tails = {}
+        self._order = []        # least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, logfilepath):
+        with self._lock:
+            tail = self._tails.get(logfilepath)
+            if tail is not None:
+                self._order.remove(logfilepath)
+                self._order.append(logfilepath)
+            return tail
+
+    def __setitem__(self, logfilepath, tail):
+        with self._lock:
+            if logfilepath in self._tails:
+                self._order.remove(logfilepath)
+            elif len(self._order) >= self.size:
+                del self._tails[self._order.pop(0)]
+            self._tails[logfilepath] = tail
+            self._order.append(logfilepath)
+
+    def __len__(self):
+        return len(self._tails)
+
+    def clear(self):
+        with self._lock:
+            self._tails.clear()
+            del self._order[:]
+
+_tailcache = _TailCache()
+
+def tailpathfor(logfilepath):
+    return logfilepath + TAIL_SUFFIX
+
+def _logstamp(logf):
+    st = os.fstat(logf.fileno())
+    return st.st_size, st.st_mtime
+
+def _readtailfile(logfilepath):
+    '''return the ((size, mtime), lastentry) recorded in the sidecar, or None'''
+    try:
+        with open(tailpathfor(logfilepath),'rb') as tailf:
+            tail = json.load(tailf)
+        entry = tail['entry']
+        return (tail['size'], tail['mtime']), entry and str(entry)
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+def getlastentryfromlog(logf,logfilepath):
+    '''return the last entry of the open log file logf, like
+    getlastentryfromfile, but without reading the log when the cached tail is
+    still valid for its current size and mtime.'''
+    stamp = _logstamp(logf)
+    cached = _tailcache.get(logfilepath) or _readtailfile(logfilepath)
+    if cached and cached[0] == stamp:
+        _tailcache[logfilepath] = cached
+        return cached[1]
+    lastentry = getlastentryfromfile(logf)
+    _tailcache[logfilepath] = (stamp, lastentry)
+    return lastentry
+
+def storelastentry(logf,logfilepath,lastentry,persist=False):
+    '''record lastentry as the tail of logf, which we have just appended to.
+    The sidecar file is only rewritten when persist is true, so that single
+    appends cost no extra file writes; a stale sidecar fails validation and
+    the log is read instead.'''
+    logf.flush()
+    stamp = _logstamp(logf)
+    _tailcache[logfilepath] = (stamp, lastentry)
+    if not persist:
+        return
+    try:
+        with open(tailpathfor(logfilepath),'wb') as tailf:
+            json.dump({'size':stamp[0],'mtime':stamp[1],'entry':lastentry},
+                      tailf)
+    except IOError, e:
+        logging.warn('could not write tail cache for %s: %s' % (logfilepath, e))
+
 
 def addCBIsettolog(logfilepath,cbilist,previoushash=None):
     '''lock & open file, compute previous cbi, format entry, append, closefile.'''
@@ -201,7 +442,7 @@ def addCBIsettolog(logfilepath,cbilist,previoushash=None):
     if previoushash:
         prevcbi = previoushash
     else:
-        prev = getlastentryfromfile(logf)
+        prev = getlastentryfromlog(logf,logfilepath)
     
         if not prev:
             prev = stringcbi('') ## HERE start value.
@@ -212,6 +453,7 @@ def addCBIsettolog(logfilepath,cbilist,previoushash=None):
     line = LINE_PREFIX + entry + NEWLINE
     logf.seek(0,2)
     logf.write(line)
+    storelastentry(logf,logfilepath,entry)
     fcntl.lockf(logf.fileno(), fcntl.LOCK_UN)  # OS level file unlock
     logf.close()
     
@@ -1,60 +1,165 @@
 #!/usr/bin/env python
 # Copyright 2010 Ricoh Innovations, Inc.
+"""Convert a PDF to a zipped memphis document.
+
+Pages are rasterized by gs and resized by mogrify in chunks of consecutive
+pages, several chunks at once on a pool of worker threads each waiting on
+its own subprocess, and are added to the MemphisFile in page order as they
+finish. The working directory of the process is never changed, so this is
+safe to call from threaded daemons.
+"""
 
 GSCMD = "gs"
-RENDERCMD = " -q -DNOPAUSE -dBATCH -sDEVICE=pgmraw -dPDFFitPage -r300x300 -sOutputFile=$1_p%04d.pgm "
-MOGRIFYCMD = "mogrify -rotate 270 -scale 1068x825 -extent 1200x825  -gravity South %s -depth 8"
+RENDERCMD = "-q -DNOPAUSE -dBATCH -sDEVICE=pgmraw -dPDFFitPage -r300x300"
+MOGRIFYCMD = "mogrify -rotate 270 -scale 1068x825 -extent 1200x825  -gravity South -path %(outdir)s %(page)s -depth 8"
 # The following would be used to make double-resolution (zoomable) page images
-#MOGRIFYCMD = "mogrify -rotate 270 -scale 2136x1650 -extent 2400x1650  -gravity South %s -depth 8"
+#MOGRIFYCMD = "mogrify -rotate 270 -scale 2136x1650 -extent 2400x1650  -gravity South -path %(outdir)s %(page)s -depth 8"
+PAGENAME = "_p%04d.pgm"
+RENDER_CHUNK = 8	# most pages rendered by one gs run
+CONVERT_WORKERS = None	# concurrent gs/mogrify runs, None for one per CPU
+
 import os
 import tempfile
 import glob
+import shutil
+import subprocess
+import multiprocessing
 import file
 from ew.memphis.constants import META_HIRES, STDGEOM_MAINIMAGE, STDGEOM_HIRES, META_MAINIMAGEGEOM, META_HIRESIMAGEGEOM
+from ew.util.worker_pool import WorkerPool
+from ew.util import ew_logging
+
+logger = ew_logging.getLogger('ew.memphis.pdfconverter')
 
-def convert2memphis(pdfpath, savepath,hires=False):
-	# get a temp dir to work in, change to it
+def convert2memphis(pdfpath, savepath,hires=False,workers=CONVERT_WORKERS,progress=None):
+	"""Convert the PDF at pdfpath to savepath + ".memphis.zip" and return
+	that path.
+	If given, progress(memphisfile, pages_done, page_count) is called after
+	each page is added and saved; page_count is None if gs could not count
+	the pages up front.
+
+	"""
 	targetpath = os.path.abspath(savepath)
-	tmpdir = tempfile.mkdtemp()
-	os.chdir(tmpdir)
-	print "Tmpdir =",tmpdir
-	
-	filename = os.path.basename(savepath)
-	
-	# prepare gs command and execute it in tmpdir
-	cmdtoexecute = GSCMD + RENDERCMD + '"' + pdfpath + '"'
-	os.system(cmdtoexecute)
-	
-	# find rendered pages
-	foundpages = glob.glob("*.pgm")
-	foundpages.sort()
-	
-	mf = file.MemphisFile(filename)
-	mf.open()
-	mf.info["title"] = filename
-
-	for p in foundpages:
-		# create the new page
-		pagefilepath = os.path.join(tmpdir,p)
-		mf.pages.append(p)
-		
-		# put the high res image version into the metadata of each page
-		if hires:
-			hirespath = "hires.%s" % (p)
-			mf.pages.page_for(p).addMetaFile(p,hirespath)
-			mf.pages.page_for(p).metadata[META_HIRES] = hirespath
-			mf.pages.page_for(p).metadata[META_HIRESIMAGEGEOM] = STDGEOM_HIRES
-		
-		# create the proper rotated lo res version for the tablet, add it
-		os.system(MOGRIFYCMD % (p))
-		mf.pages.page_for(p).metadata[META_MAINIMAGEGEOM] = STDGEOM_MAINIMAGE
-		mf.pages.page_for(p).setBaseImage(pagefilepath,isOriginal=True)
-	
-	mf.close()
 	if not targetpath.endswith(".memphis.zip"):
 		targetpath += ".memphis.zip"
-	mf.saveZipTo(targetpath)
-	os.system("/bin/rm -rf '" + tmpdir + "'")
+	filename = os.path.basename(savepath)
+	tmpdir = tempfile.mkdtemp()
+	logger.debug("converting %s in %s", pdfpath, tmpdir)
+	try:
+		mf = file.MemphisFile(os.path.join(tmpdir,filename))
+		mf.open()
+		mf.info["title"] = filename
+
+		page_count = pdf_page_count(pdfpath)
+		for done, (p, rawpath, pagepath) in enumerate(
+				rasterize(pdfpath,tmpdir,page_count,workers)):
+			# create the new page
+			mf.pages.append(p)
+			page = mf.pages.page_for(p)
+
+			# put the high res image version into the metadata of each page
+			if hires:
+				hirespath = "hires.%s" % (p)
+				page.addMetaFile(rawpath,hirespath)
+				page.metadata[META_HIRES] = hirespath
+				page.metadata[META_HIRESIMAGEGEOM] = STDGEOM_HIRES
+
+			# add the rotated lo res version for the tablet
+			page.metadata[META_MAINIMAGEGEOM] = STDGEOM_MAINIMAGE
+			page.setBaseImage(pagepath,isOriginal=True)
+			if progress:
+				mf.save()
+				progress(mf, done + 1, page_count)
+
+		mf.close()
+		mf.saveZipTo(targetpath)
+	finally:
+		shutil.rmtree(tmpdir, ignore_errors=True)
 	return targetpath
-	
-	
+
+def rasterize(pdfpath, tmpdir, page_count=None, workers=CONVERT_WORKERS):
+	"""Render and resize the pages of the PDF under tmpdir.
+	Yields (page name, full resolution image, resized image) in page
+	order, each as soon as it and the pages before it are done.
+
+	"""
+	workers = workers or multiprocessing.cpu_count()
+	rawdir = os.path.join(tmpdir, "raw")
+	pagedir = os.path.join(tmpdir, "pages")
+	os.mkdir(rawdir)
+	os.mkdir(pagedir)
+	pool = WorkerPool(workers, name='pdf-convert')
+	try:
+		chunks = page_chunks(page_count, workers)
+		render = lambda chunk: render_chunk(pdfpath, rawdir, pagedir, chunk)
+		for pages in pool.imap(render, chunks):
+			for p in pages:
+				yield (p, os.path.join(rawdir,p), os.path.join(pagedir,p))
+	finally:
+		pool.close()
+
+def page_chunks(page_count, workers):
+	"""Split pages 1..page_count into (first, last) runs, small enough to
+	keep all the workers busy. A page_count of None gives one run of
+	every page."""
+	if not page_count:
+		return [(None, None)]
+	size = max(1, min(RENDER_CHUNK, -(-page_count // workers)))
+	return [(first, min(first + size - 1, page_count))
+			for first in range(1, page_count + 1, size)]
+
+def render_chunk(pdfpath, rawdir, pagedir, chunk):
+	"""Render the pages of chunk into rawdir and resize them into pagedir.
+	Runs on a worker thread. Returns the page names in order."""
+	first, last = chunk
+	prefix = os.path.join(rawdir, "c%04d_" % (first or 1))
+	args = [GSCMD] + RENDERCMD.split()
+	if first:
+		args += ["-dFirstPage=%d" % first, "-dLastPage=%d" % last]
+	subprocess.check_call(args + ["-sOutputFile=%s%%04d.pgm" % prefix, pdfpath])
+
+	pages = []
+	# gs numbers the output of each run from 1
+	for n, rendered in enumerate(sorted(glob.glob(prefix + "*.pgm"))):
+		p = PAGENAME % ((first or 1) + n)
+		rawpath = os.path.join(rawdir, p)
+		os.rename(rendered, rawpath)
+		subprocess.check_call([arg % {'outdir': pagedir, 'page': rawpath}
+							   for arg in MOGRIFYCMD.split()])
+		pages.append(p)
+	return pages
+
+_gs_versions = {}	# GSCMD -> its version
+
+def gs_version():
+	"""the version of gs as a tuple of ints, e.g. (9, 50), or () if gs
+	cannot tell. Asked once per process."""
+	if GSCMD not in _gs_versions:
+		try:
+			gs = subprocess.Popen([GSCMD, "--version"],
+					stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+			version = tuple(int(n) for n in
+							gs.communicate()[0].strip().split('.'))
+		except (OSError, ValueError):
+			version = ()
+		_gs_versions[GSCMD] = version
+	return _gs_versions[GSCMD]
+
+def pdf_page_count(pdfpath):
+	"""the number of pages in the PDF, or None if gs cannot tell.
+	gs runs with -dSAFER; gs 9.50 and later is allowed to read only the
+	PDF itself, older gs rejects --permit-file-read and its -dSAFER lets
+	files be read anyway."""
+	pdfpath = os.path.abspath(pdfpath)
+	pspath = pdfpath.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+	args = [GSCMD, "-q", "-dNODISPLAY", "-dSAFER"]
+	if gs_version() >= (9, 50):
+		args.append("--permit-file-read=%s" % pdfpath)
+	try:
+		gs = subprocess.Popen(args + ["-c",
+				"(%s) (r) file runpdfbegin pdfpagecount = quit" % pspath],
+				stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		return int(gs.communicate()[0].strip())
+	except (OSError, ValueError):
+		logger.warn("could not count the pages of %s", pdfpath)
+		return None
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Performance timing of setting page images.
+
+Compares MemphisFilePage.setBaseImage(isOriginal=True) on 2 MB PGM pages,
+which reads each image once for the page copy, the original copy and the
+hash, against the previous code, which copied and hashed in separate
+small-block passes.
+"""
+
+import os, shutil, tempfile
+from ew.memphis.file import MemphisFile, metadataPathFor
+from ew.memphis.mlogging import MemphisLog, hashobject, hashprefix
+from ew.util.perf_timing import PerfTiming
+
+PAGES = 20
+WIDTH, HEIGHT = 1600, 1310    # about 2 MB of 8 bit gray
+
+def legacy_copy(source, dest, blocksize, hashed):
+    """The 4 KB copy loop of the previous simplefilecopy and addMetaFile"""
+    infile, outfile = open(source, 'rb'), open(dest, 'wb')
+    h = hashobject()
+    block = infile.read(blocksize)
+    while block:
+        outfile.write(block)
+        if hashed:
+            h.update(block)
+        block = infile.read(blocksize)
+    infile.close()
+    outfile.close()
+    return hashprefix() + h.hexdigest()
+
+def legacy_filecbi(path):
+    h = hashobject()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(64000), ''):
+            h.update(block)
+    return hashprefix() + h.hexdigest()
+
+def legacy_setBaseImage(page, image):
+    """setBaseImage(image, isOriginal=True) before the single pass copy"""
+    legacy_copy(image, page.filepath, 4096, False)
+    page.mlog.writeBaseImageUpdated(page.pagename,
+                                    legacy_filecbi(page.filepath))
+    targetdir = metadataPathFor(page.filepath)
+    if not os.path.exists(targetdir):
+        os.makedirs(targetdir)
+    origpath = os.path.join(targetdir,
+                            'original.' + os.path.basename(page.filepath))
+    cbi = legacy_copy(page.filepath, origpath, 4096, True)
+    MemphisLog(targetdir).writeAddMetaFile(origpath, cbi)
+
+def set_images(set_image):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        image = os.path.join(tmpdir, 'image.pgm')
+        with open(image, 'wb') as f:
+            f.write('P5\n%d %d\n255\n' % (WIDTH, HEIGHT))
+            f.write(os.urandom(WIDTH * HEIGHT))
+        with MemphisFile(os.path.join(tmpdir, 'doc.memphis')) as mf:
+            mf.pages.extend(['P%d.pgm' % n for n in range(PAGES)])
+            for n in range(PAGES):
+                set_image(mf.page(n), image)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_set_base_image():
+    """20 original 2 MB page images, single pass copy and hash"""
+    set_images(lambda page, image: page.setBaseImage(image, isOriginal=True))
+
+def test_set_base_image_legacy():
+    """20 original 2 MB page images, separate copy and hash passes"""
+    set_images(legacy_setBaseImage)
+
+if __name__ == "__main__":
+    perf = PerfTiming()
+    perf.add(test_set_base_image, test_set_base_image_legacy)
+    perf.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Performance timing of the page ink store.
+
+Writes a page of 10000 strokes of 20 to 80 samples to an InkStore, and
+reads them back by random index. Also prints the Python heap used by the
+page as lists of (x, y) tuples, as the strokes are held today, against
+what an open InkStore keeps in the heap.
+"""
+
+import os, random, shutil, sys, tempfile
+from ew.memphis.ink_store import InkStore
+from ew.util.perf_timing import PerfTiming
+
+STROKES = 10000
+
+def random_page(seed=1):
+    rnd = random.Random(seed)
+    page = []
+    for n in xrange(STROKES):
+        x, y = rnd.randrange(300, 13000), rnd.randrange(300, 19000)
+        points = []
+        for k in xrange(rnd.randrange(20, 80)):
+            x = max(0, x + rnd.randrange(-40, 41))
+            y = max(0, y + rnd.randrange(-40, 41))
+            points.append((x, y))
+        page.append(points)
+    return page
+
+PAGE = random_page()
+TMPDIR = tempfile.mkdtemp()
+STORE_PATH = os.path.join(TMPDIR, 'memphis.ink')
+
+def tuples_heap(page):
+    """bytes of the lists, tuples and ints of page"""
+    size = sys.getsizeof(page)
+    for points in page:
+        size += sys.getsizeof(points)
+        for point in points:
+            size += sys.getsizeof(point) + sum(sys.getsizeof(c)
+                                               for c in point if c > 256)
+    return size
+
+def store_heap(store):
+    return sys.getsizeof(store) + sys.getsizeof(store.__dict__) + \
+           store._offsets.buffer_info()[1] * store._offsets.itemsize
+
+def test_write():
+    """append 10000 strokes to a new store"""
+    if os.path.exists(STORE_PATH):
+        os.remove(STORE_PATH)
+    with InkStore(STORE_PATH) as store:
+        for n, points in enumerate(PAGE):
+            store.append(points, frame=n)
+
+def test_read():
+    """open the store and read 10000 strokes by random index"""
+    indices = range(STROKES)
+    random.Random(2).shuffle(indices)
+    with InkStore(STORE_PATH, create=False) as store:
+        for n in indices:
+            store[n]
+
+if __name__ == "__main__":
+    try:
+        test_write()
+        with InkStore(STORE_PATH, create=False) as store:
+            print 'heap as tuples: %.1f MB, open InkStore: %.3f MB,' \
+                  ' file: %.1f MB' % (tuples_heap(PAGE) / 1e6,
+                  store_heap(store) / 1e6, store._used / 1e6)
+        perf = PerfTiming()
+        perf.add(test_write, test_read)
+        perf.main()
+    finally:
+        shutil.rmtree(TMPDIR)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Performance timing of memphis log appends.
+
+Compares appending entries with the tail hash cache against the previous
+append path, which found the previous hash by reading back the end of the
+log on every append.
+"""
+
+import fcntl, os, shutil, tempfile
+from ew.memphis import mlogging
+from ew.memphis.mlogging import MemphisLog, stringcbi
+from ew.util.perf_timing import PerfTiming
+
+ENTRIES = 10000
+
+def legacy_addCBIsettolog(logfilepath, cbi):
+    """The append path before the tail cache, kept here for comparison."""
+    logf = open(logfilepath, 'rb+')
+    fcntl.lockf(logf.fileno(), fcntl.LOCK_EX)
+    prev = mlogging.getlastentryfromfile(logf)
+    if not prev:
+        prev = stringcbi('')
+    entry = stringcbi(prev) + '-' + cbi
+    logf.seek(0, 2)
+    logf.write(mlogging.LINE_PREFIX + entry + mlogging.NEWLINE)
+    fcntl.lockf(logf.fileno(), fcntl.LOCK_UN)
+    logf.close()
+    return stringcbi(entry)
+
+def append_entries(append):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        mlog = MemphisLog(tmpdir)
+        mlog.preparelog()
+        for n in xrange(ENTRIES):
+            append(mlog.logfilepath, stringcbi(str(n)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_append_cached():
+    """10k appends using the tail hash cache"""
+    append_entries(lambda path, cbi: mlogging.addCBIsettolog(path, [cbi]))
+
+def test_append_legacy():
+    """10k appends reading the log tail each time"""
+    append_entries(legacy_addCBIsettolog)
+
+if __name__ == "__main__":
+    perf = PerfTiming()
+    perf.add(test_append_cached, test_append_legacy)
+    perf.main()
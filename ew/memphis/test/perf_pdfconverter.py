@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Performance timing of PDF conversion.
+
+Writes a PDF of 100 text pages and rasterizes it with gs and mogrify, as
+convert2memphis does, on one worker and on one worker per CPU, so the
+scaling over the CPUs can be compared. Needs gs and mogrify on the path.
+"""
+
+import multiprocessing, os, shutil, tempfile
+from ew.memphis import pdfconverter
+from ew.util.perf_timing import PerfTiming
+
+PAGES = 100
+TMPDIR = tempfile.mkdtemp()
+PDF_PATH = os.path.join(TMPDIR, 'pages.pdf')
+
+def write_pdf(path, pages):
+    """a PDF of pages letter pages, each with its page number"""
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>',
+               '<< /Type /Pages /Kids [%s] /Count %d >>' % (
+                   ' '.join('%d 0 R' % (4 + 2 * n) for n in range(pages)),
+                   pages),
+               '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    for n in range(pages):
+        text = 'BT /F1 48 Tf 72 600 Td (Page %d) Tj ET' % (n + 1)
+        objects.append('<< /Type /Page /Parent 2 0 R'
+                       ' /MediaBox [0 0 612 792]'
+                       ' /Resources << /Font << /F1 3 0 R >> >>'
+                       ' /Contents %d 0 R >>' % (5 + 2 * n))
+        objects.append('<< /Length %d >>\nstream\n%s\nendstream' % (
+                       len(text), text))
+    data = '%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects):
+        offsets.append(len(data))
+        data += '%d 0 obj\n%s\nendobj\n' % (number + 1, body)
+    xref = len(data)
+    data += 'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    data += ''.join('%010d 00000 n \n' % offset for offset in offsets)
+    data += 'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def rasterize(workers):
+    workdir = tempfile.mkdtemp(dir=TMPDIR)
+    try:
+        page_count = pdfconverter.pdf_page_count(PDF_PATH)
+        for page in pdfconverter.rasterize(PDF_PATH, workdir, page_count,
+                                           workers):
+            pass
+    finally:
+        shutil.rmtree(workdir)
+
+def test_one_worker():
+    """rasterize 100 pages on one worker"""
+    rasterize(1)
+
+def test_worker_per_cpu():
+    """rasterize 100 pages on one worker per CPU"""
+    rasterize(multiprocessing.cpu_count())
+
+if __name__ == "__main__":
+    try:
+        write_pdf(PDF_PATH, PAGES)
+        print '%d pages counted, %d CPUs' % (
+              pdfconverter.pdf_page_count(PDF_PATH) or 0,
+              multiprocessing.cpu_count())
+        perf = PerfTiming()
+        perf.add(test_one_worker, test_worker_per_cpu)
+        perf.main()
+    finally:
+        shutil.rmtree(TMPDIR)
@@ -0,0 +1,79 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import unittest, json, os, shutil, tempfile, time
+from ew.util import system_config
+from ew.memphis import catalog
+from ew.memphis.file import MemphisFile, metadataPathFor
+
+class TestDocumentCatalog(unittest.TestCase):
+    def setUp(self):
+        self.saved_config = system_config.data_home, system_config.catalog_dir
+        self.tmpdir = tempfile.mkdtemp()
+        system_config.data_home = self.tmpdir
+        system_config.catalog_dir = os.path.join(self.tmpdir, 'cache', 'catalog')
+        catalog._catalogs.clear()
+        self.inbox = os.path.join(self.tmpdir, 'inbox')
+        os.mkdir(self.inbox)
+        for docid in ('d1', 'd2'):
+            self.make_doc(docid, 'title ' + docid)
+        self.catalog = catalog.catalog_for_subdir('inbox')
+
+    def make_doc(self, docid, title):
+        with MemphisFile(os.path.join(self.inbox, docid + '.memphis')) as mf:
+            mf.metadata['memphis.title'] = title
+
+    def test_scan_and_incremental_updates(self):
+        entries = self.catalog.entries()
+        self.assertEqual(sorted(entries), ['d1', 'd2'])
+        self.assertEqual(entries['d1']['title'], 'title d1')
+        self.assertEqual(entries['d1']['error_status'], None)
+
+        # saving a document refreshes its entry
+        self.make_doc('d1', 'new title')
+        self.assertEqual(self.catalog.get('d1')['title'], 'new title')
+
+        self.make_doc('d3', 'title d3')
+        self.assertEqual(self.catalog.update('d3')['title'], 'title d3')
+        self.catalog.set_status('d3', 'Submitted')
+        self.assertEqual(self.catalog.get('d3')['status'], 'Submitted')
+
+        # a document removed behind the catalog's back is noticed
+        shutil.rmtree(os.path.join(self.inbox, 'd2.memphis'))
+        self.assertEqual(sorted(self.catalog.entries()), ['d1', 'd3'])
+
+    def test_document_changed_in_place(self):
+        # a scan long after the last change of the directory
+        old = int(time.time()) - 10
+        os.utime(self.inbox, (old, old))
+        self.assertEqual(self.catalog.get('d1')['title'], 'title d1')
+        # the metadata rewritten behind the catalog's back, which leaves
+        # the directory mtime alone
+        path = os.path.join(metadataPathFor(
+                os.path.join(self.inbox, 'd1.memphis')),
+                'memphis.metadata.json')
+        with open(path) as f:
+            metadata = json.load(f)
+        metadata['memphis.title'] = 'changed title'
+        with open(path, 'w') as f:
+            json.dump(metadata, f)
+        os.utime(path, (old + 5, old + 5))
+        self.assertEqual(os.stat(self.inbox).st_mtime, old)
+        self.assertEqual(self.catalog.get('d1')['title'], 'changed title')
+        self.assertEqual(self.catalog.get('d2')['title'], 'title d2')
+
+    def test_creation_time_from_log(self):
+        before = self.catalog.get('d1')['creation_time']
+        self.assertTrue(0 < before <= time.time())
+        # the same when the catalog is rebuilt later
+        os.remove(self.catalog.path)
+        time.sleep(0.01)
+        self.make_doc('d1', 'new title')
+        self.assertEqual(self.catalog.get('d1')['creation_time'], before)
+
+    def tearDown(self):
+        system_config.data_home, system_config.catalog_dir = self.saved_config
+        catalog._catalogs.clear()
+        shutil.rmtree(self.tmpdir)
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDocumentCatalog)
+    unittest.TextTestRunner(verbosity=2).run(suite)
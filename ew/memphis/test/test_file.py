@@ -0,0 +1,163 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import unittest, os, shutil, tempfile, zipfile, json, hashlib
+from cStringIO import StringIO
+from ew.memphis.file import MemphisFile
+from ew.memphis import export
+from ew.memphis.mlogging import stringcbi
+
+class TestMemphisFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'doc.memphis')
+        with MemphisFile(self.path) as mf:
+            mf.metadata['memphis.title'] = 'A Title'
+            mf.pages.extend(['P1.pgm', 'P2.pgm', 'P2', 'P3.pgm'])
+
+    def test_lazy_open_loads_on_demand(self):
+        with MemphisFile(self.path, lazy=True) as mf:
+            for name in MemphisFile._components:
+                self.assertEqual(mf.loaded(name), None)
+            self.assertEqual(mf.metadata['memphis.title'], 'A Title')
+            self.assertNotEqual(mf.loaded('metadata'), None)
+            self.assertEqual(mf.loaded('pages'), None)
+            self.assertEqual(len(mf.pages), 4)
+
+    def test_page_lookup_by_id(self):
+        with MemphisFile(self.path, lazy=True) as mf:
+            pages = mf.pages
+            self.assertEqual(pages.normalize_key('P1'), 'P1.pgm')
+            # an exact page id wins over another page's id without extension
+            self.assertEqual(pages.normalize_key('P2'), 'P2')
+            self.assertEqual(pages.normalize_key('P9'), 'P9')
+            self.assertTrue('P3.pgm' in pages)
+            self.assertFalse('P3' in pages)
+            self.assertEqual(mf.page('P3').pagename, 'P3.pgm')
+            self.assertRaises(KeyError, mf.page, 'P9')
+            del pages[0]
+            self.assertEqual(pages.normalize_key('P1'), 'P1')
+            self.assertEqual(pages.positions()['P3'], 2)
+
+    def test_export_zip_manifest(self):
+        image = os.path.join(self.tmpdir, 'image.pgm')
+        with open(image, 'wb') as f:
+            f.write('P5\n2 2\n255\nabcd')
+        with MemphisFile(self.path) as mf:
+            mf.page('P1').setBaseImage(image, isOriginal=True)
+            mf.localinfo['local'] = 'not exported'
+            out = StringIO()
+            hashes = mf.exportZip(out)
+
+        archive = zipfile.ZipFile(StringIO(out.getvalue()))
+        self.assertEqual(archive.testzip(), None)
+        names = archive.namelist()
+        self.assertEqual(names[-1], '/memphis.manifest.json')
+        self.assertFalse([n for n in names if 'localinfo' in n])
+        manifest = json.loads(archive.read(names[-1]))
+        self.assertEqual(sorted(manifest), sorted(names[:-1]))
+        self.assertEqual(manifest, hashes)
+        for name in names[:-1]:
+            self.assertEqual(manifest[name],
+                    'sha1.' + hashlib.sha1(archive.read(name)).hexdigest())
+
+    def add_stroke(self, name):
+        stroke = os.path.join(self.path, 'P1.d', name)
+        if not os.path.isdir(os.path.dirname(stroke)):
+            os.makedirs(os.path.dirname(stroke))
+        with open(stroke, 'wb') as f:
+            f.write('stroke data ' + name)
+        with MemphisFile(self.path) as mf:
+            mf.page('P1').add_stroke_file(stroke)
+
+    def test_export_delta_zip(self):
+        docdir = os.path.join(self.path, 'memphis.document.d')
+        def head():
+            return stringcbi(export.read_log_entries(
+                    export.log_path_in(docdir))[-1])
+        def delta(acked):
+            out = StringIO()
+            with MemphisFile(self.path) as mf:
+                self.assertEqual(mf.exportDeltaZip(out, acked), head())
+            archive = zipfile.ZipFile(StringIO(out.getvalue()))
+            return archive, archive.namelist()
+
+        acked = head()
+        self.add_stroke('s1.dat')
+        # P1 has no log yet as far as the receiver knows: all of it is sent
+        archive, names = delta(acked)
+        self.assertTrue('/P1.d/memphis.log' in names)
+        self.assertTrue('/P1.d/s1.dat' in names)
+        self.assertTrue('/memphis.document.d/memphis.pagelist' in names)
+        self.assertFalse([n for n in names if n.startswith('/P2')])
+
+        acked = head()
+        self.add_stroke('s2.dat')
+        with MemphisFile(self.path) as mf:
+            mf.metadata['memphis.title'] = 'New Title'
+        archive, names = delta(acked)
+        plogs = [n for n in names if n.endswith('.plog')]
+        # one partial log for the document and one for the changed page
+        self.assertEqual(len(plogs), 2)
+        self.assertTrue('/P1.d/s2.dat' in names)
+        self.assertFalse('/P1.d/s1.dat' in names)
+        self.assertTrue('/memphis.document.d/memphis.metadata.json' in names)
+        doc_plog = [n for n in plogs if 'memphis.document.d' in n][0]
+        self.assertTrue(archive.read(doc_plog).startswith(
+                'Entry: %s-' % acked))
+        for entry in archive.read(doc_plog).split('\r\n')[:-1]:
+            self.assertTrue('/memphis.document.d/' + entry.split('-')[1]
+                            in names)
+
+        self.assertRaises(export.UnknownHashError, export.delta_members,
+                          self.path, ['P1.pgm'], 'sha1.unknown')
+
+    def test_export_delta_pagelist_and_info(self):
+        docdir = os.path.join(self.path, 'memphis.document.d')
+        def head():
+            return stringcbi(export.read_log_entries(
+                    export.log_path_in(docdir))[-1])
+        def delta_names(acked):
+            out = StringIO()
+            with MemphisFile(self.path) as mf:
+                mf.exportDeltaZip(out, acked)
+            return zipfile.ZipFile(StringIO(out.getvalue())).namelist()
+        pagelist = '/memphis.document.d/memphis.pagelist'
+        info = '/memphis.document.d/memphis.info.json'
+
+        acked = head()
+        self.assertFalse(pagelist in delta_names(acked))
+        with MemphisFile(self.path) as mf:
+            del mf.pages[1]
+        names = delta_names(acked)
+        self.assertTrue(pagelist in names)
+        self.assertFalse(info in names)
+
+        acked = head()
+        with MemphisFile(self.path) as mf:
+            mf.pages.reverse()
+        self.assertTrue(pagelist in delta_names(acked))
+
+        acked = head()
+        with MemphisFile(self.path) as mf:
+            mf.pages.append('P4.pgm')
+        self.assertTrue(pagelist in delta_names(acked))
+
+        acked = head()
+        with MemphisFile(self.path) as mf:
+            mf.info['status'] = 'submitted'
+        names = delta_names(acked)
+        self.assertTrue(info in names)
+        self.assertFalse(pagelist in names)
+
+        acked = head()
+        with MemphisFile(self.path) as mf:
+            mf.metadata['memphis.title'] = 'Another Title'
+        names = delta_names(acked)
+        self.assertTrue('/memphis.document.d/memphis.metadata.json' in names)
+        self.assertFalse(info in names or pagelist in names)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestMemphisFile)
+    unittest.TextTestRunner(verbosity=2).run(suite)
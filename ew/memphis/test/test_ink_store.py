@@ -0,0 +1,123 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import unittest, os, shutil, tempfile
+from array import array
+from ew.memphis.file import MemphisFile
+from ew.memphis.ink_store import InkStore, InkStoreError, INITIAL_SIZE
+from ew.memphis.export import parse_log_record, read_log_entries
+from ew.util.stroke_geometry import StrokeGeometry
+
+class TestInkStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'memphis.ink')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_append_read_erase(self):
+        strokes = [[(n, 2 * n + k) for k in range(n % 50 + 1)]
+                   for n in range(3000)]
+        with InkStore(self.path) as store:
+            for n, points in enumerate(strokes):
+                self.assertEqual(store.append(points, frame=n, status=1,
+                                              millis=10 * n), n)
+            # grew past the initial mapping
+            self.assertTrue(os.path.getsize(self.path) > INITIAL_SIZE)
+            self.assertEqual(store.erase(10, 20), 10)
+            self.assertEqual(store.erase(15, 25), 5)
+            store.erase(-1)
+        with InkStore(self.path, create=False) as store:
+            self.assertEqual(len(store), 3000)
+            self.assertEqual(store.live_count(), 3000 - 16)
+            self.assertEqual(store[12], None)
+            self.assertEqual(store[-1], None)
+            stroke = store[1234]
+            self.assertEqual((stroke.index, stroke.frame, stroke.status,
+                              stroke.millis), (1234, 1234, 1, 12340))
+            self.assertEqual(zip(stroke.samples[0::2], stroke.samples[1::2]),
+                             strokes[1234])
+            self.assertEqual([s.index for s in store][8:12], [8, 9, 25, 26])
+            self.assertRaises(IndexError, store.__getitem__, 3000)
+            # the other forms of samples
+            n = store.append(StrokeGeometry([(1, 2), (3, 4)]))
+            self.assertEqual(list(store[n].samples), [1, 2, 3, 4])
+            n = store.append(array('H', [5, 6]))
+            self.assertEqual(list(store[n].samples), [5, 6])
+
+    def test_not_a_store(self):
+        self.assertRaises(InkStoreError, InkStore, self.path, False)
+        with open(self.path, 'wb') as f:
+            f.write('x' * 64)
+        self.assertRaises(InkStoreError, InkStore, self.path)
+
+    def test_stroke_file_refers_to_ink(self):
+        docpath = os.path.join(self.tmpdir, 'doc.memphis')
+        with MemphisFile(docpath) as mf:
+            mf.pages.extend(['P1.pgm'])
+            page = mf.page('P1')
+            with page.ink_store() as store:
+                store.append([(1, 1), (2, 2)])
+                store.append([(3, 3)])
+            for name in 'a.stroke', 'b.stroke':
+                with open(os.path.join(docpath, 'P1.d', name), 'wb') as f:
+                    f.write(name)
+                page.add_stroke_file(os.path.join(docpath, 'P1.d', name))
+        pagedir = os.path.join(docpath, 'P1.d')
+        records = [parse_log_record(open(os.path.join(pagedir, cbi)).read())
+                   for entry in read_log_entries(os.path.join(pagedir,
+                                                              'memphis.log'))
+                   for cbi in entry.split('-')[1:]]
+        records = [r for r in records if r.get('Opcode') == 'AddStrokeFile']
+        self.assertEqual([(r['Path'], r.get('InkStrokes')) for r in records],
+                         [('a.stroke', '0-2'), ('b.stroke', None)])
+
+    def _stroke_file(self):
+        docpath = os.path.join(self.tmpdir, 'doc.memphis')
+        with MemphisFile(docpath) as mf:
+            mf.pages.extend(['P1.pgm'])
+        stroke_file = os.path.join(docpath, 'P1.d', 'a.stroke')
+        os.mkdir(os.path.dirname(stroke_file))
+        with open(stroke_file, 'wb') as f:
+            f.write('a.stroke')
+        return docpath, stroke_file
+
+    def _logged_stroke_files(self, pagedir):
+        records = [parse_log_record(open(os.path.join(pagedir, cbi)).read())
+                   for entry in read_log_entries(os.path.join(pagedir,
+                                                              'memphis.log'))
+                   for cbi in entry.split('-')[1:]]
+        return [(r['Path'], r.get('InkStrokes')) for r in records
+                if r.get('Opcode') == 'AddStrokeFile']
+
+    def test_stroke_file_with_strokes(self):
+        docpath, stroke_file = self._stroke_file()
+        with MemphisFile(docpath, lazy=True) as mf:
+            self.assertEqual(mf.add_stroke('P1', [(1, 1), (2, 2)], 10), 0)
+            self.assertEqual(mf.add_stroke('P1', array('H', [3, 3]), 20), 1)
+            mf.add_stroke_file(stroke_file)
+        pagedir = os.path.join(docpath, 'P1.d')
+        self.assertEqual(self._logged_stroke_files(pagedir),
+                         [('a.stroke', '0-2')])
+        with InkStore(os.path.join(pagedir, 'memphis.ink'), False) as store:
+            self.assertEqual([(list(s.samples), s.millis) for s in store],
+                             [([1, 1, 2, 2], 10), ([3, 3], 20)])
+
+    def test_stroke_too_long(self):
+        docpath, stroke_file = self._stroke_file()
+        with MemphisFile(docpath, lazy=True) as mf:
+            self.assertRaises(InkStoreError, mf.add_stroke, 'P1',
+                              array('H', [0]) * 2 * 0x10000)
+
+    def test_stroke_file_logged_without_ink(self):
+        docpath, stroke_file = self._stroke_file()
+        pagedir = os.path.join(docpath, 'P1.d')
+        with open(os.path.join(pagedir, 'memphis.ink'), 'wb') as f:
+            f.write('x' * 64)
+        with MemphisFile(docpath, lazy=True) as mf:
+            mf.add_stroke_file(stroke_file)
+        self.assertEqual(self._logged_stroke_files(pagedir),
+                         [('a.stroke', None)])
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestInkStore)
+    unittest.TextTestRunner(verbosity=2).run(suite)
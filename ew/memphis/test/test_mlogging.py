@@ -0,0 +1,113 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import unittest, os, shutil, tempfile
+from ew.memphis import mlogging
+from ew.memphis.mlogging import MemphisLog, LogTransaction, stringcbi
+
+class TestLogTransaction(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.batched = os.path.join(self.tmpdir, 'batched')
+        self.unbatched = os.path.join(self.tmpdir, 'unbatched')
+
+    def read_log(self, path):
+        with open(os.path.join(path, 'memphis.log'), 'rb') as f:
+            return f.read()
+
+    def entry_cbis(self, log):
+        """the entry cbis named by each line of the log, in order"""
+        lines = log.split(mlogging.NEWLINE)[1:-1]
+        return [line.split('-', 1)[1] for line in lines]
+
+    def test_chain_matches_unbatched(self):
+        mlog = MemphisLog(self.batched)
+        hashes = []
+        with LogTransaction():
+            for n in range(30):
+                hashes.append(mlog.writeSetMetaEntry('key%d' % n, n))
+            # a second log object on the same path joins the transaction
+            hashes.append(MemphisLog(self.batched).writeRemoveMetaEntry('key0'))
+            self.assertEqual(self.read_log(self.batched),
+                             'Entry: null.' + mlogging.NEWLINE)
+        batched_log = self.read_log(self.batched)
+
+        # replay the same records through the entry at a time path
+        replayed = []
+        MemphisLog(self.unbatched).preparelog()
+        for cbi in self.entry_cbis(batched_log):
+            with open(os.path.join(self.batched, cbi), 'rb') as f:
+                record = f.read()
+            self.assertEqual(stringcbi(record), cbi)
+            mlogging.writeentryfile(self.unbatched, cbi, record)
+            replayed.append(mlogging.addCBIsettolog(
+                    os.path.join(self.unbatched, 'memphis.log'), [cbi]))
+
+        self.assertEqual(batched_log, self.read_log(self.unbatched))
+        self.assertEqual(hashes, replayed)
+
+    def test_nested_transaction_writes_on_outer_exit(self):
+        mlog = MemphisLog(self.batched)
+        with LogTransaction():
+            with LogTransaction():
+                mlog.writeSetMetaEntry('a', 1)
+            self.assertEqual(len(self.entry_cbis(self.read_log(self.batched))), 0)
+        self.assertEqual(len(self.entry_cbis(self.read_log(self.batched))), 1)
+        self.assertEqual(mlogging.current_transaction(), None)
+
+    def test_tail_cache_detects_foreign_append(self):
+        mlog = MemphisLog(self.batched)
+        with LogTransaction():
+            mlog.writeSetMetaEntry('a', 1)
+        tailpath = mlogging.tailpathfor(mlog.logfilepath)
+        self.assertTrue(os.path.exists(tailpath))
+        # another writer appends without going through the cache
+        foreign = 'sha1.aaaa-sha1.bbbb'
+        with open(mlog.logfilepath, 'ab') as f:
+            f.write(mlogging.LINE_PREFIX + foreign + mlogging.NEWLINE)
+        mlogging._tailcache.clear()
+        new_hash = mlog.writeSetMetaEntry('b', 2)
+        last = self.read_log(self.batched).split(mlogging.NEWLINE)[-2]
+        self.assertTrue(last.startswith(mlogging.LINE_PREFIX + stringcbi(foreign)))
+        self.assertEqual(new_hash, stringcbi(last[len(mlogging.LINE_PREFIX):]))
+
+    def test_tail_cache_is_bounded(self):
+        cache = mlogging._TailCache(size=2)
+        cache['a'] = ((1, 1), 'ea')
+        cache['b'] = ((1, 1), 'eb')
+        self.assertEqual(cache.get('a'), ((1, 1), 'ea'))
+        # b is now the least recently used
+        cache['c'] = ((1, 1), 'ec')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), ((1, 1), 'ea'))
+        # logs beyond the cache still chain from the sidecar or the log
+        paths = [os.path.join(self.tmpdir, 'log%d' % n)
+                 for n in range(mlogging.TAIL_CACHE_SIZE + 5)]
+        for path in paths:
+            MemphisLog(path).writeSetMetaEntry('a', 1)
+            MemphisLog(path).writeSetMetaEntry('b', 2)
+        self.assertEqual(len(mlogging._tailcache), mlogging.TAIL_CACHE_SIZE)
+        MemphisLog(paths[0]).writeSetMetaEntry('c', 3)
+        lines = [line[len(mlogging.LINE_PREFIX):] for line in
+                 self.read_log(paths[0]).split(mlogging.NEWLINE)[1:-1]]
+        self.assertEqual(lines[2].split('-')[0], stringcbi(lines[1]))
+
+    def test_copyandhash(self):
+        source = os.path.join(self.tmpdir, 'source')
+        copies = [os.path.join(self.tmpdir, name) for name in ('c1', 'c2')]
+        for data in ('', 'x' * (mlogging.COPY_BLOCKSIZE + 5)):
+            with open(source, 'wb') as f:
+                f.write(data)
+            self.assertEqual(mlogging.copyandhash(source, copies),
+                             stringcbi(data))
+            for copy in copies:
+                with open(copy, 'rb') as f:
+                    self.assertEqual(f.read(), data)
+        self.assertEqual(mlogging.copyandhash(source, copies, hashed=False),
+                         None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestLogTransaction)
+    unittest.TextTestRunner(verbosity=2).run(suite)
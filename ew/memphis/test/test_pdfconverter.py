@@ -0,0 +1,131 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import unittest, os, shutil, stat, sys, tempfile
+from ew.memphis import pdfconverter
+
+# Logs its arguments, one run per line, answers --version, and counts 3
+# pages; gs before 9.50 rejects --permit-file-read
+GS_STUB = """#!/bin/sh
+echo "$*" >> %(log)s
+if [ "$1" = --version ]; then echo %(version)s; exit 0; fi
+for arg; do case "$arg" in
+    --permit-file-read=*) [ %(permits)s = yes ] || exit 1;;
+esac; done
+echo 3
+"""
+
+# Renders pages as text files, later chunks faster than earlier ones
+GS_RENDER_STUB = """#!%(python)s
+import sys, time
+args = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if '=' in arg)
+first = int(args.get('FirstPage', 1))
+last = int(args.get('LastPage', %(pages)d))
+time.sleep((%(pages)d - first) * 0.05)
+for n in range(last - first + 1):
+    f = open(args['OutputFile'] %% (n + 1), 'w')
+    f.write('page %%d' %% (first + n))
+    f.close()
+open('%(log)s', 'a').write('%%d-%%d\\n' %% (first, last))
+"""
+
+# Copies a page into the output directory: mogrify -path outdir page
+MOGRIFY_STUB = """#!%(python)s
+import shutil, sys
+shutil.copy(sys.argv[2], sys.argv[1])
+"""
+
+class TestPdfConverter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, 'log')
+        self.saved = pdfconverter.GSCMD, pdfconverter.MOGRIFYCMD
+        pdfconverter._gs_versions.clear()
+
+    def tearDown(self):
+        pdfconverter.GSCMD, pdfconverter.MOGRIFYCMD = self.saved
+        pdfconverter._gs_versions.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def stub(self, name, script, **values):
+        path = os.path.join(self.tmpdir, name)
+        values.setdefault('log', self.log)
+        values.setdefault('python', sys.executable)
+        with open(path, 'w') as f:
+            f.write(script % values)
+        os.chmod(path, stat.S_IRWXU)
+        return path
+
+    def runs(self):
+        with open(self.log) as f:
+            return [line.split() for line in f]
+
+    def test_page_count_old_gs(self):
+        pdfconverter.GSCMD = self.stub('gs', GS_STUB, version='9.05',
+                                       permits='no')
+        self.assertEqual(pdfconverter.gs_version(), (9, 5))
+        self.assertEqual(pdfconverter.pdf_page_count('a.pdf'), 3)
+        self.assertEqual(pdfconverter.pdf_page_count('a.pdf'), 3)
+        runs = self.runs()
+        # the version is asked once
+        self.assertEqual([run[0] for run in runs],
+                         ['--version', '-q', '-q'])
+        self.assertTrue('-dSAFER' in runs[1])
+
+    def test_page_count_new_gs(self):
+        pdfconverter.GSCMD = self.stub('gs', GS_STUB, version='9.50',
+                                       permits='yes')
+        self.assertEqual(pdfconverter.pdf_page_count('a.pdf'), 3)
+        self.assertTrue('--permit-file-read=%s' % os.path.abspath('a.pdf')
+                        in self.runs()[1])
+
+    def test_page_count_no_gs(self):
+        pdfconverter.GSCMD = os.path.join(self.tmpdir, 'missing')
+        self.assertEqual(pdfconverter.gs_version(), ())
+        self.assertEqual(pdfconverter.pdf_page_count('a.pdf'), None)
+
+    def test_page_chunks(self):
+        page_chunks = pdfconverter.page_chunks
+        self.assertEqual(page_chunks(None, 4), [(None, None)])
+        self.assertEqual(page_chunks(1, 4), [(1, 1)])
+        # fewer pages than workers, one page each
+        self.assertEqual(page_chunks(3, 4), [(1, 1), (2, 2), (3, 3)])
+        self.assertEqual(page_chunks(10, 2), [(1, 5), (6, 10)])
+        # no chunk over RENDER_CHUNK pages
+        chunks = page_chunks(100, 4)
+        self.assertEqual(max(last - first + 1 for first, last in chunks),
+                         pdfconverter.RENDER_CHUNK)
+        self.assertEqual(chunks[0], (1, pdfconverter.RENDER_CHUNK))
+        self.assertEqual(chunks[-1][1], 100)
+        self.assertEqual([page for first, last in chunks
+                          for page in range(first, last + 1)],
+                         range(1, 101))
+
+    def rasterize(self, page_count, pages=12, workers=4):
+        pdfconverter.GSCMD = self.stub('gs', GS_RENDER_STUB, pages=pages)
+        pdfconverter.MOGRIFYCMD = self.stub('mogrify', MOGRIFY_STUB) + \
+                                  ' %(outdir)s %(page)s'
+        workdir = os.path.join(self.tmpdir, 'work')
+        os.mkdir(workdir)
+        result = []
+        for p, rawpath, pagepath in pdfconverter.rasterize(
+                'a.pdf', workdir, page_count, workers):
+            with open(rawpath) as raw:
+                with open(pagepath) as page:
+                    result.append((p, raw.read(), page.read()))
+        return result
+
+    def test_rasterize_in_page_order(self):
+        pages = self.rasterize(12)
+        self.assertEqual(pages, [(pdfconverter.PAGENAME % n, 'page %d' % n,
+                                  'page %d' % n) for n in range(1, 13)])
+        # the chunks ran in parallel and finished last to first
+        self.assertEqual(self.runs(), [['10-12'], ['7-9'], ['4-6'], ['1-3']])
+
+    def test_rasterize_uncounted(self):
+        pages = self.rasterize(None, pages=3)
+        self.assertEqual([p for p, raw, page in pages],
+                         [pdfconverter.PAGENAME % n for n in (1, 2, 3)])
+        self.assertEqual(self.runs(), [['1-3']])
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestPdfConverter)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -5,6 +5,7 @@ from __future__ import with_statement
 import time, threading, os
 from ew.launcher import camera_server
 from ew.util import ew_logging
+from ew.util.reactor import Reactor
 from ew.util.lock import ExclusiveLock, LockUnavailableError
 if not os.getenv('emulate_tablet'):
     from ew.services.audio import AudioService
@@ -77,14 +78,7 @@ class Camera(object):
     def _connect_to_camera_events(self):
         """Private - start the listener for camera server events."""
 
-        class CameraServerListener(threading.Thread):
-
-            def __init__(self):
-                super(CameraServerListener, self).__init__(
-                        name='camera server listener')
-
-            def run(self):
-                camera_server.CameraListener(self).run()
+        class CameraServerListener(object):
 
             def on_have_image(self, options, request_id, image_path):
                 logger.debug('on_have_image: options: %r, request_id=%r,'
@@ -142,12 +136,11 @@ class Camera(object):
                 else:
                     logger.debug("Couldn't acquire camera.")
 
-        # Start the thread.
-        cs_event_thread = CameraServerListener()
-        cs_event_thread.setDaemon(True)
-        cs_event_thread.start()
-        logger.info('Camera server event listener thread started')
-        time.sleep(1.0)
+        # Listen on the shared reactor; the events are handled on its
+        # worker thread.
+        if camera_server.CameraListener(CameraServerListener()).register(
+                Reactor.instance()):
+            logger.info('Camera server event listener registered')
 
     def forward_event(self, event, *args, **kwargs):
         try:
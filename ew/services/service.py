@@ -10,14 +10,16 @@ import subprocess as sub
 import sys
 import traceback
 
-from threading import Thread,Condition,RLock,Event
+from threading import Thread,Event,RLock
 from time import sleep,time
 
 from middleware.middleware_message import MiddlewareMessage as MM
 from middleware.message import Message, check_opcode
 from ew.util import ew_logging
+from ew.services.service_request import ServiceRequest, ReplyMultiplexer
 
 TIMEOUT_RESPONSE = 120       # give up waiting for sync response
+RECONNECT_DELAY = 1          # between looks for a restarted manager
 
 logger = ew_logging.getLogger('ew.services.service')
 
@@ -35,11 +37,16 @@ class Service(Thread):
         if self._class_id is None: raise NotImplementedError('_class_id')
         self.sock = None
         self.is_connected = False
+        # held to connect and close, which caller threads (do_cmd) and the
+        # reactor thread (_reconnect, _on_readable) may do at once
+        self._connect_lock = RLock()
+        # set by start(reactor), to listen without a thread of our own
+        self.reactor = None
+        self._reconnect_timer = None
         # async callbacks
         self.operations = {}
-        # sync responses
-        self.response = None
-        self.cv = Condition(RLock())
+        # requests waiting for replies
+        self.replies = ReplyMultiplexer(Message.new_request_id)
 
     @classmethod
     def check_running(cls,name):
@@ -70,9 +77,68 @@ class Service(Thread):
             self.operations[op_code].remove(callback)
 
     def open(self):
-        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self.sock.connect(self._path)
-        self.is_connected = True
+        """Connect to the manager, unless another thread just did"""
+        with self._connect_lock:
+            if self.sock and self.is_connected:
+                return
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self._path)
+            except:
+                sock.close()
+                raise
+            self.close()
+            self.sock = sock
+            self.is_connected = True
+            if self.reactor:
+                self.reactor.register(sock, self._on_readable)
+
+    def start(self, reactor=None):
+        """Listen to the manager on reactor, an ew.util.reactor.Reactor,
+        or without one on a thread of our own.
+
+        On a reactor, messages are read on the reactor thread, which
+        wakes sync waiters, and the callbacks run on its worker thread.
+        """
+        if reactor is None:
+            return super(Service,self).start()
+        logger.debug("starting listener on %s", reactor.name)
+        self.reactor = reactor
+        reactor.call_soon(self._reconnect)
+
+    def _reconnect(self):
+        """Reactor timer: connect to the manager when it is up"""
+        self._reconnect_timer = None
+        if self.finished.is_set() or (self.sock and self.is_connected):
+            return
+        # wait for server to come up again
+        if os.path.exists(self._path):
+            logger.debug("re-establishing connection to manager")
+            try:
+                self.open()
+                logger.debug("we're connected to manager")
+                return
+            except socket.error:
+                logger.debug("manager not accepting connections yet")
+        self._reconnect_timer = self.reactor.call_later(RECONNECT_DELAY,
+                                                        self._reconnect)
+
+    def _on_readable(self, sock):
+        """Reactor handler for the manager socket"""
+        try:
+            logger.debug("receiving message")
+            msg = Message.recv(sock)
+            if msg is None:
+                logger.debug("received empty message")
+                raise RuntimeError, "received empty message"
+        except:
+            logger.warn("lost message, closing connection")
+            self.close(sock)
+            self._reconnect()
+            return
+        logger.debug("handling msg: %r", msg)
+        self.reactor.run_in_worker(self._run_callbacks_in_worker, msg)
+        self.notify_waiters(msg)
 
     def run(self):
         logger.debug("starting listener")
@@ -98,33 +164,50 @@ class Service(Thread):
                 self.finished.wait(1)
         logger.debug("\n\nListener exiting %r\n\n", self._path)
 
-    def close(self):
-        logger.debug("closing service socket")
-        if self.sock:
-            self.sock.close()
-            self.sock = None
-        self.is_connected = False
+    def close(self, sock=None):
+        """Close the connection to the manager; if sock is given, only if
+        that is still the connection."""
+        with self._connect_lock:
+            if sock is not None and sock is not self.sock:
+                return
+            logger.debug("closing service socket")
+            if self.sock:
+                if self.reactor:
+                    self.reactor.unregister(self.sock)
+                self.sock.close()
+                self.sock = None
+            self.is_connected = False
 
     def stop(self):
         self.close()
         self.finished.set()
+        self.replies.cancel_all()
+        if self._reconnect_timer:
+            self._reconnect_timer.cancel()
 
     def handle_msg(self,msg):
         """called whenever manager sends a message to the client"""
+        self.run_callbacks(msg)
+        self.notify_waiters(msg)
+
+    def run_callbacks(self,msg):
         op_code = msg.op_code & 0xffff
         logger.debug("received message: %r", msg)
         if self.operations.has_key(op_code):
             for cb in self.operations[op_code]:
                 logger.debug("passing message to callback: %r", cb.func_name)
                 cb(*(msg.int_args + msg.char_args))
-        # notify sync waiters
-        logger.debug("notifying waiters: %r", msg)
-        self.cv.acquire()
-        logger.debug("listener lock acquired")
-        self.response = msg
-        self.cv.notify_all()
-        self.cv.release()
-        logger.debug("listener lock released: %r", msg)
+
+    def _run_callbacks_in_worker(self,msg):
+        try:
+            self.run_callbacks(msg)
+        except:
+            logger.exception("callbacks failed for message %r", msg)
+
+    def notify_waiters(self,msg):
+        request = self.replies.deliver(msg)
+        if request:
+            logger.debug("reply for request %r: %r", request, msg)
 
     def do_cmd(self,
             op_code,
@@ -132,57 +215,87 @@ class Service(Thread):
             request_id=0,
             int_args = None,
             char_args = None,
-            wait = False
+            wait = False,
+            timeout = TIMEOUT_RESPONSE
         ):
+        """
+        Send a command to the manager. Returns True once sent, False if it
+        could not be. With wait, returns the reply: the message with the
+        command's request_id or, if wait is a tuple of op codes, the first
+        with one of those; None if there is none in timeout seconds, the
+        command could not be sent or the service stopped.
+        """
         if not os.path.exists(self._path):
             logger.error("command not sent because control socket is gone")
             return False
         if self.sock is None or not self.is_connected:
             self.open()
-            if self.sock is None or not self.is_connected:
-                return False
+        sock = self.sock
+        if sock is None or not self.is_connected:
+            return False
         op_code = check_opcode(self._prefix, op_code)
         op_code |= self._class_id << 16
-        if wait and request_id == 0:
-            # we must have a unique request id or waiters will conflict
-            request_id = Message.new_request_id()
+        request = None
+        if wait:
+            # registered before sending, so the reply cannot be missed;
+            # a new request id unless the caller gave one
+            request = self.replies.expect(op_code, request_id, timeout,
+                    wait if isinstance(wait,tuple) else ())
+            request_id = request.request_id
         msg = Message(op_code, options, request_id, int_args, char_args)
         try:
             logger.debug('sending message: %r', msg)
-            msg.send(self.sock)
+            msg.send(sock)
             logger.debug('message sent')
         except:
             # exception, most likely because listener is gone
             logger.exception("got exception while sending message")
-            if self.is_connected: self.close()
+            self.close(sock)
+            if request: request.cancel()
             return None if wait else False
-        if wait:
+        if request:
             logger.debug("waiting for response")
-            msg = None
-            self.cv.acquire()
-            logger.debug("service lock acquired")
-            timeout = time() + TIMEOUT_RESPONSE
-            while not self.finished.is_set():
-                self.cv.wait(2.5)
-                if self.response is None: continue
-                if self.response.request_id == request_id:
-                    msg = self.response
-                    break
-                if time() > timeout:
-                    logger.debug("response not seen in %d secs, timeout"
-                        % TIMEOUT_RESPONSE)
-                    break
-                if isinstance(wait,tuple):
-                    if self.response.op_code in wait:
-                        msg = self.response
-                        break
-            self.response = None
-            self.cv.release()
-            logger.debug("service lock released")
+            try:
+                msg = request.result()
+            except ServiceRequest.Timeout:
+                logger.debug("response not seen in %d secs, timeout", timeout)
+                msg = None
             logger.debug("response received: %r", msg)
             return msg
         return True
 
+    def submit(self, operation, *args, **kwargs):
+        """
+        Send a command without waiting and return its ServiceRequest, so
+        that several commands can be outstanding at once; collect the
+        replies with request.result(), wait_all or wait_any, or drop a
+        request with request.cancel().
+
+        "operation" is the name of a command method taking request_id and
+        wait, e.g. "get_conn_info", or the bound method. Optional
+        "timeout" (seconds, default TIMEOUT_RESPONSE) and "accept" (op
+        codes that also answer it, as for a wait tuple) keywords apply to
+        the request; the other arguments are passed to the method. The
+        request is cancelled at once if the command could not be sent.
+        """
+        if isinstance(operation, basestring):
+            operation = getattr(self, operation)
+        timeout = kwargs.pop('timeout', TIMEOUT_RESPONSE)
+        accept = kwargs.pop('accept', ())
+        request = self.replies.expect(operation.__name__, 0, timeout, accept)
+        kwargs.update(request_id=request.request_id, wait=False)
+        if not operation(*args, **kwargs):
+            request.cancel()
+        return request
+
+    def wait_all(self, requests, timeout=None):
+        """See ReplyMultiplexer.wait_all"""
+        return self.replies.wait_all(requests, timeout)
+
+    def wait_any(self, requests, timeout=None):
+        """See ReplyMultiplexer.wait_any"""
+        return self.replies.wait_any(requests, timeout)
+
     def help(self):
         print "You are now in console mode, enter the following commands:"
         print
@@ -212,7 +325,8 @@ class Service(Thread):
         This is a testing console that is useful for testing commands.
         """
         waiting = False
-        if not self.finished.is_set() and not self.is_alive(): self.start()
+        if not self.finished.is_set() and not self.is_alive() and \
+                not self.reactor: self.start()
         self.help()
         while True:
             try:
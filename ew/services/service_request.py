@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# Copyright (c) 2011 __Ricoh Company Ltd.__. All rights reserved.
+
+"""Matching service manager replies to the commands waiting for them.
+
+A Service sends a command with a request id and the manager answers with
+a message carrying the same id. A ReplyMultiplexer holds a ServiceRequest
+for each command still waiting, so any number of commands can be
+outstanding at once, each with its own timeout, and a reply only ever
+completes the request it belongs to.
+"""
+
+from __future__ import with_statement
+
+import threading
+import time
+
+from ew.util import ew_logging
+
+logger = ew_logging.getLogger('ew.services.service_request')
+
+class ServiceRequest(object):
+    """A command sent to a service manager, and the reply to it.
+
+    "reply" is the first message received with the request id, or with an
+    op code in "accept"; it stays None if the request is cancelled.
+
+    """
+
+    class Timeout(Exception):
+        """Raised when a request is not answered in time."""
+
+    def __init__(self, replies, name, request_id, timeout=None, accept=()):
+        self._replies = replies
+        self.name = name
+        self.request_id = request_id
+        self.accept = accept
+        self.reply = None
+        self.start = time.time()
+        self.deadline = self.start + timeout if timeout else None
+        self.completed = False
+        self.cancelled = False
+        self.timed_out = False
+
+    def done(self):
+        return self.completed or self.cancelled or self.timed_out
+
+    def result(self, timeout=None):
+        """Waits for the reply and returns it, None if the request was
+        cancelled. Raises ServiceRequest.Timeout if the request's own
+        timeout expires, or if it is not done within "timeout" seconds.
+
+        """
+        self._replies.wait_all([self], timeout)
+        return self.reply
+
+    def cancel(self):
+        """Stops waiting for the reply; result() returns None."""
+        self._replies.cancel(self)
+
+    def __repr__(self):
+        return '<ServiceRequest %s %d %s>' % (self.name, self.request_id,
+                'done' if self.completed else
+                'cancelled' if self.cancelled else
+                'timed out' if self.timed_out else 'pending')
+
+
+class ReplyMultiplexer(object):
+    """The requests of one Service waiting for replies, by request id.
+
+    new_request_id is called for the id of a request made without one;
+    0 and ids still pending are skipped.
+
+    """
+
+    def __init__(self, new_request_id):
+        self._new_request_id = new_request_id
+        self._pending = {}      # request id -> ServiceRequest
+        self._lock = threading.Lock()
+        self._completion = threading.Condition(self._lock)
+
+    def expect(self, name, request_id=0, timeout=None, accept=()):
+        """Returns a ServiceRequest for a command about to be sent, with a
+        new request id if request_id is 0. Replies are matched to it from
+        now on, so register before sending.
+
+        """
+        with self._lock:
+            if request_id:
+                if request_id in self._pending:
+                    raise ValueError('request id %d is already pending' %
+                                     request_id)
+            else:
+                request_id = self._new_request_id()
+                while not request_id or request_id in self._pending:
+                    request_id = self._new_request_id()
+            request = ServiceRequest(self, name, request_id, timeout, accept)
+            self._pending[request_id] = request
+        return request
+
+    def deliver(self, msg):
+        """Completes the request msg answers, if one is waiting: the one
+        with its request id, else the oldest accepting its op code.
+        Returns that request, or None.
+
+        """
+        with self._lock:
+            request = self._pending.pop(msg.request_id, None)
+            if request is None:
+                accepting = [r for r in self._pending.itervalues()
+                             if msg.op_code in r.accept]
+                if not accepting:
+                    return None
+                request = min(accepting, key=lambda r: r.start)
+                del self._pending[request.request_id]
+            request.reply = msg
+            request.completed = True
+            self._completion.notifyAll()
+        return request
+
+    def cancel(self, request):
+        with self._lock:
+            if not request.done():
+                request.cancelled = True
+                self._pending.pop(request.request_id, None)
+                self._completion.notifyAll()
+
+    def cancel_all(self):
+        """Cancels every pending request, e.g. when the service stops."""
+        with self._lock:
+            for request in self._pending.itervalues():
+                request.cancelled = True
+            self._pending = {}
+            self._completion.notifyAll()
+
+    def pending(self):
+        return len(self._pending)
+
+    def _expire(self, requests, now):
+        # Called with self._lock held.
+        for request in requests:
+            if (request.deadline and now >= request.deadline
+                    and not request.done()):
+                request.timed_out = True
+                self._pending.pop(request.request_id, None)
+                logger.info('Service request %s %d timed out',
+                            request.name, request.request_id)
+
+    def wait_all(self, requests, timeout=None):
+        """Waits until all the requests are done and returns their
+        replies. Raises ServiceRequest.Timeout if any of them expires, or
+        if they are not all done within "timeout" seconds.
+
+        """
+        self._wait_until(lambda: all(r.done() for r in requests),
+                         requests, timeout)
+        expired = [r for r in requests if r.timed_out]
+        if expired:
+            raise ServiceRequest.Timeout('Service requests timed out: %s' %
+                                         expired)
+        return [r.reply for r in requests]
+
+    def wait_any(self, requests, timeout=None):
+        """Waits until at least one of the requests is done and returns
+        the list of those that are. Raises ServiceRequest.Timeout if none
+        is done within "timeout" seconds.
+
+        """
+        self._wait_until(lambda: any(r.done() for r in requests),
+                         requests, timeout)
+        return [r for r in requests if r.done()]
+
+    def _wait_until(self, predicate, requests, timeout):
+        end = time.time() + timeout if timeout is not None else None
+        with self._completion:
+            while True:
+                now = time.time()
+                self._expire(requests, now)
+                if predicate():
+                    return
+                if end is not None and now >= end:
+                    raise ServiceRequest.Timeout(
+                            'Service requests not done in %ss: %s' %
+                            (timeout, requests))
+                deadlines = [r.deadline for r in requests
+                             if r.deadline and not r.done()]
+                if end is not None:
+                    deadlines.append(end)
+                self._completion.wait(
+                        min(deadlines) - now if deadlines else None)
@@ -0,0 +1,92 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import os, shutil, socket, tempfile, threading, time, unittest
+from middleware.middleware_message import MiddlewareMessage as MM
+from ew.services.service import Service
+from ew.util.reactor import Reactor
+
+class FakeManager(object):
+    """Accepts connections on a Unix socket and keeps them"""
+
+    def __init__(self, path):
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(16)
+        self.connections = []
+        self.accepted = threading.Condition()
+        thread = threading.Thread(target=self.accept)
+        thread.setDaemon(True)
+        thread.start()
+
+    def accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()[0]
+            except socket.error:
+                return
+            with self.accepted:
+                self.connections.append(conn)
+                self.accepted.notifyAll()
+
+    def wait_for(self, count, timeout=5):
+        deadline = time.time() + timeout
+        with self.accepted:
+            while len(self.connections) < count and time.time() < deadline:
+                self.accepted.wait(deadline - time.time())
+            return len(self.connections)
+
+    def close(self):
+        self.listener.close()
+        for conn in self.connections:
+            conn.close()
+
+class TestServiceConnect(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(self.tmpdir, 'manager')
+        self.manager = FakeManager(path)
+        class TestService(Service):
+            _path = path
+            _prefix = 'NETWORK_MANAGER'
+            _class_id = MM.NETWORK_SERVICE_CLASS
+        self.service = TestService()
+        self.reactor = Reactor('test-reactor')
+        self.reactor.start()
+
+    def tearDown(self):
+        self.service.stop()
+        self.reactor.close()
+        self.manager.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_do_cmd_races_reconnect(self):
+        rounds = 30
+        self.service.start(self.reactor)
+        self.assertEqual(self.manager.wait_for(1), 1)
+        for n in range(rounds):
+            self.service.close()
+            senders = [threading.Thread(target=self.service.do_cmd,
+                    args=(MM.NETWORK_MANAGER_GET_CONN_INFO,))
+                    for k in range(3)]
+            self.reactor.call_soon(self.service._reconnect)
+            for sender in senders:
+                sender.start()
+            for sender in senders:
+                sender.join(5)
+            self.manager.wait_for(n + 2)
+        time.sleep(0.2)
+        # one connection per round, and only the current one registered
+        self.assertEqual(len(self.manager.connections), rounds + 1)
+        self.assertTrue(self.service.is_connected)
+        self.assertEqual(
+                [fd for fd in self.reactor._handlers
+                 if fd != self.service.sock.fileno()], [])
+        # closing the service leaves no connection open at the manager
+        self.service.stop()
+        for conn in self.manager.connections:
+            conn.settimeout(2)
+            while conn.recv(4096):
+                pass
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestServiceConnect)
+    unittest.TextTestRunner(verbosity=2).run(suite)
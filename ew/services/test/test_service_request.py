@@ -0,0 +1,71 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import itertools, threading, time, unittest
+from ew.services.service_request import ServiceRequest, ReplyMultiplexer
+
+class Reply(object):
+    def __init__(self, request_id, op_code=1):
+        self.request_id = request_id
+        self.op_code = op_code
+
+class TestReplyMultiplexer(unittest.TestCase):
+    def setUp(self):
+        ids = itertools.cycle([0, 5, 6, 7])
+        self.replies = ReplyMultiplexer(ids.next)
+
+    def test_ids(self):
+        requests = [self.replies.expect('cmd') for n in range(3)]
+        self.assertEqual([r.request_id for r in requests], [5, 6, 7])
+        self.assertRaises(ValueError, self.replies.expect, 'cmd', 6)
+        requests[0].cancel()
+        self.assertEqual(self.replies.expect('cmd').request_id, 5)
+
+    def test_concurrent_replies(self):
+        requests = [self.replies.expect('cmd') for n in range(3)]
+        results = {}
+        def wait(request):
+            results[request.request_id] = request.result(5)
+        threads = [threading.Thread(target=wait, args=(r,)) for r in requests]
+        for t in threads:
+            t.start()
+        replies = [Reply(7), Reply(99), Reply(5), Reply(6)]
+        for reply in replies:
+            self.replies.deliver(reply)
+        for t in threads:
+            t.join(5)
+        self.assertEqual(results, {5: replies[2], 6: replies[3],
+                                   7: replies[0]})
+        self.assertEqual(self.replies.pending(), 0)
+
+    def test_accept(self):
+        first = self.replies.expect('cmd', accept=(40,))
+        second = self.replies.expect('cmd', accept=(40,))
+        connected = Reply(0, 40)
+        self.assertTrue(self.replies.deliver(connected) is first)
+        self.assertEqual(first.result(0), connected)
+        self.assertFalse(second.done())
+
+    def test_timeouts(self):
+        quick = self.replies.expect('cmd', timeout=0.05)
+        slow = self.replies.expect('cmd')
+        start = time.time()
+        self.assertRaises(ServiceRequest.Timeout, quick.result)
+        self.assertTrue(quick.timed_out)
+        self.assertRaises(ServiceRequest.Timeout, slow.result, 0.05)
+        self.assertTrue(time.time() - start < 1)
+        self.assertFalse(slow.done())
+        self.assertEqual(self.replies.deliver(Reply(quick.request_id)), None)
+        self.assertEqual(self.replies.wait_any([quick, slow], 0), [quick])
+
+    def test_cancel(self):
+        request = self.replies.expect('cmd')
+        threading.Timer(0.05, request.cancel).start()
+        self.assertEqual(request.result(5), None)
+        self.assertTrue(request.cancelled)
+        self.assertEqual(self.replies.deliver(Reply(request.request_id)), None)
+        others = [self.replies.expect('cmd') for n in range(2)]
+        self.replies.cancel_all()
+        self.assertEqual(self.replies.wait_all(others, 0), [None, None])
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestReplyMultiplexer)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -3,16 +3,29 @@
 #Here are all our communication ports and the what and various server classes
 #and Server and Client instance creation functions
 
-from xmlrpclib import ServerProxy, Fault
+from __future__ import with_statement
+
+from xmlrpclib import ServerProxy, Fault, ProtocolError, Transport
 import SimpleXMLRPCServer
+import errno
+import httplib
+import marshal
+import os
+import select
+import stat
+import sys
+import xmlrpclib
 import socket
 import SocketServer
+import struct
 import threading
 import time
 import itertools
 import traceback
 
-from ew.util import ew_logging
+from ew.util import ew_logging, rpc_stats, system_config
+from ew.util.reactor import Reactor
+from ew.util.worker_pool import WorkerPool
 
 logger = _logger = ew_logging.getLogger('ew.util.comms')
 
@@ -27,6 +40,35 @@ DS_INPUT_PORT = 8772
 
 DEFAULT_IP='0.0.0.0'
 
+# Servers listen on TCP, on the Unix domain socket of their port, or both
+# while clients move over to the Unix sockets. The sockets are in a
+# directory only this user may enter, see private_socket_dir.
+LISTEN_TCP = 'tcp'
+LISTEN_UNIX = 'unix'
+LISTEN_BOTH = 'both'
+RPC_SOCKET_DIR = system_config.rpc_socket_dir
+
+KEEP_ALIVE_TIMEOUT = 60  # seconds a server keeps an idle connection open
+MAX_IDLE_CONNECTIONS = 4 # kept open per host:port by a ConnectionPool
+
+RPC_WORKERS = 4          # threads of a PooledXMLRPCServer
+RPC_MAX_QUEUED = 32      # new connections waiting for one of them
+RPC_QUEUE_TIMEOUT = 5    # seconds a new connection waits to be queued
+RPC_LINGER = 0.002       # seconds a worker waits for a connection's next call
+
+# Calls on a keep-alive connection may be sent as marshal data instead of
+# XML: a client offers it with CODEC_HEADER on a call, and a server that
+# accepts it says so in its response. marshal is not safe on untrusted
+# data, so both ends only use it on a Unix domain socket whose peer runs
+# as the same user, see peer_uid; calls over TCP are always XML.
+CODEC_HEADER = 'X-RPC-Codec'
+MARSHAL_CODEC = 'marshal'
+MARSHAL_CONTENT_TYPE = 'application/x-ew-marshal'
+# getsockopt giving the pid, uid and gid of a Unix domain socket's peer
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED',
+                      17 if sys.platform.startswith('linux') else None)
+PEERCRED = struct.Struct('3i')
+
 ServerNames = dict(SYNC_PORT = "Sync", DEC_PORT = "DEC", INBOX_PORT = "Inbox",
                    LAUNCHER_PORT = "Launcher",
                    LISTINGS_UPDATER_PORT = "ListingsUpdater",
@@ -35,7 +77,9 @@ ServerNames = dict(SYNC_PORT = "Sync", DEC_PORT = "DEC", INBOX_PORT = "Inbox",
 Fault_repr_fixed = False
 
 class AsyncXMLRPCServer(SocketServer.ThreadingMixIn,
-                        SimpleXMLRPCServer.SimpleXMLRPCServer): pass
+                        SimpleXMLRPCServer.SimpleXMLRPCServer):
+    # a thread may be waiting on an idle keep-alive connection
+    daemon_threads = True
 
 def fixed_fault_repr(self):
     return "<Fault %s: %s>" % (self.faultCode, self.faultString)
@@ -46,7 +90,422 @@ def ensure_Fault_fix():
         Fault.__repr__ = fixed_fault_repr
         Fault_repr_fixed = True
 
-class ErrorLoggingXMLRPCServer(AsyncXMLRPCServer):
+def as_xmlrpc_types(value):
+    """value as XML-RPC would have delivered it: lists for tuples, str for
+    ASCII unicode and unicode for non-ASCII str, so that a call gives the
+    same types whether it went as marshal data or as XML"""
+    value_type = type(value)
+    if value_type is str:
+        try:
+            value.decode('ascii')
+        except UnicodeDecodeError:
+            try:
+                return value.decode('utf-8')
+            except UnicodeDecodeError:
+                pass
+        return value
+    if value_type is unicode:
+        try:
+            return value.encode('ascii')
+        except UnicodeEncodeError:
+            return value
+    if value_type is list or value_type is tuple:
+        return [as_xmlrpc_types(item) for item in value]
+    if value_type is dict:
+        return dict((as_xmlrpc_types(key), as_xmlrpc_types(item))
+                    for key, item in value.iteritems())
+    return value
+
+def peer_uid(sock):
+    """The uid of the process at the other end of the Unix domain socket
+    sock, or None if the system cannot tell"""
+    if SO_PEERCRED is None:
+        return None
+    try:
+        creds = sock.getsockopt(socket.SOL_SOCKET, SO_PEERCRED,
+                                PEERCRED.size)
+    except socket.error:
+        return None
+    return PEERCRED.unpack(creds)[1]
+
+def trusted_peer(sock):
+    """Whether the peer of the Unix domain socket sock runs as this user,
+    so that marshal data from it may be loaded"""
+    return peer_uid(sock) == os.getuid()
+
+def marshal_dispatch(server, data, dispatch_method=None):
+    """Calls dispatch_method (server._dispatch if None) for a call sent as
+    marshal data, the way _marshaled_dispatch does for XML. Returns
+    (content type, response); the response is XML if the result cannot be
+    marshalled."""
+    try:
+        method, params = marshal.loads(data)
+        result = False, (dispatch_method or server._dispatch)(
+                method, as_xmlrpc_types(params))
+    except Fault, fault:
+        result = True, (fault.faultCode, fault.faultString)
+    except:
+        exc_type, exc_value = sys.exc_info()[:2]
+        result = True, (1, '%s:%s' % (exc_type, exc_value))
+    try:
+        return MARSHAL_CONTENT_TYPE, marshal.dumps(result)
+    except ValueError:
+        failed, value = result
+        response = Fault(*value) if failed else (value,)
+        return 'text/xml', xmlrpclib.dumps(response, methodresponse=not failed,
+                allow_none=server.allow_none, encoding=server.encoding)
+
+class RPCRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
+    """Records each call in the rpc_stats of the server, if it has one.
+    The Unix socket handlers also take calls sent as marshal data."""
+
+    def log_message(self, format, *args):
+        logger.debug('%s: %s', self.address_string(), format % args)
+
+    def marshal_allowed(self):
+        return False
+
+    def do_POST(self):
+        if not self.is_rpc_path_valid():
+            self.report_404()
+            return
+        start = time.time()
+        self.offer_codec = (self.headers.get(CODEC_HEADER) == MARSHAL_CODEC
+                            and self.marshal_allowed())
+        self.method = None
+        self.failed = True
+        data = response = ''
+        with rpc_stats.tracing(self.headers.get(rpc_stats.TRACE_HEADER)) \
+                as self.trace:
+            try:
+                data = self.rfile.read(int(self.headers['Content-Length']))
+                if (self.offer_codec and self.headers.get('Content-Type') ==
+                        MARSHAL_CONTENT_TYPE):
+                    content_type, response = marshal_dispatch(self.server,
+                            data, self._dispatch)
+                else:
+                    content_type = 'text/xml'
+                    response = self.server._marshaled_dispatch(data,
+                                                               self._dispatch)
+            except Exception:
+                # only if this module is buggy, as in SimpleXMLRPCServer
+                logger.exception('Error serving %s', self.method)
+                self.send_response(500)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+        elapsed = time.time() - start
+        stats = getattr(self.server, 'rpc_stats', None)
+        if stats is not None:
+            stats.record(self.method or 'unknown', elapsed, len(data),
+                         len(response), self.failed)
+        rpc_stats.log_call('server', self.trace, self.method, elapsed,
+                           self.failed)
+
+    def _dispatch(self, method, params):
+        self.method = method
+        result = self.server._dispatch(method, params)
+        self.failed = False
+        return result
+
+    def end_headers(self):
+        if getattr(self, 'offer_codec', False):
+            self.send_header(CODEC_HEADER, MARSHAL_CODEC)
+        trace = getattr(self, 'trace', None)
+        if trace:
+            self.send_header(rpc_stats.TRACE_HEADER, trace)
+        SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.end_headers(self)
+
+class KeepAliveRequestHandler(RPCRequestHandler):
+    """Serves any number of requests on a connection (HTTP/1.1), until the
+    client closes it or it is idle for KEEP_ALIVE_TIMEOUT seconds."""
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEP_ALIVE_TIMEOUT
+    # the response goes out in one write, not held back by Nagle's
+    # algorithm waiting for the client's delayed ACK
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        if not getattr(self.server, 'request_per_task', False):
+            return RPCRequestHandler.handle(self)
+        # the server waits for the next request without a thread
+        self.close_connection = 1
+        self.handle_one_request()
+
+class UnixRequestHandlerMixIn:
+    # there is no Nagle's algorithm, nor a client host, on a Unix socket
+    disable_nagle_algorithm = False
+
+    def address_string(self):
+        return self.server.server_address
+
+    def marshal_allowed(self):
+        """only from a client running as this user"""
+        allowed = getattr(self, '_marshal_allowed', None)
+        if allowed is None:
+            allowed = self._marshal_allowed = trusted_peer(self.connection)
+        return allowed
+
+class UnixKeepAliveRequestHandler(UnixRequestHandlerMixIn,
+                                  KeepAliveRequestHandler):
+    pass
+
+class UnixRequestHandler(UnixRequestHandlerMixIn, RPCRequestHandler):
+    pass
+
+def rpc_socket_path(port):
+    """The Unix domain socket of the server of a port"""
+    return os.path.join(RPC_SOCKET_DIR, 'ew_rpc_%d.sock' % port)
+
+def private_socket_dir(directory):
+    """Make directory, mode 0700, if it does not exist, or take away the
+    group and other permissions of an existing one. Raises socket.error
+    if it is not a directory of this user, such as one another user made
+    to put their own sockets in."""
+    try:
+        os.makedirs(directory, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise socket.error(errno.EACCES, '%s is not a directory of uid %d' %
+                           (directory, os.getuid()))
+    if st.st_mode & 0077:
+        os.chmod(directory, 0700)
+    return directory
+
+class UnixServerMixIn:
+    """Makes an XML-RPC server class listen on a Unix domain socket; its
+    address is the path of the socket, which unix_server_class servers
+    remove when closed."""
+    address_family = socket.AF_UNIX
+    allow_reuse_address = False
+
+    def server_bind(self):
+        path = self.server_address
+        private_socket_dir(os.path.dirname(path))
+        if os.path.exists(path):
+            # left by a server that died, unless one is still listening
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                try:
+                    probe.connect(path)
+                except socket.error:
+                    os.unlink(path)
+                else:
+                    raise socket.error(errno.EADDRINUSE,
+                                       '%s is in use' % path)
+            finally:
+                probe.close()
+        SocketServer.TCPServer.server_bind(self)
+        self.socket_bound = True
+        os.chmod(path, 0600)
+
+    def remove_socket(self):
+        # not if binding failed: the socket is another server's
+        if getattr(self, 'socket_bound', False):
+            try:
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+
+    def server_name(self):
+        return self.server_address
+
+def unix_server_class(server_class):
+    """server_class, listening on a Unix domain socket"""
+    if issubclass(server_class, UnixServerMixIn):
+        return server_class
+    class UnixServer(UnixServerMixIn, server_class):
+        def server_close(self):
+            server_class.server_close(self)
+            self.remove_socket()
+    UnixServer.__name__ = 'Unix' + server_class.__name__
+    return UnixServer
+
+class ServerGroup(object):
+    """One XML-RPC server listening on several sockets. The first server
+    dispatches the calls received by all of them, so functions are
+    registered with the group as with a single server."""
+
+    def __init__(self, servers):
+        self.servers = servers
+        self._threads = []
+        primary = servers[0]
+        for server in servers[1:]:
+            server._marshaled_dispatch = primary._marshaled_dispatch
+            server._dispatch = primary._dispatch
+
+    def __getattr__(self, name):
+        return getattr(self.servers[0], name)
+
+    def serve_forever(self):
+        """Serves the other sockets on threads of their own, and the
+        first on this thread"""
+        for server in self.servers[1:]:
+            thread = threading.Thread(target=server.serve_forever,
+                    name='%s-%s' % (threading.currentThread().getName(),
+                                    server.server_name()))
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+        self.servers[0].serve_forever()
+
+    def shutdown(self):
+        self.servers[0].shutdown()
+        for server in self.servers[1:len(self._threads) + 1]:
+            server.shutdown()
+
+    def server_close(self):
+        for server in self.servers:
+            server.server_close()
+
+class WorkerPoolMixIn:
+    """Serves requests on a fixed pool of worker threads, instead of a
+    thread per connection like ThreadingMixIn.
+
+    A worker serves one request of a connection at a time. Between
+    requests, a keep-alive connection waits in the reactor, so idle
+    connections hold no thread; it is closed once idle for the handler's
+    timeout. A worker waits up to linger seconds for the next request
+    before handing a connection to the reactor. No more than max_queued new connections wait for a worker.
+    When that many are waiting, the accept loop blocks, so further clients
+    wait in the listen backlog. A connection that cannot be queued within
+    queue_timeout seconds is closed and counted as rejected."""
+
+    workers = RPC_WORKERS
+    max_queued = RPC_MAX_QUEUED
+    queue_timeout = RPC_QUEUE_TIMEOUT
+    linger = RPC_LINGER
+    reactor = None          # Reactor.instance() if None
+    # a KeepAliveRequestHandler serves a single request
+    request_per_task = True
+
+    def server_activate(self):
+        SocketServer.TCPServer.server_activate(self)
+        if self.reactor is None:
+            self.reactor = Reactor.instance()
+        address = self.server_address
+        self.pool_name = 'rpc-%s' % (address[1] if isinstance(address, tuple)
+                                     else os.path.basename(address))
+        self._pool = WorkerPool(self.workers, self.pool_name)
+        self._lock = threading.Lock()
+        self._queue_space = threading.Condition(self._lock)
+        self._queued = 0        # new connections waiting for a worker
+        self._busy = 0
+        self._idle = {}         # fd -> (connection, client address, Timer)
+        self._closed = False
+        self.rejected = 0
+
+    def process_request(self, request, client_address):
+        end = time.time() + self.queue_timeout
+        with self._queue_space:
+            while self._queued >= self.max_queued and not self._closed:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    self.rejected += 1
+                    break
+                self._queue_space.wait(remaining)
+            else:
+                self._queued += 1
+                self._pool.submit(self._serve, request, client_address, True)
+                return
+        logger.warn('%s: %d connections waiting, rejected %s',
+                    self.pool_name, self._queued, client_address)
+        self._drop(request)
+
+    def _serve(self, request, client_address, new):
+        with self._lock:
+            if new:
+                self._queued -= 1
+                self._queue_space.notify()
+            self._busy += 1
+        close = True
+        try:
+            try:
+                while True:
+                    handler = self.RequestHandlerClass(request,
+                                                       client_address, self)
+                    close = getattr(handler, 'close_connection', True)
+                    if close or not self._next_request_soon(request):
+                        break
+            except:
+                self.handle_error(request, client_address)
+        finally:
+            with self._lock:
+                self._busy -= 1
+                close = close or self._closed
+                if not close:
+                    timer = self.reactor.call_later(
+                            self.RequestHandlerClass.timeout,
+                            self._expire_idle, request)
+                    self._idle[request.fileno()] = (request, client_address,
+                                                    timer)
+        if close:
+            self._drop(request)
+        else:
+            self.reactor.register(request, self._on_idle_readable)
+
+    def _next_request_soon(self, request):
+        # a client making a run of calls sends the next one within a round
+        # trip; serving it here saves two hand-offs through the reactor
+        poll = select.poll()
+        poll.register(request, select.POLLIN)
+        return bool(poll.poll(self.linger * 1000))
+
+    def _on_idle_readable(self, request):
+        # on the reactor thread: the next request, or the client closing
+        self.reactor.unregister(request)
+        with self._lock:
+            request, client_address, timer = self._idle.pop(request.fileno())
+        timer.cancel()
+        self._pool.submit(self._serve, request, client_address, False)
+
+    def _expire_idle(self, request):
+        with self._lock:
+            if self._idle.pop(request.fileno(), None) is None:
+                return
+        self.reactor.unregister(request)
+        self._drop(request)
+
+    def _drop(self, request):
+        shutdown_request = getattr(self, 'shutdown_request', None)
+        if shutdown_request:
+            shutdown_request(request)
+        else:   # before Python 2.7
+            self.close_request(request)
+
+    def stats(self):
+        with self._lock:
+            return dict(workers=self.workers, busy=self._busy,
+                        queued=self._queued, idle=len(self._idle),
+                        rejected=self.rejected)
+
+    def server_close(self):
+        SocketServer.TCPServer.server_close(self)
+        if getattr(self, '_pool', None) is None:
+            return      # binding failed
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, {}
+            self._queue_space.notifyAll()
+        for request, client_address, timer in idle.itervalues():
+            timer.cancel()
+            self.reactor.unregister(request)
+            self._drop(request)
+        self._pool.close()
+
+class PooledXMLRPCServer(WorkerPoolMixIn, SimpleXMLRPCServer.SimpleXMLRPCServer):
+    pass
+
+class ErrorLoggingMixIn:
 
     def server_name(self):
         port = self.server_address[1]
@@ -61,25 +520,79 @@ class ErrorLoggingXMLRPCServer(AsyncXMLRPCServer):
             logger.debug('%s', trace)
             raise Exception('Remote server: %s\n%s' % (self.server_name(), trace))
 
-def create_XMLRPC_server(port, server_class=ErrorLoggingXMLRPCServer,server_ip=DEFAULT_IP):
-    server = server_class((server_ip, port), allow_none=True,
-        logRequests=False)
+class ErrorLoggingXMLRPCServer(ErrorLoggingMixIn, AsyncXMLRPCServer):
+    pass
+
+class ErrorLoggingPooledXMLRPCServer(WorkerPoolMixIn, ErrorLoggingMixIn,
+                                     SimpleXMLRPCServer.SimpleXMLRPCServer):
+    pass
+
+def create_XMLRPC_server(port, server_class=ErrorLoggingXMLRPCServer,server_ip=DEFAULT_IP,
+        keep_alive=None, listen=LISTEN_TCP):
+    """keep_alive (the default for threaded servers) serves HTTP/1.1, so
+    clients can send many calls on one connection. A server without threads
+    would serve only the one connection, so it closes each after a call.
+
+    listen is LISTEN_TCP (server_ip:port), LISTEN_UNIX (rpc_socket_path of
+    port) or LISTEN_BOTH, which returns a ServerGroup. The Unix socket of a
+    server on port 0 is that of the port it gets."""
+    if keep_alive is None:
+        keep_alive = issubclass(server_class,
+                (SocketServer.ThreadingMixIn, WorkerPoolMixIn))
+    servers = []
+    try:
+        if listen in (LISTEN_TCP, LISTEN_BOTH):
+            handler = KeepAliveRequestHandler if keep_alive else \
+                    RPCRequestHandler
+            servers.append(server_class((server_ip, port), handler,
+                    allow_none=True, logRequests=False))
+            port = port or servers[0].server_address[1]
+        if listen in (LISTEN_UNIX, LISTEN_BOTH):
+            handler = UnixKeepAliveRequestHandler if keep_alive else \
+                    UnixRequestHandler
+            servers.append(unix_server_class(server_class)(
+                    rpc_socket_path(port), handler, allow_none=True,
+                    logRequests=False))
+    except:
+        for server in servers:
+            server.server_close()
+        raise
+    if not servers:
+        raise ValueError('listen is %r, not one of LISTEN_TCP, LISTEN_UNIX, '
+                         'LISTEN_BOTH' % listen)
+    stats = rpc_stats.RPCStats()
+    for each in servers:
+        each.rpc_stats = stats
+    server = servers[0] if len(servers) == 1 else ServerGroup(servers)
     server.register_introspection_functions()
     server.register_function(__nonzero__)
+    server.register_function(lambda: server_stats(servers), '__stats__')
     return server
 
 def __nonzero__():
     return True
 
+def server_stats(servers):
+    """What the __stats__ RPC returns: the calls served and the calls
+    made by this process, and the worker pools of the servers"""
+    return dict(pid=os.getpid(),
+                server=servers[0].rpc_stats.as_dict(),
+                client=rpc_stats.client_stats.as_dict(),
+                pools=[server.stats() for server in servers
+                       if isinstance(server, WorkerPoolMixIn)])
+
 class XMLRPCClient(object):
     def __init__(self, port):
-        self._client = create_XMLRPC_client('localhost', port)
+        self._client = create_XMLRPC_client('localhost', port,
+                                            unix_socket=True)
 
     def __getattr__(self, name):
         return getattr(self._client, name)
 
 
 def create_threaded_server(port, **kwargs):
+    """A server calling its functions on a pool of RPC_WORKERS threads"""
+    kwargs.setdefault('server_class', ErrorLoggingPooledXMLRPCServer)
     return create_XMLRPC_server(port, **kwargs)
 
 
@@ -89,9 +602,244 @@ def create_unthreaded_server(port, **kwargs):
 
 
 
-def create_XMLRPC_client(host, port, verbose=False):
-    client =  ServerProxy('http://%s:%d' % (host, port), allow_none=True,
-            verbose=verbose)
+class ConnectionPool(object):
+    """Idle keep-alive HTTP connections, at most max_idle per host:port.
+
+    A connection is checked out by one thread for one request and checked
+    back in if the server left it open, so a pool can be shared by any
+    number of threads and clients.
+    """
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self._idle = {}         # host -> list of HTTPConnection
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def checkout(self, host, connect=None):
+        """Returns (connection, reused) for host ("host:port"); a new
+        connection is connect(host), a TCPConnection by default"""
+        with self._lock:
+            idle = self._idle.get(host)
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+            self.created += 1
+        return (connect or TCPConnection)(host), False
+
+    def checkin(self, host, connection):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """Close the idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.itervalues():
+            for connection in connections:
+                connection.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(created=self.created, reused=self.reused,
+                        idle=sum(len(c) for c in self._idle.itervalues()))
+
+default_pool = ConnectionPool()
+
+class TCPConnection(httplib.HTTPConnection):
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        # headers and body are separate writes
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+class UnixConnection(httplib.HTTPConnection):
+    """An HTTP connection to the server listening on a Unix domain socket;
+    host is only sent in the Host header"""
+    def __init__(self, host, path):
+        httplib.HTTPConnection.__init__(self, host)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except:
+            sock.close()
+            raise
+        self.sock = sock
+        # marshal responses are only loaded from a server of this user
+        self.trusted = trusted_peer(sock)
+
+class PooledTransport(Transport):
+    """XML-RPC over HTTP/1.1 connections kept open in a ConnectionPool.
+
+    Unlike the standard Transport it holds no connection itself, so one
+    ServerProxy using it can be shared between threads. A call on a reused
+    connection that the server has since closed is retried once on a new
+    one; the server never saw it.
+
+    With a socket_path, new connections go to the Unix domain socket there
+    while it exists, and to host over TCP otherwise.
+    """
+    def __init__(self, pool=None, use_datetime=0, socket_path=None):
+        Transport.__init__(self, use_datetime)
+        self.pool = pool if pool is not None else default_pool
+        self.socket_path = socket_path
+
+    def connect(self, host):
+        if self.socket_path and os.path.exists(self.socket_path):
+            return UnixConnection(host, self.socket_path)
+        return TCPConnection(host)
+
+    def request(self, host, handler, request_body, verbose=0):
+        return self._on_connection(host, lambda connection: self._request(
+                connection, host, handler, request_body, verbose))
+
+    def call(self, host, handler, method, params, verbose=0,
+             allow_none=False, encoding=None):
+        """Calls method, as marshal data on a connection whose server has
+        accepted it, as XML otherwise; returns the response params. The
+        call is recorded in rpc_stats.client_stats."""
+        trace = rpc_stats.trace_id() or rpc_stats.new_trace_id()
+        sizes = [0, 0]
+        def send(connection):
+            body = None
+            if getattr(connection, 'codec', None) == MARSHAL_CODEC:
+                try:
+                    body = marshal.dumps((method, params))
+                    content_type = MARSHAL_CONTENT_TYPE
+                except ValueError:
+                    pass    # e.g. a DateTime, which XML can send
+            if body is None:
+                body = xmlrpclib.dumps(params, method, encoding=encoding,
+                                       allow_none=allow_none)
+                content_type = 'text/xml'
+            sizes[0] = len(body)
+            result = self._request(connection, host, handler, body, verbose,
+                                   content_type, trace)
+            sizes[1] = connection.response_bytes
+            return result
+        start = time.time()
+        failed = True
+        try:
+            result = self._on_connection(host, send)
+            failed = False
+            return result
+        finally:
+            elapsed = time.time() - start
+            rpc_stats.client_stats.record('%s %s' % (host, method), elapsed,
+                                          sizes[0], sizes[1], failed)
+            rpc_stats.log_call('client', trace, method, elapsed, failed)
+
+    def _on_connection(self, host, send):
+        while True:
+            connection, reused = self.pool.checkout(host, self.connect)
+            try:
+                result, will_close = send(connection)
+            except Fault:
+                # the response was read whole; the connection is fine
+                self.pool.checkin(host, connection)
+                raise
+            except (socket.error, httplib.BadStatusLine), e:
+                connection.close()
+                if reused and (isinstance(e, httplib.BadStatusLine) or
+                        e.args[0] in (errno.ECONNRESET, errno.ECONNABORTED,
+                                      errno.EPIPE)):
+                    continue
+                raise
+            except:
+                connection.close()
+                raise
+            if will_close:
+                connection.close()
+            else:
+                self.pool.checkin(host, connection)
+            return result
+
+    def _request(self, connection, host, handler, request_body, verbose,
+                 content_type='text/xml', trace=None):
+        if verbose:
+            connection.set_debuglevel(1)
+        if connection.sock is None:
+            connection.connect()    # to know if the server is trusted
+        connection.putrequest('POST', handler)
+        connection.putheader('User-Agent', self.user_agent)
+        connection.putheader('Content-Type', content_type)
+        connection.putheader('Content-Length', str(len(request_body)))
+        trusted = getattr(connection, 'trusted', False)
+        if trusted:
+            connection.putheader(CODEC_HEADER, MARSHAL_CODEC)
+        connection.putheader(rpc_stats.TRACE_HEADER,
+                trace or rpc_stats.trace_id() or rpc_stats.new_trace_id())
+        connection.endheaders()
+        connection.send(request_body)
+        try:
+            # a buffered read of the status and headers, not a recv a byte
+            response = connection.getresponse(buffering=True)
+        except TypeError:   # before Python 2.7
+            response = connection.getresponse()
+        if response.status != 200:
+            response.read()
+            raise ProtocolError(host + handler, response.status,
+                                response.reason, response.msg)
+        connection.codec = trusted and response.getheader(CODEC_HEADER)
+        connection.response_bytes = int(
+                response.getheader('Content-Length') or 0)
+        self.verbose = verbose
+        will_close = response.will_close
+        try:
+            if response.getheader('Content-Type') == MARSHAL_CONTENT_TYPE:
+                if not trusted:
+                    response.read()
+                    raise ProtocolError(host + handler, response.status,
+                            'marshal response from an untrusted server',
+                            response.msg)
+                failed, value = marshal.loads(response.read())
+                if failed:
+                    raise Fault(*value)
+                return (as_xmlrpc_types(value),), will_close
+            return self.parse_response(response), will_close
+        except Fault:
+            raise
+        except:
+            connection.close()
+            raise
+
+class RPCProxy(ServerProxy):
+    """A ServerProxy making its calls with PooledTransport.call, so that
+    they go as marshal data to a server that takes it. Either way, values
+    arrive with the types XML-RPC gives them; see as_xmlrpc_types."""
+    def _ServerProxy__request(self, methodname, params):
+        response = self._ServerProxy__transport.call(
+                self._ServerProxy__host, self._ServerProxy__handler,
+                methodname, params, self._ServerProxy__verbose,
+                self._ServerProxy__allow_none, self._ServerProxy__encoding)
+        if len(response) == 1:
+            response = response[0]
+        return response
+
+def create_XMLRPC_client(host, port, verbose=False, pooled=True,
+        unix_socket=False):
+    """A client for the server at host:port. Its calls go over the
+    keep-alive connections of default_pool unless pooled is False.
+
+    With unix_socket, for a server on this host, calls go to the Unix
+    domain socket of the port whenever the server listens on it, as
+    marshal data if the server takes it."""
+    if unix_socket:
+        transport = PooledTransport(None if pooled else ConnectionPool(0),
+                                    socket_path=rpc_socket_path(port))
+    elif pooled:
+        transport = PooledTransport()
+    else:
+        transport = None
+    proxy_class = RPCProxy if transport else ServerProxy
+    client = proxy_class('http://%s:%d' % (host, port), transport,
+            allow_none=True, verbose=verbose)
     ensure_Fault_fix()
     return client
 
@@ -133,7 +881,7 @@ def try_until_connected(server_name, connect_function, logger=None,
 
 
 def create_local_client(port, host=DEFAULT_IP):
-    return create_XMLRPC_client(host, port)
+    return create_XMLRPC_client(host, port, unix_socket=True)
 
 def create_sync_client():
     return create_local_client(SYNC_PORT)
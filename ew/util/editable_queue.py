@@ -1,40 +1,195 @@
 #!/usr/bin/env python
 # Copyright 2011 Ricoh Innovations, Inc.
-import Queue
+import heapq, itertools, threading, time
+from Queue import Empty
 from ew.util import ew_logging as log
+from ew.util.latency_histogram import LatencyHistogram
 
 logger = log.getLogger('ew.util.editablequeue')
 
+# Heap entry fields. Entries are lists that order by priority and then
+# sequence, which is unique, so the items themselves are never compared.
+_PRIORITY, _SEQUENCE, _PUT_TIME, _ITEM, _KEY, _POSITION = range(6)
+
 class EditableQueue:
     """Provide a priority queue wrapper that allows filtering items out of
-    the queue and simplfies queue interaction"""
+    the queue and simplfies queue interaction.
+
+    Items come out in priority order (lowest first), and in the order they
+    were put within a priority. The queue is a binary heap that knows each
+    entry's position, so an item put with a key can be removed in
+    O(log n), and remove_all costs one pass over the queue.
+    """
     Priority_Immediate, Priority_High, Priority_Normal, Priority_Low = 0,1,5,9
     def __init__(self):
-        self. _queue = Queue.PriorityQueue()
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._heap = []
+        self._keyed = {}            # key -> entry
+        self._last = None           # the entry put last while still queued
+        self._sequence = itertools.count()
+        self._queued = {}           # priority -> number of entries queued
+        self._put_count = {}        # priority -> number ever put
+        self._max_depth = 0
+        self._coalesced = 0
+        self._removed = 0
+        self._lag = LatencyHistogram()
 
-    def put(self, item, priority= None):
-        if not priority: priority = self.Priority_Normal
-        self._queue.put_nowait((priority, item))
+    def put(self, item, priority= None, merge=None, key=None):
+        """Queue item. If merge is given and the item put last is still
+        queued with the same priority, merge(queued item, item) is called:
+        if it returns other than None that replaces the queued item and item
+        is not queued itself. An item put with a key, which must not be
+        that of a queued item, can be taken out again with remove."""
+        if priority is None: priority = self.Priority_Normal
+        with self._mutex:
+            last = self._last
+            if merge and last is not None and last[_PRIORITY] == priority:
+                merged = merge(last[_ITEM], item)
+                if merged is not None:
+                    last[_ITEM] = merged
+                    self._coalesced += 1
+                    logger.debug('Merged %s into queued item', item)
+                    return
+            if key is not None and key in self._keyed:
+                raise KeyError('%r is already queued' % (key,))
+            entry = [priority, next(self._sequence), time.time(), item, key,
+                     len(self._heap)]
+            self._heap.append(entry)
+            self._sift_up(entry[_POSITION])
+            if key is not None:
+                self._keyed[key] = entry
+            self._last = entry
+            self._queued[priority] = self._queued.get(priority, 0) + 1
+            self._put_count[priority] = self._put_count.get(priority, 0) + 1
+            self._max_depth = max(self._max_depth, len(self._heap))
+            self._not_empty.notify()
         logger.debug('Put %s on queue with priority %d', item, priority)
 
     def get(self, wait=True, seconds=None):
-        return self._queue.get(wait, seconds)[1]
+        """Remove and return the first item. Waits for one if wait is true,
+        for at most seconds if that is given, and raises Queue.Empty if
+        there is none."""
+        with self._mutex:
+            if wait and seconds is not None:
+                deadline = time.time() + seconds
+            while not self._heap:
+                if not wait:
+                    raise Empty
+                if seconds is None:
+                    self._not_empty.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Empty
+                    self._not_empty.wait(remaining)
+            entry = self._remove_at(0)
+            self._lag.add(time.time() - entry[_PUT_TIME])
+            return entry[_ITEM]
+
+    def remove(self, key):
+        """Remove the item put with key; returns it, or None if no such
+        item is queued."""
+        with self._mutex:
+            entry = self._keyed.get(key)
+            if entry is None:
+                return None
+            self._removed += 1
+            return self._remove_at(entry[_POSITION])[_ITEM]
 
     def remove_all(self, limiting_test = None):
-        """removes all elements limited by limiting_test."""
-        to_keep = []
-        with self._queue.mutex:
-            for _ in range(self._queue.qsize()):
-                entry = self._queue.get_nowait()
-                self._queue.task_done()
-                if limiting_test:
-                    func,args = entry[1]
-                    if not limiting_test(func, args):
-                        to_keep.append(entry)
-        for stuff in to_keep:
-            self._queue.put_nowait(stuff)
+        """removes all elements limited by limiting_test, a function of
+        (func, args) for the (func, args) items of the queue; all elements
+        if it is None. Returns the number removed."""
+        with self._mutex:
+            if limiting_test:
+                kept, removed = [], []
+                for entry in self._heap:
+                    func, args = entry[_ITEM]
+                    (removed if limiting_test(func, args) else kept).append(
+                            entry)
+            else:
+                kept, removed = [], self._heap
+            for entry in removed:
+                self._forget(entry)
+            if removed:
+                heapq.heapify(kept)
+                self._heap = kept
+                for position, entry in enumerate(kept):
+                    entry[_POSITION] = position
+                self._removed += len(removed)
+            return len(removed)
+
+    def qsize(self):
+        with self._mutex:
+            return len(self._heap)
+
+    def stats(self):
+        """Queue depth and the lag between put and get, as a dict of plain
+        values. Counts by priority are keyed by the priority as a string,
+        for XML-RPC."""
+        with self._mutex:
+            return {
+                'depth': len(self._heap),
+                'max_depth': self._max_depth,
+                'coalesced': self._coalesced,
+                'removed': self._removed,
+                'queued': dict((str(p), n) for p, n in
+                               self._queued.iteritems()),
+                'put': dict((str(p), n) for p, n in
+                            self._put_count.iteritems()),
+                'lag': self._lag.as_dict(),
+            }
+
+    # Heap maintenance; the callers hold the mutex ==================
 
+    def _forget(self, entry):
+        """Drop the bookkeeping for an entry leaving the queue."""
+        self._queued[entry[_PRIORITY]] -= 1
+        if entry[_KEY] is not None:
+            del self._keyed[entry[_KEY]]
+        if entry is self._last:
+            self._last = None
 
+    def _remove_at(self, position):
+        heap = self._heap
+        entry = heap[position]
+        self._forget(entry)
+        tail = heap.pop()
+        if tail is not entry:
+            heap[position] = tail
+            tail[_POSITION] = position
+            self._sift_down(position)
+            self._sift_up(position)
+        return entry
 
+    def _place(self, entry, position):
+        self._heap[position] = entry
+        entry[_POSITION] = position
 
+    def _sift_up(self, position):
+        heap = self._heap
+        entry = heap[position]
+        while position:
+            parent = (position - 1) >> 1
+            if heap[parent] < entry:
+                break
+            self._place(heap[parent], position)
+            position = parent
+        self._place(entry, position)
 
+    def _sift_down(self, position):
+        heap = self._heap
+        size = len(heap)
+        entry = heap[position]
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if entry < heap[child]:
+                break
+            self._place(heap[child], position)
+            position = child
+        self._place(entry, position)
@@ -10,6 +10,10 @@ Designed for subclassing such that certain properties of the message type
 (such as option names and values) can be customized. See the comments for
 class EwBinaryMessage.
 
+The "encoder" method returns a MessageEncoder, a precompiled encoder for all
+messages with a given number of int and char arguments, so no format string
+is built or parsed per message.
+
 The "decode" and "read_from_stream" methods return an EwDecodedMessage
 object that contains the message components:
     'total_length',   # Total length of whole message (int)
@@ -22,8 +26,7 @@ object that contains the message components:
 
 """
 
-from struct import pack, unpack, calcsize, error as struct_error
-from itertools import chain
+from struct import Struct, unpack, calcsize, error as struct_error
 
 from ew.util.options_factory import OptionsFactory
 
@@ -43,7 +46,7 @@ class EwBinaryMessage(object):
     """
 
     __slots__ = ('magic_number', 'endian', 'option_bit_values',
-            'header_format', 'header_length', 'options_factory')
+            'header_format', 'header_length', 'options_factory', '_encoders')
 
     def __init__(self, magic_number=0x131C014E, endian='@',
             option_bit_values=None):
@@ -58,6 +61,7 @@ class EwBinaryMessage(object):
         self.header_format = self.endian + '2L'
         self.header_length = calcsize(self.header_format)
         self.options_factory = OptionsFactory(**self.option_bit_values)
+        self._encoders = {}
 
     def format_description(self):
         """Return a text description of the binary protocol.
@@ -198,12 +202,51 @@ class EwBinaryMessage(object):
         Returns: a string (str) representing the binary message.
 
         """
-        fmt = (self.endian + str(7 + len(int_args) + len(char_args)) + 'L' +
-                (('%ds' * len(char_args)) % tuple(len(s) for s in char_args)))
-        return pack(fmt, self.magic_number, calcsize(fmt),
+        return self.encoder(len(int_args), len(char_args)).encode(
+                op_code, options, request_id, int_args, char_args)
+
+    def encoder(self, int_arg_count, char_arg_count):
+        """Return the MessageEncoder for messages with the given numbers of
+        int and char arguments. Encoders are created once and cached.
+        """
+        key = int_arg_count, char_arg_count
+        try:
+            return self._encoders[key]
+        except KeyError:
+            return self._encoders.setdefault(key, MessageEncoder(
+                    self.magic_number, self.endian, *key))
+
+
+class MessageEncoder(object):
+    """Precompiled encoder for messages of one shape.
+
+    All fields before the char data are integers, so for a given number of
+    int and char args they have a fixed layout, packed by one precompiled
+    Struct. The char data follows unaligned.
+
+    """
+
+    __slots__ = ('magic_number', 'int_arg_count', 'char_arg_count', 'struct')
+
+    def __init__(self, magic_number, endian, int_arg_count, char_arg_count):
+        self.magic_number = magic_number
+        self.int_arg_count = int_arg_count
+        self.char_arg_count = char_arg_count
+        self.struct = Struct('%s%dL' % (endian,
+                7 + int_arg_count + char_arg_count))
+
+    def encode(self, op_code, options=0, request_id=0, int_args=(),
+            char_args=()):
+        """Encode a message, as EwBinaryMessage.encode. int_args and
+        char_args must have the counts this encoder was made for, and
+        char_args must be str objects.
+        """
+        data = ''.join(char_args)
+        return self.struct.pack(self.magic_number,
+                self.struct.size + len(data),
                 op_code, options, request_id,
-                len(int_args), len(char_args),
-                *chain(int_args, (len(s) for s in char_args), char_args))
+                self.int_arg_count, self.char_arg_count,
+                *(tuple(int_args) + tuple(map(len, char_args)))) + data
 
 
 class EwMessageError(Exception):
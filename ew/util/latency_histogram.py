@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""Latency histograms with power-of-two millisecond buckets.
+
+Cheap enough to update on every request: adding a sample is a few integer
+operations and no allocation. Percentiles are estimated from the buckets,
+so they are upper bounds accurate to a factor of two.
+"""
+
+import math
+
+__all__ = "LatencyHistogram",
+
+class LatencyHistogram(object):
+    """Counts of latencies, bucket i holding those under 2**i ms (bucket 0
+    those under 1 ms), and the last bucket everything longer.
+
+    Not thread safe; callers that share a histogram lock around it.
+
+    """
+
+    BUCKETS = 16    # the last finite bucket is under 2**14 ms, about 16 s
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """Adds one latency, in seconds."""
+        ms = seconds * 1000.0
+        if ms < 1.0:
+            bucket = 0
+        else:
+            bucket = min(int(math.log(ms, 2)) + 1, self.BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """Upper bound in seconds of the given percentile of latencies, the
+        max if it falls in the last bucket, 0.0 if there are none."""
+        if not self.count:
+            return 0.0
+        wanted = self.count * percent / 100.0
+        seen = 0
+        for bucket, n in enumerate(self.counts[:-1]):
+            seen += n
+            if seen >= wanted:
+                return min(2 ** bucket / 1000.0, self.max)
+        return self.max
+
+    def as_dict(self):
+        """The histogram as a dict of plain values, e.g. for XML-RPC."""
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'buckets_ms': dict(('<%d' % 2 ** i, n) for i, n in
+                               enumerate(self.counts[:-1]) if n),
+            'over_ms': self.counts[-1],
+        }
+
+    def __str__(self):
+        return ('n=%d mean=%.1fms p50<=%.1fms p90<=%.1fms p99<=%.1fms'
+                ' max=%.1fms' % (self.count, self.mean() * 1000,
+                    self.percentile(50) * 1000, self.percentile(90) * 1000,
+                    self.percentile(99) * 1000, self.max * 1000))
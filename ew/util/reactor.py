@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""One thread waiting on many sockets.
+
+A Reactor polls the sockets registered with it (with epoll where the
+kernel has it, poll otherwise) and calls the handler of each socket that
+is readable, so the display server event socket, the camera server socket
+and the service manager sockets share one thread instead of each parking
+a thread of its own in recv().
+
+Handlers run on the reactor thread and must not block: they read what is
+ready and hand anything slow to a queue of their own, or to run_in_worker.
+Timers (call_later) and calls from other threads (call_soon) run on the
+reactor thread too.
+"""
+
+from __future__ import with_statement
+
+import errno
+import fcntl
+import heapq
+import itertools
+import os
+import select
+import threading
+import time
+from collections import deque
+
+import ew_logging
+from worker_pool import WorkerPool
+
+logger = ew_logging.getLogger('ew.util.reactor')
+
+__all__ = "Reactor",
+
+EPOLL_EXISTS = hasattr(select, 'epoll')
+
+def _fileno(fileobj):
+    return fileobj if isinstance(fileobj, (int, long)) else fileobj.fileno()
+
+class _Epoll(object):
+    """select.epoll, in seconds"""
+    READ = EPOLL_EXISTS and (select.EPOLLIN | select.EPOLLERR |
+                             select.EPOLLHUP)
+
+    def __init__(self):
+        self._epoll = select.epoll()
+
+    def register(self, fd):
+        self._epoll.register(fd, self.READ)
+
+    def unregister(self, fd):
+        self._epoll.unregister(fd)
+
+    def poll(self, timeout):
+        return self._epoll.poll(-1 if timeout is None else timeout)
+
+    def close(self):
+        self._epoll.close()
+
+class _Poll(object):
+    """select.poll, in seconds"""
+    READ = select.POLLIN | select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+    def __init__(self):
+        self._poll = select.poll()
+
+    def register(self, fd):
+        self._poll.register(fd, self.READ)
+
+    def unregister(self, fd):
+        self._poll.unregister(fd)
+
+    def poll(self, timeout):
+        return self._poll.poll(None if timeout is None else
+                               int(timeout * 1000 + 0.999))
+
+    def close(self):
+        pass
+
+class Timer(object):
+    """A call_later call, which can be cancelled"""
+
+    __slots__ = ('when', 'function', 'args', 'cancelled')
+
+    def __init__(self, when, function, args):
+        self.when = when
+        self.function = function
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Reactor(object):
+    """Calls handler(fileobj) on the reactor thread when a registered
+    socket (or anything with a fileno) is readable or hung up.
+
+    Reactor.instance() is the reactor shared by a process, started on first
+    use; a Reactor made directly is started with start(), or driven by
+    calling run_once.
+
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                cls._instance.start()
+            return cls._instance
+
+    def __init__(self, name='reactor', use_epoll=EPOLL_EXISTS):
+        self.name = name
+        self._poller = _Epoll() if use_epoll else _Poll()
+        self._handlers = {}         # fd -> (fileobj, handler)
+        self._timers = []           # heap of (when, sequence, Timer)
+        self._sequence = itertools.count()
+        self._calls = deque()       # (function, args) from call_soon
+        self._lock = threading.Lock()
+        self._thread = None
+        self._worker = None
+        self._stopping = False
+        # written to wake the poll when another thread changes things
+        self._wake_read, self._wake_write = os.pipe()
+        for fd in self._wake_read, self._wake_write:
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._poller.register(self._wake_read)
+
+    # Registration ==========================================================
+
+    def register(self, fileobj, handler):
+        """Call handler(fileobj) whenever fileobj is readable. May be called
+        from any thread."""
+        fd = _fileno(fileobj)
+        with self._lock:
+            if fd in self._handlers:
+                raise ValueError('fd %d is already registered' % fd)
+            self._handlers[fd] = fileobj, handler
+            self._poller.register(fd)
+        self._wake()
+
+    def unregister(self, fileobj):
+        """Stop watching fileobj; does nothing if it is not registered.
+        Call before closing it."""
+        fd = _fileno(fileobj)
+        with self._lock:
+            if self._handlers.pop(fd, None) is not None:
+                self._poller.unregister(fd)
+        self._wake()
+
+    def is_registered(self, fileobj):
+        return _fileno(fileobj) in self._handlers
+
+    # Calls =================================================================
+
+    def call_soon(self, function, *args):
+        """Run function(*args) on the reactor thread. May be called from
+        any thread."""
+        self._calls.append((function, args))
+        self._wake()
+
+    def call_later(self, delay, function, *args):
+        """Run function(*args) on the reactor thread after delay seconds.
+        Returns a Timer, whose cancel method stops the call."""
+        timer = Timer(time.time() + delay, function, args)
+        with self._lock:
+            heapq.heappush(self._timers,
+                           (timer.when, self._sequence.next(), timer))
+        self._wake()
+        return timer
+
+    def run_in_worker(self, function, *args):
+        """Run function(*args) on the worker thread of this reactor, for
+        work too slow for a handler. Calls run in order. Returns the
+        Future of the call."""
+        with self._lock:
+            if self._worker is None:
+                self._worker = WorkerPool(1, self.name + '-worker')
+        return self._worker.submit(function, *args)
+
+    def in_reactor_thread(self):
+        return threading.currentThread() is self._thread
+
+    # Running ===============================================================
+
+    def start(self):
+        """Run the reactor on a daemon thread of its own"""
+        self._thread = threading.Thread(target=self.run, name=self.name)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Make run return; may be called from any thread"""
+        self._stopping = True
+        self._wake()
+
+    def close(self):
+        """Stop the reactor, waiting for its thread, and release its poll
+        and wakeup pipe. The registered sockets are not closed."""
+        if self._wake_write is None:
+            return
+        self.stop()
+        if self._thread is not None and not self.in_reactor_thread():
+            self._thread.join()
+        if self._worker is not None:
+            self._worker.close()
+        self._poller.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+        self._wake_read = self._wake_write = None
+
+    def run(self):
+        self._thread = threading.currentThread()
+        logger.debug('%s running, %s', self.name,
+                     'epoll' if isinstance(self._poller, _Epoll) else 'poll')
+        while not self._stopping:
+            self.run_once()
+        logger.debug('%s stopped', self.name)
+
+    def run_once(self, timeout=None):
+        """Wait up to timeout seconds (until the next timer if that is
+        sooner) and run the handlers of ready sockets, the calls from
+        call_soon and the timers that are due."""
+        if self._timers:
+            wait = max(0.0, self._timers[0][0] - time.time())
+            timeout = wait if timeout is None else min(timeout, wait)
+        if self._calls:
+            timeout = 0.0
+        try:
+            events = self._poller.poll(timeout)
+        except (IOError, OSError, select.error), e:
+            if e.args[0] != errno.EINTR:
+                raise
+            events = ()
+        for fd, event in events:
+            if fd == self._wake_read:
+                self._drain_wake()
+                continue
+            entry = self._handlers.get(fd)
+            if entry is not None:
+                self._call(fd, *entry)
+        while self._calls:
+            function, args = self._calls.popleft()
+            self._run(function, args)
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            with self._lock:
+                timer = heapq.heappop(self._timers)[2]
+            if not timer.cancelled:
+                self._run(timer.function, timer.args)
+
+    def _call(self, fd, fileobj, handler):
+        try:
+            handler(fileobj)
+        except:
+            # a handler that fails would fail again on every poll
+            logger.exception('%s: handler %r for fd %d failed, unregistered',
+                             self.name, handler, fd)
+            self.unregister(fd)
+
+    def _run(self, function, args):
+        try:
+            function(*args)
+        except:
+            logger.exception('%s: call of %r failed', self.name, function)
+
+    def _wake(self):
+        if self._wake_write is not None and not self.in_reactor_thread():
+            try:
+                os.write(self._wake_write, 'x')
+            except OSError, e:
+                if e.errno != errno.EAGAIN:  # already awake
+                    raise
+
+    def _drain_wake(self):
+        try:
+            while os.read(self._wake_read, 512):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def stats(self):
+        """Registered sockets, pending timers and calls"""
+        return dict(handlers=len(self._handlers), timers=len(self._timers),
+                    calls=len(self._calls))
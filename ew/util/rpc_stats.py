@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""Call counts, latencies and payload sizes of XML-RPC methods.
+
+ew.util.comms records every call a server handles in the RPCStats of the
+server, and every call made with an RPCProxy in client_stats, keyed by
+"host method". A server answers the __stats__ RPC with both, so that
+bin/rpc_stats.py can show them for a running process.
+
+Each call carries a trace id in TRACE_HEADER. A server serving a call
+makes its trace id current on the serving thread, and calls the server
+makes while serving it carry the same id. The calls one request causes
+across the launcher, the listing updater and sync can then be followed in
+their logs (logger ew.util.rpc_stats, at debug level).
+"""
+
+from __future__ import with_statement
+
+import itertools
+import os
+import threading
+
+import ew_logging
+from latency_histogram import LatencyHistogram
+
+logger = ew_logging.getLogger('ew.util.rpc_stats')
+
+__all__ = "RPCStats", "client_stats", "trace_id", "new_trace_id", "tracing"
+
+TRACE_HEADER = 'X-RPC-Trace'
+
+_trace_numbers = itertools.count(1)
+_current = threading.local()
+
+def new_trace_id():
+    """A trace id unique to this process and call, "pid.number"."""
+    return '%d.%d' % (os.getpid(), _trace_numbers.next())
+
+def trace_id():
+    """The trace id of the call this thread is serving, None if none."""
+    return getattr(_current, 'trace_id', None)
+
+class tracing(object):
+    """Makes trace_id current on this thread for the with block, a new
+    one if it is None; as returns the id."""
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or new_trace_id()
+
+    def __enter__(self):
+        self._outer = getattr(_current, 'trace_id', None)
+        _current.trace_id = self.trace_id
+        return self.trace_id
+
+    def __exit__(self, *exc):
+        _current.trace_id = self._outer
+
+class RPCStats(object):
+    """Per method: calls, errors (faults and failures), a LatencyHistogram,
+    and the request and response bytes. Thread safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = {}  # method -> [calls, errors, LatencyHistogram,
+                            #             request bytes, response bytes]
+
+    def record(self, method, seconds, request_bytes=0, response_bytes=0,
+               failed=False):
+        with self._lock:
+            entry = self._methods.get(method)
+            if entry is None:
+                entry = self._methods[method] = [0, 0, LatencyHistogram(),
+                                                 0, 0]
+            entry[0] += 1
+            entry[1] += bool(failed)
+            entry[2].add(seconds)
+            entry[3] += request_bytes
+            entry[4] += response_bytes
+
+    def methods(self):
+        return sorted(self._methods)
+
+    def as_dict(self):
+        """method -> dict of plain values, e.g. for XML-RPC. The byte
+        counts are floats, as XML-RPC has no integers past 2**31 - 1."""
+        with self._lock:
+            return dict((method, {
+                'calls': calls,
+                'errors': errors,
+                'latency': histogram.as_dict(),
+                'request_bytes': float(request_bytes),
+                'response_bytes': float(response_bytes),
+            }) for method, (calls, errors, histogram, request_bytes,
+                            response_bytes) in self._methods.iteritems())
+
+    def reset(self):
+        with self._lock:
+            self._methods = {}
+
+client_stats = RPCStats()
+
+def log_call(side, trace, method, seconds, failed):
+    """Debug log of one call: side is "client" or "server"."""
+    logger.debug('%s %s %s %.1fms%s', trace, side, method, seconds * 1000,
+                 ' failed' if failed else '')
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""Compact stroke geometry and the box tests strokes are matched with.
+
+A StrokeGeometry keeps the x and y coordinates of a stroke's points in two
+arrays, instead of a list of (x, y) tuples, with its bounding box and the
+bounding boxes of its segments (pairs of consecutive points) computed once.
+
+The kernel functions bbox, segments_overlap and any_point_in_rect use NumPy
+when it is installed and the stroke is long enough to repay the cost of
+calling into it, and pure Python otherwise; both give the same answers.
+"""
+
+from array import array
+from itertools import chain, izip
+
+try:
+    import numpy
+    NUMPY_EXISTS = True
+except ImportError:
+    NUMPY_EXISTS = False
+
+# Below these sizes the pure Python kernel is faster than NumPy
+NUMPY_MIN_POINTS = 256      # points of a stroke
+NUMPY_MIN_PAIRS = 1024      # segment pairs of two strokes
+
+__all__ = ("StrokeGeometry", "geometry_of", "bbox", "segments_overlap",
+           "any_point_in_rect", "point_in_rect", "NUMPY_EXISTS")
+
+def _coords(values):
+    """values as an array of ints, or doubles if they are not all ints"""
+    if not isinstance(values, (list, array)):
+        values = list(values)
+    try:
+        return array('i', values)
+    except TypeError:
+        return array('d', values)
+
+def _extended(coords, values):
+    """coords, an array from _coords, with values appended"""
+    more = _coords(values)
+    if more.typecode == coords.typecode:
+        coords.extend(more)
+        return coords
+    return _coords(chain(coords, more))
+
+class StrokeGeometry(object):
+    """The points of a stroke as x and y arrays, "xs" and "ys".
+
+    Points can be added with extend; the boxes are recomputed as needed.
+    """
+
+    __slots__ = ('xs', 'ys', '_bbox', '_boxes', '_numpy')
+
+    def __init__(self, points=()):
+        xs, ys = zip(*points) if points else ((), ())
+        try:
+            self.xs, self.ys = array('i', xs), array('i', ys)
+        except TypeError:
+            self.xs, self.ys = _coords(xs), _coords(ys)
+        self._forget()
+        if len(xs) < NUMPY_MIN_POINTS and xs:
+            # the tuples are at hand, and quicker to scan than the arrays
+            self._bbox = min(xs), min(ys), max(xs), max(ys)
+
+    def _forget(self):
+        self._bbox = self._boxes = self._numpy = None
+
+    def extend(self, points):
+        """Append (x, y) points"""
+        if not points:
+            return
+        xs, ys = zip(*points)
+        self.xs, self.ys = _extended(self.xs, xs), _extended(self.ys, ys)
+        self._forget()
+
+    def __len__(self):
+        return len(self.xs)
+
+    def point(self, n):
+        return self.xs[n], self.ys[n]
+
+    def points(self):
+        """The points as a list of (x, y) tuples"""
+        return zip(self.xs, self.ys)
+
+    def bbox(self):
+        """(xmin, ymin, xmax, ymax), or None for no points"""
+        if self._bbox is None and self.xs:
+            if NUMPY_EXISTS and len(self.xs) >= NUMPY_MIN_POINTS:
+                self._bbox = _bbox_numpy(self)
+            else:
+                self._bbox = _bbox_py(self)
+        return self._bbox
+
+    def segment_boxes(self):
+        """(x0s, y0s, x1s, y1s): arrays of the lower and upper corners of
+        the bounding box of each segment"""
+        if self._boxes is None:
+            xs, ys = self.xs, self.ys
+            self._boxes = (_coords(map(min, xs[:-1], xs[1:])),
+                           _coords(map(min, ys[:-1], ys[1:])),
+                           _coords(map(max, xs[:-1], xs[1:])),
+                           _coords(map(max, ys[:-1], ys[1:])))
+        return self._boxes
+
+    def iter_segment_boxes(self):
+        """yields (x0, y0, x1, y1) for each segment"""
+        return izip(*self.segment_boxes())
+
+    def as_numpy(self):
+        """(xs, ys, x0s, y0s, x1s, y1s) as NumPy arrays sharing the
+        memory of the arrays here"""
+        if self._numpy is None:
+            self._numpy = tuple(numpy.frombuffer(a, dtype=a.typecode) if a
+                                else numpy.zeros(0) for a in
+                                (self.xs, self.ys) + self.segment_boxes())
+        return self._numpy
+
+def geometry_of(stroke):
+    """The StrokeGeometry for a list of points, or a stroke dict of
+    ew.e_ink.strokes.Strokes (which keeps it as 'geometry')"""
+    if isinstance(stroke, StrokeGeometry):
+        return stroke
+    if isinstance(stroke, dict):
+        if 'geometry' not in stroke:
+            stroke['geometry'] = StrokeGeometry(stroke['strokes'])
+        return stroke['geometry']
+    return StrokeGeometry(stroke)
+
+def point_in_rect(x, y, x0, y0, x1, y1):
+    return x0 <= x <= x1 and y0 <= y <= y1
+
+# Pure Python kernel ==================================================
+
+def _bbox_py(geometry):
+    xs, ys = geometry.xs, geometry.ys
+    return min(xs), min(ys), max(xs), max(ys)
+
+def _segments_overlap_py(geometry1, geometry2, t):
+    ax0s, ay0s, ax1s, ay1s = geometry1.segment_boxes()
+    if not ax0s:
+        return False
+    # only the segments of geometry2 near all of geometry1 can overlap
+    gx0, gy0 = min(ax0s) - t, min(ay0s) - t
+    gx1, gy1 = max(ax1s) + t, max(ay1s) + t
+    near = [(jx0 - t, jy0 - t, jx1 + t, jy1 + t) for jx0, jy0, jx1, jy1 in
+            geometry2.iter_segment_boxes() if not
+            (jx1 < gx0 or jx0 > gx1 or jy1 < gy0 or jy0 > gy1)]
+    if not near:
+        return False
+    for ix0, iy0, ix1, iy1 in izip(ax0s, ay0s, ax1s, ay1s):
+        for jx0, jy0, jx1, jy1 in near:
+            if not (ix1 < jx0 or ix0 > jx1 or iy1 < jy0 or iy0 > jy1):
+                return True
+    return False
+
+def _any_point_in_rect_py(geometry, x0, y0, x1, y1):
+    for x, y in izip(geometry.xs, geometry.ys):
+        if x0 <= x <= x1 and y0 <= y <= y1:
+            return True
+    return False
+
+# NumPy kernel ========================================================
+
+def _bbox_numpy(geometry):
+    xs, ys = geometry.as_numpy()[:2]
+    return xs.min().item(), ys.min().item(), xs.max().item(), ys.max().item()
+
+def _segments_overlap_numpy(geometry1, geometry2, t):
+    ax0, ay0, ax1, ay1 = geometry1.as_numpy()[2:]
+    bx0, by0, bx1, by1 = geometry2.as_numpy()[2:]
+    if not (len(ax0) and len(bx0)):
+        return False
+    near = ~((bx1 < ax0.min() - t) | (bx0 > ax1.max() + t) |
+             (by1 < ay0.min() - t) | (by0 > ay1.max() + t))
+    if not near.any():
+        return False
+    bx0, by0, bx1, by1 = bx0[near], by0[near], bx1[near], by1[near]
+    apart = ((ax1[:, None] < bx0 - t) | (ax0[:, None] > bx1 + t) |
+             (ay1[:, None] < by0 - t) | (ay0[:, None] > by1 + t))
+    return not apart.all()
+
+def _any_point_in_rect_numpy(geometry, x0, y0, x1, y1):
+    xs, ys = geometry.as_numpy()[:2]
+    return bool(((xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)).any())
+
+def bbox(geometry):
+    """(xmin, ymin, xmax, ymax) of a StrokeGeometry, None if it has no
+    points"""
+    return geometry.bbox()
+
+def segments_overlap(geometry1, geometry2, threshold=0):
+    """Does the bounding box of a segment of geometry1 overlap that of a
+    segment of geometry2, when grown by threshold (>0 for looser, <0 for
+    tighter)?"""
+    if NUMPY_EXISTS and len(geometry1) * len(geometry2) >= NUMPY_MIN_PAIRS:
+        return _segments_overlap_numpy(geometry1, geometry2, threshold)
+    return _segments_overlap_py(geometry1, geometry2, threshold)
+
+def any_point_in_rect(geometry, x0, y0, x1, y1):
+    """Is a point of geometry in the rectangle, edges included?"""
+    box = geometry.bbox()
+    if box is None:
+        return False
+    xmin, ymin, xmax, ymax = box
+    if xmax < x0 or xmin > x1 or ymax < y0 or ymin > y1:
+        return False
+    if x0 <= xmin and xmax <= x1 and y0 <= ymin and ymax <= y1:
+        return True
+    if NUMPY_EXISTS and len(geometry) >= NUMPY_MIN_POINTS:
+        return _any_point_in_rect_numpy(geometry, x0, y0, x1, y1)
+    return _any_point_in_rect_py(geometry, x0, y0, x1, y1)
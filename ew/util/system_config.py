@@ -53,6 +53,10 @@ if not font_dir:
         font_dir = '/usr/share/fonts/truetype/ttf-dejavu'
     else:
         font_dir = os.path.join(resource_dir, 'truetype', 'ttf-dejavu')
+catalog_dir = (os.environ.get('EW_CATALOG_DIR') or
+        os.path.join(data_home, 'cache', 'catalog'))
+rpc_socket_dir = (os.environ.get('EW_RPC_SOCKET_DIR') or
+        os.path.join(data_home, 'run', 'rpc'))
 cache_dir = os.environ.get('EW_DIR', tmp)
 gui_cache_dir = (os.environ.get('EW_GUI_CACHE_DIR') or
         os.path.join(cache_dir, 'guitmp'))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Performance timing of small XML-RPC calls between local processes.
+
+Round trips of a call with two small arguments, through a client on the
+pooled keep-alive transport against a keep-alive server, and through a
+plain ServerProxy against a server closing each connection after one call,
+as the launcher, listing updater and sync client did before, and through
+a pooled client on the Unix domain socket of a server listening on both
+(sending marshal data once the server has accepted it).
+The legacy server starts a thread per connection; the same calls against
+a server on a fixed pool of workers show what that costs.
+"""
+
+import multiprocessing
+import shutil
+import tempfile
+import xmlrpclib
+from ew.util import comms
+from ew.util.perf_timing import PerfTiming
+
+CALLS = 200
+
+comms.RPC_SOCKET_DIR = tempfile.mkdtemp()
+
+def serve(ports, kwargs):
+    server = comms.create_threaded_server(0, server_ip='127.0.0.1', **kwargs)
+    server.register_function(lambda x, y: x + y, 'add')
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+def start_server(**kwargs):
+    """Serves in a process of its own, as the launcher and the listing
+    updater do, so that the client times are round trips"""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(ports, kwargs))
+    process.daemon = True
+    process.start()
+    SERVERS.append(process)
+    return ports.get()
+
+SERVERS = []
+KEEP_ALIVE_PORT = start_server(listen=comms.LISTEN_BOTH)
+LEGACY_PORT = start_server(keep_alive=False,
+                           server_class=comms.ErrorLoggingXMLRPCServer)
+WORKER_POOL_PORT = start_server(keep_alive=False)
+
+def test_pooled_calls():
+    """200 calls, pooled keep-alive connections"""
+    client = comms.create_XMLRPC_client('127.0.0.1', KEEP_ALIVE_PORT)
+    for n in xrange(CALLS):
+        client.add(n, 1)
+
+def test_unix_calls():
+    """200 calls, pooled keep-alive connections, Unix domain socket"""
+    client = comms.create_XMLRPC_client('localhost', KEEP_ALIVE_PORT,
+                                        unix_socket=True)
+    for n in xrange(CALLS):
+        client.add(n, 1)
+
+def test_legacy_calls():
+    """200 calls, a connection per call"""
+    client = xmlrpclib.ServerProxy('http://127.0.0.1:%d' % LEGACY_PORT,
+                                   allow_none=True)
+    for n in xrange(CALLS):
+        client.add(n, 1)
+
+def test_worker_pool_calls():
+    """200 calls, a connection per call, worker pool server"""
+    client = xmlrpclib.ServerProxy('http://127.0.0.1:%d' % WORKER_POOL_PORT,
+                                   allow_none=True)
+    for n in xrange(CALLS):
+        client.add(n, 1)
+
+if __name__ == "__main__":
+    perf = PerfTiming()
+    perf.add(test_pooled_calls, test_unix_calls, test_legacy_calls,
+             test_worker_pool_calls)
+    perf.main()
+    comms.default_pool.clear()
+    for process in SERVERS:
+        process.terminate()
+    shutil.rmtree(comms.RPC_SOCKET_DIR)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""
+Performance timing of the XML-RPC and marshal codecs of ew.util.comms.
+
+Encodes and decodes the request and response of calls like those between
+the launcher, the listing updater and sync: set_current_docid, an empty
+next_doc_to_sync, and a display server passthrough with a region and an
+options dict. The bytes on the wire of each are printed first.
+"""
+
+import marshal
+import sys
+import xmlrpclib
+from ew.util.comms import as_xmlrpc_types
+from ew.util.perf_timing import PerfTiming
+
+CALLS = 1000
+
+# (method, params, result)
+SAMPLE_CALLS = [
+    ('set_current_docid', ('a1b2c3d4e5f60718293a4b5c6d7e8f90',), None),
+    ('next_doc_to_sync', (), None),
+    ('update_region_of_page', (3, [0, 120, 600, 240],
+                               {'waveform': 'GU', 'wait': True}), True),
+]
+
+def xml_round_trip(method, params, result):
+    method, params = xmlrpclib.loads(xmlrpclib.dumps(params, method,
+                                                     allow_none=True))[::-1]
+    return xmlrpclib.loads(xmlrpclib.dumps((result,), methodresponse=True,
+                                           allow_none=True))[0][0]
+
+def marshal_round_trip(method, params, result):
+    method, params = marshal.loads(marshal.dumps((method, params)))
+    params = as_xmlrpc_types(params)
+    return as_xmlrpc_types(marshal.loads(marshal.dumps((False, result)))[1])
+
+def test_xml_codec():
+    """1000 x 3 calls, XML-RPC request and response encoded and decoded"""
+    for _ in xrange(CALLS):
+        for call in SAMPLE_CALLS:
+            xml_round_trip(*call)
+
+def test_marshal_codec():
+    """1000 x 3 calls, marshal request and response encoded and decoded,
+    with XML-RPC types"""
+    for _ in xrange(CALLS):
+        for call in SAMPLE_CALLS:
+            marshal_round_trip(*call)
+
+def print_sizes():
+    print >>sys.stderr, 'Bytes on the wire (request + response bodies):'
+    for method, params, result in SAMPLE_CALLS:
+        xml = (len(xmlrpclib.dumps(params, method, allow_none=True)) +
+               len(xmlrpclib.dumps((result,), methodresponse=True,
+                                   allow_none=True)))
+        binary = (len(marshal.dumps((method, params))) +
+                  len(marshal.dumps((False, result))))
+        print >>sys.stderr, '  %-22s xml %4d  marshal %4d' % (method, xml,
+                                                              binary)
+
+if __name__ == "__main__":
+    perf = PerfTiming()
+    perf.add(test_xml_codec, test_marshal_codec)
+    print_sizes()
+    perf.main()
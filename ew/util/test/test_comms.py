@@ -0,0 +1,461 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import marshal, os, shutil, socket, stat, tempfile, threading, time, unittest
+from xmlrpclib import DateTime, Fault, ProtocolError, ServerProxy
+from SimpleXMLRPCServer import SimpleXMLRPCServer
+from ew.util import comms, rpc_stats
+
+def start_server(**kwargs):
+    server = comms.create_threaded_server(0, server_ip='127.0.0.1', **kwargs)
+    server.register_function(lambda x, y: x + y, 'add')
+    server.register_function(lambda: 1 // 0, 'fail')
+    thread = comms.ServerThread('test-server', server)
+    thread.start()
+    return server
+
+class TestPooledClient(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server()
+        self.port = self.server.server_address[1]
+        self.pool = comms.ConnectionPool(max_idle=2)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, pool=None):
+        return comms.ServerProxy('http://127.0.0.1:%d' % self.port,
+                           comms.PooledTransport(pool or self.pool),
+                           allow_none=True)
+
+    def test_connection_reused(self):
+        client = self.client()
+        for n in range(20):
+            self.assertEqual(client.add(n, 1), n + 1)
+        stats = self.pool.stats()
+        self.assertEqual((stats['created'], stats['reused'], stats['idle']),
+                         (1, 19, 1))
+
+    def test_fault_keeps_connection(self):
+        client = self.client()
+        self.assertRaises(Fault, client.fail)
+        self.assertEqual(client.add(1, 2), 3)
+        self.assertEqual(self.pool.stats()['created'], 1)
+
+    def test_threads_share_client(self):
+        client = self.client()
+        results = []
+        def calls(base):
+            for n in range(50):
+                results.append(client.add(base, n) == base + n)
+        threads = [threading.Thread(target=calls, args=(b,))
+                   for b in range(0, 500, 100)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [True] * 250)
+        self.assertTrue(self.pool.stats()['idle'] <= 2)
+
+    def test_server_closed_idle_connection(self):
+        client = self.client()
+        timeout = comms.KeepAliveRequestHandler.timeout
+        comms.KeepAliveRequestHandler.timeout = 0.1
+        try:
+            self.assertEqual(client.add(1, 2), 3)
+            time.sleep(0.3)     # the server times the connection out
+            self.assertEqual(client.add(2, 2), 4)
+        finally:
+            comms.KeepAliveRequestHandler.timeout = timeout
+        stats = self.pool.stats()
+        self.assertEqual((stats['created'], stats['reused']), (2, 1))
+
+    def test_server_without_keep_alive(self):
+        server = start_server(keep_alive=False)
+        try:
+            pool = comms.ConnectionPool()
+            client = comms.ServerProxy('http://127.0.0.1:%d' %
+                                       server.server_address[1],
+                                       comms.PooledTransport(pool))
+            self.assertEqual([client.add(n, n) for n in range(3)], [0, 2, 4])
+            self.assertEqual(pool.stats()['idle'], 0)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+class TestUnixSocket(unittest.TestCase):
+    def setUp(self):
+        self.socket_dir = comms.RPC_SOCKET_DIR
+        comms.RPC_SOCKET_DIR = tempfile.mkdtemp()
+        self.pool = comms.ConnectionPool()
+        self.servers = []
+
+    def tearDown(self):
+        self.pool.clear()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(comms.RPC_SOCKET_DIR)
+        comms.RPC_SOCKET_DIR = self.socket_dir
+
+    def start(self, **kwargs):
+        server = start_server(**kwargs)
+        self.servers.append(server)
+        return server
+
+    def client(self, port):
+        return comms.ServerProxy('http://localhost:%d' % port,
+                comms.PooledTransport(self.pool,
+                                      socket_path=comms.rpc_socket_path(port)))
+
+    def test_unix_only(self):
+        server = self.start(listen=comms.LISTEN_UNIX)
+        path = comms.rpc_socket_path(0)
+        self.assertEqual(server.server_address, path)
+        self.assertEqual(self.client(0).add(1, 2), 3)
+        self.assertRaises(Fault, self.client(0).fail)
+        self.assertEqual(self.pool.stats()['created'], 1)
+        self.servers.remove(server)
+        server.shutdown()
+        server.server_close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_both(self):
+        """One set of functions served on both sockets"""
+        server = self.start(listen=comms.LISTEN_BOTH)
+        port = server.server_address[1]
+        self.assertTrue(os.path.exists(comms.rpc_socket_path(port)))
+        server.register_function(lambda: 'late', 'late')
+        self.assertEqual(self.client(port).late(), 'late')
+        connection = self.pool.checkout('localhost:%d' % port)[0]
+        self.assertTrue(isinstance(connection, comms.UnixConnection))
+        connection.close()
+        tcp = comms.ServerProxy('http://127.0.0.1:%d' % port,
+                                comms.PooledTransport(self.pool))
+        self.assertEqual(tcp.add(2, 2), 4)
+        self.assertEqual(tcp.late(), 'late')
+
+    def test_falls_back_to_tcp(self):
+        server = self.start()
+        port = server.server_address[1]
+        self.assertEqual(self.client(port).add(3, 4), 7)
+        connection = self.pool.checkout('localhost:%d' % port)[0]
+        self.assertTrue(isinstance(connection, comms.TCPConnection))
+        connection.close()
+
+    def test_stale_socket_replaced(self):
+        path = comms.rpc_socket_path(0)
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        self.start(listen=comms.LISTEN_UNIX)
+        self.assertEqual(self.client(0).add(1, 1), 2)
+        # but not one a live server listens on
+        self.assertRaises(socket.error, start_server, listen=comms.LISTEN_UNIX)
+        self.assertTrue(os.path.exists(path))
+
+    def test_private_sockets(self):
+        os.rmdir(comms.RPC_SOCKET_DIR)
+        self.start(listen=comms.LISTEN_UNIX)
+        mode = lambda path: stat.S_IMODE(os.stat(path).st_mode)
+        self.assertEqual(mode(comms.RPC_SOCKET_DIR), 0700)
+        self.assertEqual(mode(comms.rpc_socket_path(0)), 0600)
+        # a directory others could enter is closed to them
+        os.chmod(comms.RPC_SOCKET_DIR, 0777)
+        self.assertEqual(comms.private_socket_dir(comms.RPC_SOCKET_DIR),
+                         comms.RPC_SOCKET_DIR)
+        self.assertEqual(mode(comms.RPC_SOCKET_DIR), 0700)
+        # and a socket path that is not a directory of ours refused
+        other = os.path.join(comms.RPC_SOCKET_DIR, 'link')
+        os.symlink(tempfile.gettempdir(), other)
+        self.assertRaises(socket.error, comms.private_socket_dir, other)
+
+class TestMarshalCodec(unittest.TestCase):
+    def setUp(self):
+        self.socket_dir = comms.RPC_SOCKET_DIR
+        comms.RPC_SOCKET_DIR = tempfile.mkdtemp()
+        self.server = start_server(listen=comms.LISTEN_BOTH)
+        self.server.register_function(lambda *args: args, 'echo')
+        self.port = self.server.server_address[1]
+        self.pool = comms.ConnectionPool()
+        self.transport = comms.PooledTransport(self.pool,
+                socket_path=comms.rpc_socket_path(self.port))
+        self.client = comms.RPCProxy('http://localhost:%d' % self.port,
+                                     self.transport, allow_none=True)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(comms.RPC_SOCKET_DIR)
+        comms.RPC_SOCKET_DIR = self.socket_dir
+
+    def connection(self, host='localhost'):
+        host = '%s:%d' % (host, self.port)
+        connection = self.pool.checkout(host)[0]
+        self.pool.checkin(host, connection)
+        return connection
+
+    def test_tcp_is_xml(self):
+        """Any local user may connect over TCP: no marshal there"""
+        client = comms.RPCProxy('http://127.0.0.1:%d' % self.port,
+                                comms.PooledTransport(self.pool))
+        for n in range(3):
+            self.assertEqual(client.echo(n), [n])
+        self.assertFalse(self.connection('127.0.0.1').codec)
+
+    def test_other_user_is_xml(self):
+        """Neither end takes marshal data from a peer of another uid"""
+        peer_uid = comms.peer_uid
+        comms.peer_uid = lambda sock: os.getuid() + 1
+        try:
+            for n in range(3):
+                self.assertEqual(self.client.echo(n), [n])
+            self.assertFalse(self.connection().codec)
+        finally:
+            comms.peer_uid = peer_uid
+
+    def test_untrusted_marshal_response(self):
+        """A marshal response from a server of another uid is refused"""
+        class Response(object):
+            status, reason, msg, will_close = 200, 'OK', {}, False
+            def getheader(self, name, default=None):
+                return {'Content-Type': comms.MARSHAL_CONTENT_TYPE,
+                        comms.CODEC_HEADER: comms.MARSHAL_CODEC}.get(name,
+                                                                     default)
+            def read(self):
+                return marshal.dumps((False, 'unchecked'))
+        class Connection(object):
+            sock, trusted, closed = object(), False, False
+            def putrequest(self, *args): pass
+            putheader = endheaders = send = putrequest
+            def getresponse(self, buffering=False):
+                return Response()
+            def close(self):
+                self.closed = True
+        connection = Connection()
+        self.assertRaises(ProtocolError, self.transport._request, connection,
+                          'localhost', '/RPC2', 'body', 0)
+        self.assertFalse(connection.codec)
+        connection.trusted = True
+        self.assertEqual(self.transport._request(connection, 'localhost',
+                                                 '/RPC2', 'body', 0)[0],
+                         ('unchecked',))
+
+    def test_negotiated(self):
+        """The first call is XML; the server accepts marshal for the rest"""
+        self.assertEqual(self.client.echo(1, 'a'), [1, 'a'])
+        self.assertEqual(self.connection().codec, comms.MARSHAL_CODEC)
+        self.assertEqual(self.client.echo(1, 'a'), [1, 'a'])
+        self.assertEqual(self.pool.stats()['created'], 1)
+
+    def test_same_types_as_xml(self):
+        """The first call (XML) and later ones (marshal) return equal
+        values of equal types"""
+        self.server.register_function(
+                lambda *args: [(type(a).__name__, a) for a in args], 'types')
+        args = ({'a': (1, 2)}, u'ascii', 'caf\xc3\xa9', [(None, True)], 1.5)
+        first = self.client.types(*args)
+        self.assertEqual(self.connection().codec, comms.MARSHAL_CODEC)
+        later = self.client.types(*args)
+        def types(value):
+            if isinstance(value, (list, tuple)):
+                return [type(value)] + [types(v) for v in value]
+            if isinstance(value, dict):
+                return [dict] + [types(v) for v in value.items()]
+            return type(value)
+        self.assertEqual(later, first)
+        self.assertEqual(types(later), types(first))
+        self.assertEqual(first[0], ['dict', {'a': [1, 2]}])
+        self.assertEqual(first[2], ['unicode', u'caf\xe9'])
+
+    def test_faults(self):
+        self.client.add(1, 1)
+        self.assertRaises(Fault, self.client.fail)
+        try:
+            self.client.missing()
+        except Fault, fault:
+            self.assertTrue('missing' in fault.faultString)
+        else:
+            self.fail('no Fault')
+        self.assertEqual(self.client.add(2, 3), 5)
+
+    def test_falls_back_to_xml(self):
+        """Values marshal cannot send go as XML, either way"""
+        self.client.add(1, 1)
+        when = DateTime('20111011T12:00:00')
+        self.assertEqual(self.client.echo(when), [when])
+        self.server.register_function(lambda: when, 'when')
+        self.assertEqual(self.client.when(), when)
+
+    def test_old_client(self):
+        """A ServerProxy on the pooled transport still gets XML back"""
+        client = ServerProxy('http://127.0.0.1:%d' % self.port,
+                             self.transport)
+        for n in range(3):
+            self.assertEqual(client.echo(n), [n])
+
+    def test_old_server(self):
+        """A server without the codec gets XML calls"""
+        server = SimpleXMLRPCServer(('127.0.0.1', 0), logRequests=False)
+        server.register_function(lambda x, y: x + y, 'add')
+        comms.ServerThread('old-server', server).start()
+        try:
+            client = comms.RPCProxy('http://127.0.0.1:%d' %
+                                    server.server_address[1], self.transport)
+            self.assertEqual([client.add(n, n) for n in range(3)], [0, 2, 4])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+class SmallPoolServer(comms.ErrorLoggingPooledXMLRPCServer):
+    workers = 2
+    max_queued = 1
+    queue_timeout = 0.2
+
+class TestPooledServer(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server(server_class=SmallPoolServer)
+        self.port = self.server.server_address[1]
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self):
+        """A client with a connection of its own"""
+        self.pools.append(comms.ConnectionPool())
+        return comms.RPCProxy('http://127.0.0.1:%d' % self.port,
+                              comms.PooledTransport(self.pools[-1]))
+
+    def wait_for(self, predicate, timeout=2):
+        end = time.time() + timeout
+        while not predicate() and time.time() < end:
+            time.sleep(0.01)
+        self.assertTrue(predicate())
+
+    def test_workers(self):
+        names = set()
+        def name():
+            time.sleep(0.01)
+            names.add(threading.currentThread().getName())
+        self.server.register_function(name)
+        clients = [self.client() for n in range(6)]
+        threads = [threading.Thread(target=lambda c=c: c.name())
+                   for c in clients]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertTrue(0 < len(names) <= 2, names)
+        self.assertEqual(self.server.rpc_stats.as_dict()['name']['calls'], 6)
+
+    def test_idle_connections_hold_no_worker(self):
+        clients = [self.client() for n in range(5)]
+        for n, client in enumerate(clients):
+            self.assertEqual(client.add(n, 1), n + 1)
+        self.wait_for(lambda: self.server.stats()['idle'] == 5)
+        self.assertEqual(self.server.stats()['busy'], 0)
+        self.assertEqual([c.add(1, 1) for c in clients], [2] * 5)
+        self.assertEqual(sum(p.stats()['created'] for p in self.pools), 5)
+
+    def test_idle_timeout(self):
+        timeout = comms.KeepAliveRequestHandler.timeout
+        comms.KeepAliveRequestHandler.timeout = 0.1
+        try:
+            client = self.client()
+            client.add(1, 1)
+            self.wait_for(lambda: self.server.stats()['idle'] == 0)
+            self.assertEqual(client.add(2, 2), 4)
+        finally:
+            comms.KeepAliveRequestHandler.timeout = timeout
+
+    def test_backpressure(self):
+        release = threading.Event()
+        self.server.register_function(lambda: release.wait(2) or True,
+                                      'block')
+        blocked = [threading.Thread(target=lambda c=self.client(): c.block())
+                   for n in range(2)]
+        for t in blocked:
+            t.start()
+        self.wait_for(lambda: self.server.stats()['busy'] == 2)
+        client = self.client()
+        waiting = threading.Thread(target=lambda: client.add(1, 1))
+        waiting.start()     # queued
+        self.wait_for(lambda: self.server.stats()['queued'] == 1)
+        self.assertRaises((socket.error, comms.httplib.HTTPException),
+                          self.client().add, 1, 1)
+        self.assertEqual(self.server.stats()['rejected'], 1)
+        release.set()
+        for t in blocked + [waiting]:
+            t.join()
+
+class TestRPCStats(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server()
+        self.port = self.server.server_address[1]
+        self.pool = comms.ConnectionPool()
+        rpc_stats.client_stats.reset()
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, port=None):
+        return comms.RPCProxy('http://127.0.0.1:%d' % (port or self.port),
+                              comms.PooledTransport(self.pool))
+
+    def test_stats_rpc(self):
+        client = self.client()
+        for n in range(5):
+            client.add(n, 1)
+        self.assertRaises(Fault, client.fail)
+        stats = getattr(client, '__stats__')()
+        add = stats['server']['add']
+        self.assertEqual((add['calls'], add['errors']), (5, 0))
+        self.assertEqual(stats['server']['fail']['errors'], 1)
+        self.assertTrue(add['request_bytes'] > 0 and add['response_bytes'] > 0)
+        self.assertTrue(add['latency']['p95'] >= add['latency']['p50'])
+        self.assertEqual(stats['pools'][0]['workers'], comms.RPC_WORKERS)
+        # the process of the test is the client too
+        client_add = stats['client']['127.0.0.1:%d add' % self.port]
+        self.assertEqual((client_add['calls'], client_add['errors']), (5, 0))
+        self.assertEqual(client_add['request_bytes'], add['request_bytes'])
+
+    def test_large_byte_counts(self):
+        """Byte counts past what XML-RPC integers hold"""
+        self.server.rpc_stats.record('big', 0.001, request_bytes=2 ** 40,
+                                     response_bytes=3 * 2 ** 31)
+        big = getattr(self.client(), '__stats__')()['server']['big']
+        self.assertEqual((big['request_bytes'], big['response_bytes']),
+                         (2 ** 40, 3 * 2 ** 31))
+
+    def test_trace_propagated(self):
+        """A call made while serving a call carries its trace id"""
+        other = start_server()
+        try:
+            other.register_function(rpc_stats.trace_id, 'trace')
+            inner = self.client(other.server_address[1])
+            self.server.register_function(
+                    lambda: [rpc_stats.trace_id(), inner.trace()], 'both')
+            outer, nested = self.client().both()
+            self.assertEqual(outer, nested)
+            with rpc_stats.tracing('sync.1') as trace:
+                self.assertEqual(self.client().both(), [trace, trace])
+            self.assertNotEqual(self.client().both()[0], outer)
+        finally:
+            other.shutdown()
+            other.server_close()
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(TestPooledClient),
+        unittest.TestLoader().loadTestsFromTestCase(TestUnixSocket),
+        unittest.TestLoader().loadTestsFromTestCase(TestMarshalCodec),
+        unittest.TestLoader().loadTestsFromTestCase(TestPooledServer),
+        unittest.TestLoader().loadTestsFromTestCase(TestRPCStats)])
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,80 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import random, threading, unittest
+from Queue import Empty
+from ew.util.editable_queue import EditableQueue
+
+def event(name, n):
+    return name, (n,)
+
+def drain(queue):
+    items = []
+    while True:
+        try:
+            items.append(queue.get(False))
+        except Empty:
+            return items
+
+class TestEditableQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = EditableQueue()
+
+    def test_priority_then_fifo(self):
+        q = self.queue
+        for n in range(5):
+            q.put(event('normal', n))
+            q.put(event('high', n), q.Priority_High)
+        q.put(event('immediate', 0), q.Priority_Immediate)
+        self.assertEqual(drain(q), [event('immediate', 0)] +
+                         [event('high', n) for n in range(5)] +
+                         [event('normal', n) for n in range(5)])
+        self.assertRaises(Empty, q.get, True, 0.01)
+
+    def test_remove(self):
+        q = self.queue
+        for n in range(20):
+            q.put(event('e', n), random.choice((1, 5, 9)), key=n)
+        self.assertRaises(KeyError, q.put, event('e', 3), key=3)
+        for n in range(0, 20, 3):
+            self.assertEqual(q.remove(n), event('e', n))
+        self.assertEqual(q.remove(0), None)
+        self.assertEqual(q.remove_all(lambda f, args: args[0] % 2), 7)
+        left = drain(q)
+        self.assertEqual(sorted(left),
+                         [event('e', n) for n in (2, 4, 8, 10, 14, 16)])
+        stats = q.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['removed'], 14)
+        self.assertEqual(sum(stats['put'].values()), 20)
+        self.assertEqual(sum(stats['queued'].values()), 0)
+        # keys are free again once their items are gone
+        q.put(event('e', 2), key=2)
+        self.assertEqual(q.remove_all(), 1)
+
+    def test_order_kept_through_removals(self):
+        q = self.queue
+        rnd = random.Random(7)
+        expected = []
+        for n in range(300):
+            priority = rnd.choice((0, 1, 5, 9))
+            q.put(event('e', n), priority, key=n)
+            expected.append((priority, n))
+        for n in rnd.sample(range(300), 100):
+            q.remove(n)
+            expected.remove([e for e in expected if e[1] == n][0])
+        q.remove_all(lambda f, args: args[0] % 7 == 0)
+        expected = [e for e in expected if e[1] % 7]
+        self.assertEqual(drain(q), [event('e', n) for p, n in sorted(expected)])
+
+    def test_remove_all_while_waiting(self):
+        q = self.queue
+        got = []
+        getter = threading.Thread(target=lambda: got.append(q.get()))
+        getter.start()
+        q.remove_all(lambda f, args: True)
+        q.put(event('e', 1))
+        getter.join(5)
+        self.assertEqual(got, [event('e', 1)])
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestEditableQueue)
+    unittest.TextTestRunner(verbosity=2).run(suite)
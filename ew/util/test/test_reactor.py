@@ -0,0 +1,97 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import socket, threading, time, unittest
+from ew.util import reactor
+
+class TestReactor(unittest.TestCase):
+    use_epoll = reactor.EPOLL_EXISTS
+
+    def setUp(self):
+        self.reactor = reactor.Reactor('test-reactor', self.use_epoll)
+        self.pairs = []
+
+    def tearDown(self):
+        self.reactor.close()
+        for a, b in self.pairs:
+            a.close()
+            b.close()
+
+    def pair(self):
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.pairs.append((a, b))
+        return a, b
+
+    def test_dispatch(self):
+        received = []
+        a1, b1 = self.pair()
+        a2, b2 = self.pair()
+        self.reactor.register(b1, lambda s: received.append((1, s.recv(10))))
+        self.reactor.register(b2, lambda s: received.append((2, s.recv(10))))
+        a2.send('two')
+        self.reactor.run_once(1)
+        a1.send('one')
+        self.reactor.run_once(1)
+        self.assertEqual(received, [(2, 'two'), (1, 'one')])
+        self.reactor.run_once(0)
+        self.assertEqual(len(received), 2)
+
+    def test_unregister(self):
+        received = []
+        a, b = self.pair()
+        self.reactor.register(b, lambda s: received.append(s.recv(10)))
+        self.assertRaises(ValueError, self.reactor.register, b, None)
+        self.reactor.unregister(b)
+        self.assertFalse(self.reactor.is_registered(b))
+        a.send('x')
+        self.reactor.run_once(0.05)
+        self.assertEqual(received, [])
+
+    def test_failing_handler_is_unregistered(self):
+        a, b = self.pair()
+        def fail(s):
+            raise RuntimeError('handler failed')
+        self.reactor.register(b, fail)
+        a.send('x')
+        self.reactor.run_once(1)
+        self.assertFalse(self.reactor.is_registered(b))
+
+    def test_timers(self):
+        calls = []
+        self.reactor.call_later(0.02, calls.append, 2)
+        self.reactor.call_later(0.01, calls.append, 1)
+        self.reactor.call_later(0.01, calls.append, 'cancelled').cancel()
+        self.reactor.call_soon(calls.append, 0)
+        start = time.time()
+        while len(calls) < 3 and time.time() - start < 2:
+            self.reactor.run_once(1)
+        self.assertEqual(calls, [0, 1, 2])
+        self.assertTrue(time.time() - start < 1)
+
+    def test_thread(self):
+        """Registration from another thread wakes a running reactor"""
+        received = threading.Event()
+        self.reactor.start()
+        try:
+            time.sleep(0.05)
+            a, b = self.pair()
+            self.reactor.register(b, lambda s: s.recv(10) and received.set())
+            a.send('x')
+            received.wait(2)
+            self.assertTrue(received.isSet())
+            done = threading.Event()
+            self.reactor.call_soon(done.set)
+            done.wait(2)
+            self.assertTrue(done.isSet())
+            self.assertEqual(self.reactor.run_in_worker(
+                    lambda: threading.currentThread().getName()).result(2),
+                    'test-reactor-worker-0')
+        finally:
+            self.reactor.close()
+
+class TestPollReactor(TestReactor):
+    use_epoll = False
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(TestReactor),
+        unittest.TestLoader().loadTestsFromTestCase(TestPollReactor)])
+    unittest.TextTestRunner(verbosity=2).run(suite)
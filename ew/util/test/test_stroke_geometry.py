@@ -0,0 +1,72 @@
+# Copyright 2011 Ricoh Innovations, Inc.
+import random, unittest
+from ew.util import stroke_geometry as sg
+
+def reference_overlap(points1, points2, t):
+    """segment box test as Strokes.stroke_intersects has always done it"""
+    for i in range(len(points1)-1):
+        ix0, iy0 = points1[i]
+        ix1, iy1 = points1[i+1]
+        if ix0 > ix1: ix0, ix1 = ix1, ix0
+        if iy0 > iy1: iy0, iy1 = iy1, iy0
+        for j in range(len(points2)-1):
+            jx0, jy0 = points2[j]
+            jx1, jy1 = points2[j+1]
+            if jx0 > jx1: jx0, jx1 = jx1, jx0
+            if jy0 > jy1: jy0, jy1 = jy1, jy0
+            if not (ix1 < jx0 - t or ix0 > jx1 + t or
+                    iy1 < jy0 - t or iy0 > jy1 + t):
+                return True
+    return False
+
+def random_points(rnd, n):
+    x, y = rnd.randrange(400), rnd.randrange(400)
+    points = []
+    for k in range(n):
+        x += rnd.randrange(-20, 21)
+        y += rnd.randrange(-20, 21)
+        points.append((x, y))
+    return points
+
+KERNELS = [(sg._bbox_py, sg._segments_overlap_py, sg._any_point_in_rect_py)]
+if sg.NUMPY_EXISTS:
+    KERNELS.append((sg._bbox_numpy, sg._segments_overlap_numpy,
+                    sg._any_point_in_rect_numpy))
+
+class TestStrokeGeometry(unittest.TestCase):
+    def test_geometry(self):
+        g = sg.StrokeGeometry([(3, 4), (1, 9)])
+        self.assertEqual(g.bbox(), (1, 4, 3, 9))
+        g.extend([(7, -2)])
+        self.assertEqual(len(g), 3)
+        self.assertEqual(g.points(), [(3, 4), (1, 9), (7, -2)])
+        self.assertEqual(g.bbox(), (1, -2, 7, 9))
+        self.assertEqual(list(g.iter_segment_boxes()),
+                         [(1, 4, 3, 9), (1, -2, 7, 9)])
+        g.extend([(0.5, 1)])
+        self.assertEqual(g.xs.typecode, 'd')
+        self.assertEqual(g.bbox(), (0.5, -2, 7, 9))
+        self.assertEqual(sg.geometry_of({'strokes': [(1, 1)]}).points(),
+                         [(1, 1)])
+
+    def test_kernels_agree_with_reference(self):
+        rnd = random.Random(3)
+        for n in range(400):
+            points1 = random_points(rnd, rnd.randrange(1, 12))
+            points2 = random_points(rnd, rnd.randrange(1, 12))
+            g1, g2 = sg.StrokeGeometry(points1), sg.StrokeGeometry(points2)
+            t = rnd.choice((-5, 0, 5, 30))
+            x0, y0 = rnd.randrange(400), rnd.randrange(400)
+            rect = x0, y0, x0 + rnd.randrange(100), y0 + rnd.randrange(100)
+            in_rect = [p for p in points1 if sg.point_in_rect(*(p + rect))]
+            for bbox, overlap, any_in_rect in KERNELS:
+                self.assertEqual(bbox(g1), (min(x for x, y in points1),
+                        min(y for x, y in points1), max(x for x, y in points1),
+                        max(y for x, y in points1)))
+                self.assertEqual(overlap(g1, g2, t),
+                                 reference_overlap(points1, points2, t))
+                self.assertEqual(any_in_rect(g1, *rect), bool(in_rect))
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStrokeGeometry)
+    unittest.TextTestRunner(verbosity=2).run(suite)
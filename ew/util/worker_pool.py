@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright 2011 Ricoh Innovations, Inc.
+"""Fixed size pool of worker threads.
+
+Useful for work that releases the GIL (zlib, hashlib, file and socket I/O,
+waiting on subprocesses), where a few threads overlap nicely without the
+cost of a thread per task.
+"""
+
+from __future__ import with_statement
+
+import sys
+import threading
+import Queue
+from collections import deque
+
+import ew_logging
+
+logger = ew_logging.getLogger('ew.util.worker_pool')
+
+__all__ = "WorkerPool", "Future"
+
+class Future(object):
+    """The eventual result of a task submitted to a WorkerPool."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._done.set()
+
+    def done(self):
+        return self._done.isSet()
+
+    def result(self, timeout=None):
+        """Wait for the task and return its result, re-raising any exception
+        it raised. Raises WorkerPool.Timeout if timeout seconds pass first.
+
+        """
+        self._done.wait(timeout)
+        if not self._done.isSet():
+            raise WorkerPool.Timeout()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class WorkerPool(object):
+    """A fixed number of daemon threads running submitted tasks in order of
+    submission.
+
+    """
+
+    class Timeout(Exception):
+        """Raised by Future.result when the result is not ready in time."""
+
+    _stop = object()
+
+    def __init__(self, workers, name='worker'):
+        self.workers = max(1, workers)
+        self._tasks = Queue.Queue()
+        self._threads = []
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._run,
+                                      name='%s-%d' % (name, n))
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) and return its Future."""
+        future = Future()
+        self._tasks.put((future, func, args, kwargs))
+        return future
+
+    def imap(self, func, iterable, window=None):
+        """Like itertools.imap, but func runs on the pool. Results are
+        yielded in order, and at most "window" (default twice the number of
+        workers) items are in flight or waiting to be consumed.
+
+        """
+        window = window or 2 * self.workers
+        pending = deque()
+        for item in iterable:
+            pending.append(self.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        """Stop the worker threads once the queued tasks are done."""
+        for _ in self._threads:
+            self._tasks.put(self._stop)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is self._stop:
+                return
+            future, func, args, kwargs = task
+            try:
+                future.set_result(func(*args, **kwargs))
+            except:
+                future.set_exception(sys.exc_info())